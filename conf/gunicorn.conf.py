@@ -0,0 +1,19 @@
+# Gunicorn settings for namesdb-public
+# gunicorn -c /opt/namesdb-public/conf/gunicorn.conf.py namessite.wsgi:application
+
+bind = '127.0.0.1:8000'
+workers = 4
+timeout = 60
+
+def when_ready(server):
+    # Read the warmup targets from the access logs once, in the arbiter;
+    # workers forked afterwards inherit them.
+    from namesdb_public import warmup
+    warmup.when_ready(server)
+
+def post_fork(server, worker):
+    # Fetch the most requested records and searches (see [warmup] in
+    # namesdbpublic.cfg) before this worker accepts connections, for at
+    # most half of timeout so that gunicorn does not kill the worker.
+    from namesdb_public import warmup
+    warmup.post_fork(server, worker)
@@ -0,0 +1,62 @@
+"""Read web server access logs (nginx/Apache "combined" format)
+
+Used by the load test and cache warmup commands to replay realistic
+request distributions.
+
+    >>> from namesdb_public import accesslog
+    >>> for entry in accesslog.entries('/var/log/nginx/access.log.gz'):
+    ...     print(entry['status'], entry['path'])
+"""
+import gzip
+import re
+from urllib.parse import parse_qs, urlsplit
+
+COMBINED = re.compile(
+    r'(?P<remote_addr>\S+) \S+ (?P<remote_user>\S+) \[(?P<time>[^\]]+)\] '
+    r'"(?P<method>[A-Z]+) (?P<path>\S+) [^"]*" (?P<status>\d{3}) (?P<bytes>\S+)'
+    r'(?: "(?P<referer>[^"]*)" "(?P<user_agent>[^"]*)")?'
+)
+
+
+def _open(path):
+    if str(path).endswith('.gz'):
+        return gzip.open(path, 'rt', errors='replace')
+    return open(path, 'r', errors='replace')
+
+def parse(line):
+    """Parse one log line
+
+    @param line: str
+    @returns: dict or None if line is not in combined format
+    """
+    m = COMBINED.match(line)
+    if not m:
+        return None
+    entry = m.groupdict()
+    entry['status'] = int(entry['status'])
+    url = urlsplit(entry['path'])
+    entry['url_path'] = url.path
+    entry['query'] = parse_qs(url.query)
+    return entry
+
+def entries(paths, methods=['GET'], statuses=[200]):
+    """Successful requests from one or more log files
+
+    @param paths: str or list of str (.gz files are decompressed)
+    @param methods: list HTTP methods to include
+    @param statuses: list HTTP statuses to include (empty list: all)
+    @returns: generator of dicts (see parse)
+    """
+    if isinstance(paths, str):
+        paths = [paths]
+    for path in paths:
+        with _open(path) as f:
+            for line in f:
+                entry = parse(line)
+                if not entry:
+                    continue
+                if methods and entry['method'] not in methods:
+                    continue
+                if statuses and entry['status'] not in statuses:
+                    continue
+                yield entry
@@ -0,0 +1,296 @@
+"""Admission control: keep bursts of traffic from overwhelming Elasticsearch
+
+Elasticsearch calls are admitted through one of three gates with separate
+budgets:
+
+    lookup  es.get and the small filter searches on detail pages
+    search  searches with aggregations (search UI, search and list APIs)
+    batch   batch name matching msearches (see batchmatch), so that a big
+            upload queues behind other uploads rather than taking the
+            search slots
+
+Each gate limits concurrent calls per worker process and optionally per host
+(all workers on the machine share slot files in settings.ADMISSION_LOCK_DIR,
+locked with flock so a dead worker's slots are freed by the kernel).  Calls
+that find the gate full wait in a bounded queue; if the queue is full or the
+wait exceeds settings.ADMISSION_TIMEOUT, Overloaded is raised and
+middleware.AdmissionMiddleware answers 503 with a Retry-After header.
+
+    with admission.admit('search'):
+        response = s.execute()
+
+The middleware also applies per-client token buckets (RateLimiter), keyed by
+API key or client IP.  Clients over their limit get 429 with Retry-After.
+"""
+from collections import OrderedDict
+from contextlib import asynccontextmanager, contextmanager
+import asyncio
+import fcntl
+import os
+from pathlib import Path
+import threading
+import time
+
+from django.conf import settings
+
+from . import metrics
+
+GATES = ['lookup', 'search', 'batch']
+# Seconds between attempts while waiting for a slot
+POLL_INTERVAL = 0.01
+# Clients remembered by RateLimiter (least recently seen are dropped)
+MAX_CLIENTS = 10000
+
+
+def enabled():
+    return getattr(settings, 'ADMISSION_ENABLED', False)
+
+
+class Overloaded(Exception):
+    """No capacity for an Elasticsearch call; the request should be retried later
+    """
+
+    def __init__(self, gate, reason):
+        self.gate = gate
+        self.reason = reason
+        super().__init__(f'{gate} gate: {reason}')
+
+
+class Gate():
+    """Concurrency limit with a bounded wait queue
+
+    @param name: str
+    @param limit: int Concurrent calls in this process
+    @param host_limit: int Concurrent calls on this host (0: no host limit)
+    @param queue: int Max calls waiting in this process
+    @param lock_dir: str Directory for the host slot files
+    """
+
+    def __init__(self, name, limit, host_limit=0, queue=0, lock_dir=None):
+        self.name = name
+        self.semaphore = threading.BoundedSemaphore(limit)
+        self.queue = queue
+        self.waiting = 0
+        self.lock = threading.Lock()
+        self.slots = []
+        if host_limit:
+            Path(lock_dir).mkdir(parents=True, exist_ok=True)
+            self.slots = [
+                str(Path(lock_dir) / f'{name}-{n}.lock') for n in range(host_limit)
+            ]
+
+    def __repr__(self):
+        return f'<Gate {self.name} waiting:{self.waiting}>'
+
+    def try_acquire(self):
+        """Take a slot if one is free
+
+        @returns: token for release(), or None
+        """
+        if not self.semaphore.acquire(blocking=False):
+            return None
+        if not self.slots:
+            return -1
+        # start at a different slot in each process to spread contention
+        start = os.getpid() % len(self.slots)
+        for path in self.slots[start:] + self.slots[:start]:
+            fd = os.open(path, os.O_RDWR | os.O_CREAT, 0o666)
+            try:
+                fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+                return fd
+            except BlockingIOError:
+                os.close(fd)
+        self.semaphore.release()
+        return None
+
+    def release(self, token):
+        if token >= 0:
+            fcntl.flock(token, fcntl.LOCK_UN)
+            os.close(token)
+        self.semaphore.release()
+
+    def _enqueue(self):
+        with self.lock:
+            if self.waiting >= self.queue:
+                raise _rejected(self.name, 'queue')
+            self.waiting += 1
+
+    def _dequeue(self):
+        with self.lock:
+            self.waiting -= 1
+
+    def acquire(self, timeout):
+        """Wait up to TIMEOUT seconds for a slot
+
+        @returns: token for release()
+        @raises: Overloaded
+        """
+        token = self.try_acquire()
+        if token is not None:
+            return token
+        self._enqueue()
+        try:
+            deadline = time.monotonic() + timeout
+            while time.monotonic() < deadline:
+                time.sleep(POLL_INTERVAL)
+                token = self.try_acquire()
+                if token is not None:
+                    return token
+            raise _rejected(self.name, 'timeout')
+        finally:
+            self._dequeue()
+
+    async def aacquire(self, timeout):
+        """Async version of acquire; waits without blocking the event loop
+        """
+        token = self.try_acquire()
+        if token is not None:
+            return token
+        self._enqueue()
+        try:
+            deadline = time.monotonic() + timeout
+            while time.monotonic() < deadline:
+                await asyncio.sleep(POLL_INTERVAL)
+                token = self.try_acquire()
+                if token is not None:
+                    return token
+            raise _rejected(self.name, 'timeout')
+        finally:
+            self._dequeue()
+
+
+def _rejected(gate, reason):
+    metrics.inc('namesdb_admission_rejected_total', gate=gate, reason=reason)
+    return Overloaded(gate, reason)
+
+
+_gates = {}
+_gates_lock = threading.Lock()
+
+def gate(name):
+    """Per-process Gate configured from settings
+
+    @param name: str 'lookup', 'search', or 'batch'
+    @returns: Gate
+    """
+    config = (
+        getattr(settings, f'ADMISSION_{name.upper()}_CONCURRENCY'),
+        getattr(settings, f'ADMISSION_HOST_{name.upper()}_CONCURRENCY'),
+        settings.ADMISSION_QUEUE,
+        settings.ADMISSION_LOCK_DIR,
+    )
+    with _gates_lock:
+        if (name,config) not in _gates:
+            _gates[(name,config)] = Gate(name, *config)
+        return _gates[(name,config)]
+
+@contextmanager
+def admit(name):
+    """Hold a slot in gate NAME for the duration of the block
+
+    @param name: str 'lookup', 'search', or 'batch'
+    @raises: Overloaded
+    """
+    if not enabled():
+        yield
+        return
+    g = gate(name)
+    token = g.acquire(settings.ADMISSION_TIMEOUT)
+    try:
+        yield
+    finally:
+        g.release(token)
+
+@asynccontextmanager
+async def aadmit(name):
+    """Async version of admit"""
+    if not enabled():
+        yield
+        return
+    g = gate(name)
+    token = await g.aacquire(settings.ADMISSION_TIMEOUT)
+    try:
+        yield
+    finally:
+        g.release(token)
+
+
+# per-client rate limits -----------------------------------------------
+
+def ratelimit_enabled():
+    return getattr(settings, 'RATELIMIT_ENABLED', False)
+
+
+class RateLimiter():
+    """Token buckets per client
+
+    Each client may make BURST requests at once and RATE requests per second
+    on average.  Buckets are kept in this process only.
+    """
+
+    def __init__(self, rate, burst, max_clients=MAX_CLIENTS):
+        self.rate = rate
+        self.burst = burst
+        self.max_clients = max_clients
+        self.buckets = OrderedDict()  # key: (tokens, updated)
+        self.lock = threading.Lock()
+
+    def allow(self, key, rate=None, now=None):
+        """Take a token from KEY's bucket
+
+        @param key: str
+        @param rate: float Override the default rate (e.g. for API keys)
+        @param now: float time.monotonic()
+        @returns: (allowed, retry_after_seconds)
+        """
+        rate = rate or self.rate
+        now = now if now is not None else time.monotonic()
+        with self.lock:
+            tokens,updated = self.buckets.pop(key, (self.burst, now))
+            tokens = min(self.burst, tokens + (now - updated) * rate)
+            if tokens >= 1:
+                allowed,retry_after = True,0
+                tokens -= 1
+            else:
+                allowed,retry_after = False,(1 - tokens) / rate
+            self.buckets[key] = (tokens, now)
+            while len(self.buckets) > self.max_clients:
+                self.buckets.popitem(last=False)
+        return allowed,retry_after
+
+
+def client_key(request):
+    """Rate limit key and rate for a request
+
+    Known API keys (settings.RATELIMIT_API_KEYS) get their own bucket and
+    settings.RATELIMIT_API_KEY_RATE; everyone else is limited by IP.
+
+    Behind proxies (settings.RATELIMIT_FORWARDED_FOR) the IP is the
+    X-Forwarded-For entry appended by the outermost of the
+    settings.RATELIMIT_TRUSTED_PROXIES proxies, counting from the right.
+    Entries to the left of it come from the client and could be anything.
+
+    @returns: (key, rate)
+    """
+    api_key = request.headers.get(settings.RATELIMIT_API_KEY_HEADER, '')
+    if api_key and api_key in settings.RATELIMIT_API_KEYS:
+        return f'key:{api_key}',settings.RATELIMIT_API_KEY_RATE
+    ip = request.META.get('REMOTE_ADDR', '')
+    if settings.RATELIMIT_FORWARDED_FOR and request.META.get('HTTP_X_FORWARDED_FOR'):
+        forwarded = [
+            address.strip()
+            for address in request.META['HTTP_X_FORWARDED_FOR'].split(',')
+        ]
+        trusted = max(settings.RATELIMIT_TRUSTED_PROXIES, 1)
+        ip = forwarded[-min(trusted, len(forwarded))]
+    return f'ip:{ip}',settings.RATELIMIT_RATE
+
+
+_limiter = None
+
+def limiter():
+    global _limiter
+    if _limiter is None \
+    or (_limiter.rate,_limiter.burst) != (settings.RATELIMIT_RATE, settings.RATELIMIT_BURST):
+        _limiter = RateLimiter(settings.RATELIMIT_RATE, settings.RATELIMIT_BURST)
+    return _limiter
@@ -1,21 +1,60 @@
 from collections import OrderedDict
+from urllib.parse import urlencode
 
 from django.conf import settings
 
 from rest_framework import status
 from rest_framework.decorators import api_view
+from rest_framework.permissions import AllowAny
 from rest_framework.request import Request as RestRequest
 from rest_framework.response import Response
 from rest_framework.reverse import reverse
 from rest_framework.views import APIView
 
+from django.http import StreamingHttpResponse
 from django.http.request import HttpRequest
+from django.utils.cache import patch_cache_control
 
-from elastictools import docstore, search
+from elastictools import search
+from elastictools.docstore import elasticsearch_dsl as dsl
 
+from . import autocomplete as names_autocomplete
+from . import batchmatch
+from . import conditional
+from . import fieldvalues
 from . import models
+from . import namekeys
+from . import querycost
+from . import years
 
 DEFAULT_LIMIT = 25
+# Largest page of the list APIs
+MAX_LIMIT = 100
+# Elasticsearch's index.max_result_window: offset + limit may not exceed it
+MAX_RESULT_WINDOW = 10000
+# Top hits of each model in the combined search
+SEARCH_ALL_LIMIT = 5
+# Fields of each model's hits in the combined search
+SEARCH_ALL_FIELDS = {
+    'person': ['nr_id', 'preferred_name', 'birth_year'],
+    'farrecord': ['far_record_id', 'facility', 'last_name', 'first_name', 'year_of_birth'],
+    'wrarecord': ['wra_record_id', 'facility', 'lastname', 'firstname', 'birthyear'],
+    'farpage': ['far_page_id', 'facility_id', 'page', 'file_label'],
+}
+# Paged searches of one model, for the combined search's "more" links
+SEARCH_ALL_LISTS = {
+    'person': 'namespub-api-persons',
+    'farrecord': 'namespub-api-farrecords',
+    'wrarecord': 'namespub-api-wrarecords',
+}
+
+
+class PagingError(ValueError):
+    pass
+
+
+# Search parameters rejected with a 400 (see _bad_query)
+PARAM_ERRORS = (querycost.QueryCostError, years.RangeError, PagingError)
 
 
 # views ----------------------------------------------------------------
@@ -28,7 +67,16 @@ def index(request, format=None):
         'persons': reverse('namespub-api-persons', request=request),
         'farrecords': reverse('namespub-api-farrecords', request=request),
         'wrarecords': reverse('namespub-api-wrarecords', request=request),
+        'persons_count': reverse('namespub-api-persons-count', request=request),
+        'farrecords_count': reverse('namespub-api-farrecords-count', request=request),
+        'wrarecords_count': reverse('namespub-api-wrarecords-count', request=request),
         'search': reverse('namespub-api-search', request=request),
+        'search_all': reverse('namespub-api-search-all', request=request),
+        'autocomplete': reverse('namespub-api-autocomplete', request=request),
+        'match': reverse('namespub-api-match', request=request),
+        'values': reverse(
+            'namespub-api-values', args=['person', 'citizenship'], request=request
+        ),
     }
     return Response(data)
 
@@ -38,40 +86,168 @@ def object_nodes(request, object_id):
     return files(request._request, object_id)
 
 def _list(request, data):
+    return Response(_list_links(request, data))
+
+def _list_links(request, data):
     host = request.META.get('HTTP_HOST')
     path = request.META['PATH_INFO']
     if data.get('prev'):
         data['prev'] = 'http://%s%s%s' % (host, path, data['prev'])
     if data.get('next'):
         data['next'] = 'http://%s%s%s' % (host, path, data['next'])
-    return Response(data)
+    return data
 
 @api_view(['GET'])
 def persons(request, format=None):
     """List multiple Persons with filtering by most fields (exact values)
     """
     filters = _list_filters(request)
-    return _list(request, model_objects(
-        request, 'person', filters, sort_fields=['id']
-    ))
+    try:
+        limit,offset = _list_paging(request)
+        data = model_objects(
+            request, 'person', filters, sort_fields=['id'],
+            limit=limit, offset=offset
+        )
+    except PARAM_ERRORS as err:
+        return _bad_query(err)
+    return _list(request, data)
 
 @api_view(['GET'])
 def farrecords(request, format=None):
     """List multiple FarRecords with filtering by most fields (exact values)
     """
     filters = _list_filters(request)
-    return _list(request, model_objects(
-        request, 'farrecord', filters, sort_fields=['id']
-    ))
+    try:
+        limit,offset = _list_paging(request)
+        data = model_objects(
+            request, 'farrecord', filters, sort_fields=['id'],
+            limit=limit, offset=offset
+        )
+    except PARAM_ERRORS as err:
+        return _bad_query(err)
+    return _list(request, data)
 
 @api_view(['GET'])
 def wrarecords(request, format=None):
     """List multiple WraRecords with filtering by most fields (exact values)
     """
     filters = _list_filters(request)
-    return _list(request, model_objects(
-        request, 'wrarecord', filters, sort_fields=['id']
-    ))
+    try:
+        limit,offset = _list_paging(request)
+        data = model_objects(
+            request, 'wrarecord', filters, sort_fields=['id'],
+            limit=limit, offset=offset
+        )
+    except PARAM_ERRORS as err:
+        return _bad_query(err)
+    return _list(request, data)
+
+@api_view(['GET'])
+def persons_count(request, format=None):
+    """Number of Persons matching the same filters as persons, without the records
+    """
+    return _count(request, 'person')
+
+@api_view(['GET'])
+def farrecords_count(request, format=None):
+    """Number of FarRecords matching the same filters as farrecords
+    """
+    return _count(request, 'farrecord')
+
+@api_view(['GET'])
+def wrarecords_count(request, format=None):
+    """Number of WraRecords matching the same filters as wrarecords
+    """
+    return _count(request, 'wrarecord')
+
+def _count(request, model):
+    try:
+        data = model_objects(
+            request, model, _list_filters(request), just_count=True
+        )
+    except PARAM_ERRORS as err:
+        return _bad_query(err)
+    return Response(data)
+
+async def persons_async(request, format=None):
+    """Async version of persons"""
+    return await _alist(request, 'person')
+
+async def farrecords_async(request, format=None):
+    """Async version of farrecords"""
+    return await _alist(request, 'farrecord')
+
+async def wrarecords_async(request, format=None):
+    """Async version of wrarecords"""
+    return await _alist(request, 'wrarecord')
+
+async def _alist(request, model):
+    data = None
+    status_code = status.HTTP_200_OK
+    if request.method == 'GET':
+        try:
+            limit,offset = _list_paging(request)
+            data = _list_links(request, await model_objects_async(
+                request, model, _list_filters(request), sort_fields=['id'],
+                limit=limit, offset=offset
+            ))
+        except PARAM_ERRORS as err:
+            data = {'detail': str(err)}
+            status_code = status.HTTP_400_BAD_REQUEST
+    return async_response(request, data, ['get'], status_code)
+
+async def persons_count_async(request, format=None):
+    """Async version of persons_count"""
+    return await _acount(request, 'person')
+
+async def farrecords_count_async(request, format=None):
+    """Async version of farrecords_count"""
+    return await _acount(request, 'farrecord')
+
+async def wrarecords_count_async(request, format=None):
+    """Async version of wrarecords_count"""
+    return await _acount(request, 'wrarecord')
+
+async def _acount(request, model):
+    data = None
+    status_code = status.HTTP_200_OK
+    if request.method == 'GET':
+        try:
+            data = await model_objects_async(
+                request, model, _list_filters(request), just_count=True
+            )
+        except PARAM_ERRORS as err:
+            data = {'detail': str(err)}
+            status_code = status.HTTP_400_BAD_REQUEST
+    return async_response(request, data, ['get'], status_code)
+
+def _bad_query(err):
+    """400 response for a fulltext query rejected by querycost, a bad year
+    range, or a page past the result window
+    """
+    return Response({'detail': str(err)}, status=status.HTTP_400_BAD_REQUEST)
+
+def _list_paging(request):
+    """limit and offset of a list request; malformed values get the defaults
+
+    limit is capped at MAX_LIMIT.
+
+    @raises: PagingError if the page ends past MAX_RESULT_WINDOW
+    """
+    try:
+        limit = max(int(request.GET.get('limit', DEFAULT_LIMIT)), 0)
+    except ValueError:
+        limit = DEFAULT_LIMIT
+    try:
+        offset = max(int(request.GET.get('offset', 0)), 0)
+    except ValueError:
+        offset = 0
+    limit = min(limit, MAX_LIMIT)
+    if offset + limit > MAX_RESULT_WINDOW:
+        raise PagingError(
+            f'offset + limit may not exceed {MAX_RESULT_WINDOW}; narrow the search'
+        )
+    return limit,offset
 
 def _list_filters(request):
     return {
@@ -87,17 +263,50 @@ def _detail(request, data):
         return Response(status=status.HTTP_404_NOT_FOUND)
     return Response(data)
 
-@api_view(['GET'])
+def _exists(request, model, oid):
+    """Empty response to a HEAD request: 200 if the record exists, else 404
+    
+    Checked without fetching the record, by conditional.record's validator
+    lookup if it made one.  The headers are those of a GET.
+    """
+    if hasattr(request, 'conditional_validators'):
+        found = request.conditional_validators is not None
+    else:
+        found = models.docstore_exists(model, oid)
+    if not found:
+        return Response(status=status.HTTP_404_NOT_FOUND)
+    response = Response(status=status.HTTP_200_OK)
+    response.add_post_render_callback(_head_content_type)
+    return response
+
+def _head_content_type(response):
+    # DRF removes Content-Type when the rendered body is empty
+    renderer = response.accepted_renderer
+    if renderer.charset:
+        response['Content-Type'] = f'{renderer.media_type}; charset={renderer.charset}'
+    else:
+        response['Content-Type'] = renderer.media_type
+
+@conditional.record('person', vary=['Accept'])
+@api_view(['GET', 'HEAD'])
 def person(request, naan, noid, format=None):
     object_id = '/'.join([naan, noid])
+    if request.method == 'HEAD':
+        return _exists(request, 'person', object_id)
     return _detail(request, models.Person.get(object_id, request))
 
-@api_view(['GET'])
+@conditional.record('farrecord', vary=['Accept'])
+@api_view(['GET', 'HEAD'])
 def farrecord(request, object_id, format=None):
+    if request.method == 'HEAD':
+        return _exists(request, 'farrecord', object_id)
     return _detail(request, models.FarRecord.get(object_id, request))
 
-@api_view(['GET'])
+@conditional.record('wrarecord', vary=['Accept'])
+@api_view(['GET', 'HEAD'])
 def wrarecord(request, object_id, format=None):
+    if request.method == 'HEAD':
+        return _exists(request, 'wrarecord', object_id)
     return _detail(request, models.WraRecord.get(object_id, request))
 
 @api_view(['GET'])
@@ -106,10 +315,89 @@ def farpages(request, format=None):
     """
     pass
 
+@conditional.farpage(vary=['Accept'])
 @api_view(['GET'])
 def farpage(request, facility_id, far_page, format=None):
     return _detail(request, models.FarPage.get(facility_id, far_page, request))
 
+@api_view(['GET'])
+def autocomplete(request, format=None):
+    """Names starting with a prefix, for search form typeahead
+    
+    `q`: Prefix e.g. "tan".
+    `model`: "person" (default), "farrecord", or "wrarecord".
+    `facility`: Facility ID e.g. "7-manzanar".
+    `limit`: Max suggestions (default 10, max 20).
+    """
+    try:
+        limit = int(request.GET.get('limit', 0))
+    except ValueError:
+        return Response(
+            {'detail': 'limit must be an integer'},
+            status=status.HTTP_400_BAD_REQUEST
+        )
+    try:
+        names = names_autocomplete.suggest(
+            request.GET.get('q', ''),
+            request.GET.get('model', 'person'),
+            request.GET.get('facility'),
+            limit,
+        )
+    except ValueError as err:
+        return Response({'detail': str(err)}, status=status.HTTP_400_BAD_REQUEST)
+    response = Response({'q': request.GET.get('q', ''), 'suggestions': names})
+    patch_cache_control(
+        response, public=True, max_age=settings.AUTOCOMPLETE_MAX_AGE
+    )
+    return response
+
+@api_view(['POST'])
+def match(request, format=None):
+    """Match a list of names against persons, FAR records, and WRA records
+    
+    POST a CSV file (with a header row) or NDJSON, as the request body or
+    as the `file` field of a form.  Columns: `name` (or `family_name` and
+    `given_name`), optional `birth_year`, `camp`, and `id`.
+    
+    Responds with NDJSON, one line per name in input order, and a summary.
+    `start`: Skip names before this one, to resume an interrupted upload.
+    `progress`: 1 to add progress lines (rows/second) after each batch.
+    """
+    try:
+        start = int(request.query_params.get('start', 0))
+        upload = request.FILES.get('file') \
+            if request.content_type.startswith('multipart/') else None
+        if upload:
+            text = upload.read().decode('utf-8-sig')
+        else:
+            text = request.body.decode('utf-8-sig')
+        rows = batchmatch.read_rows(text, request.content_type)
+    except (ValueError, UnicodeDecodeError) as err:
+        return Response({'detail': str(err)}, status=status.HTTP_400_BAD_REQUEST)
+    return StreamingHttpResponse(
+        batchmatch.stream(
+            rows, max(start, 0), request.query_params.get('progress') == '1'
+        ),
+        content_type='application/x-ndjson',
+    )
+
+
+@api_view(['GET'])
+def values(request, model, field, format=None):
+    """Every value of a facet field and its count, streamed as NDJSON
+    
+    One {"value": ..., "count": ...} line per value in value order, then
+    {"summary": {...}}.  Resume with after=<last value received>.
+    """
+    try:
+        fieldvalues.check(model, field)
+    except KeyError as err:
+        return Response({'detail': err.args[0]}, status=status.HTTP_404_NOT_FOUND)
+    return StreamingHttpResponse(
+        fieldvalues.stream(model, field, request.GET.get('after')),
+        content_type='application/x-ndjson',
+    )
+
 
 class Search(APIView):
     
@@ -118,6 +406,7 @@ class Search(APIView):
         
         `fulltext`: Search string using Elasticsearch query_string syntax.
         `m_camp`: One or more camp IDs e.g. "9-rohwer".
+        `birth_year_min`, `birth_year_max`: Birth year range (either may be left out).
         `page`: Selected results page (default: 0).
 
         Search API help: /api/search/help/
@@ -129,6 +418,7 @@ class Search(APIView):
         
         `fulltext`: Search string using Elasticsearch query_string syntax.
         `m_camp`: One or more camp IDs e.g. "9-rohwer".
+        `birth_year_min`, `birth_year_max`: Birth year range (either may be left out).
         `page`: Selected results page (default: 0).
         
         Search API help: /api/search/help/
@@ -138,59 +428,215 @@ class Search(APIView):
     def grep(self, request):
         """NamesDB search
         """
-        def reget(request, field):
-            if request.GET.get(field):
-                return request.GET[field]
-            elif request.data.get(field):
-                return request.data[field]
-            return None
-        
-        fulltext = reget(request, 'fulltext')
-        offset = reget(request, 'offset')
-        limit = reget(request, 'limit')
-        page = reget(request, 'page')
-        
-        if offset:
-            # limit and offset args take precedence over page
-            if not limit:
-                limit = settings.RESULTS_PER_PAGE
-            offset = int(offset)
-        elif page:
-            limit = settings.RESULTS_PER_PAGE
-            thispage = int(page)
-            offset = search.es_offset(limit, thispage)
-        else:
-            limit = settings.RESULTS_PER_PAGE
-            offset = 0
-        
-        if isinstance(request, HttpRequest):
-            params = request.GET.copy()
-        elif isinstance(request, RestRequest):
-            params = request.query_params.dict()
-        searcher = search.Searcher(
-            docstore.Docstore(
-                models.INDEX_PREFIX, settings.DOCSTORE_HOST, settings
+        try:
+            searcher,limit,offset = _search_prepare(request)
+        except PARAM_ERRORS as err:
+            return _bad_query(err)
+        results = models.execute_search(searcher, limit, offset, request)
+        return Response(_search_data(request, results))
+
+
+async def search_async(request, format=None):
+    """Async version of Search"""
+    data = None
+    status_code = status.HTTP_200_OK
+    if request.method in ['GET', 'POST']:
+        rest_request = AsyncAPIView().initialize_request(request)
+        try:
+            searcher,limit,offset = _search_prepare(rest_request)
+            results = await models.aexecute_search(
+                searcher, limit, offset, rest_request
             )
+            data = _search_data(rest_request, results)
+        except PARAM_ERRORS as err:
+            data = {'detail': str(err)}
+            status_code = status.HTTP_400_BAD_REQUEST
+    return async_response(request, data, ['get', 'post'], status_code)
+
+def _search_prepare(request):
+    """Searcher, limit, and offset for a Search API request
+    """
+    def reget(request, field):
+        if request.GET.get(field):
+            return request.GET[field]
+        elif request.data.get(field):
+            return request.data[field]
+        return None
+    
+    fulltext = reget(request, 'fulltext')
+    offset = reget(request, 'offset')
+    limit = reget(request, 'limit')
+    page = reget(request, 'page')
+    
+    if offset:
+        # limit and offset args take precedence over page
+        if not limit:
+            limit = settings.RESULTS_PER_PAGE
+        offset = int(offset)
+    elif page:
+        limit = settings.RESULTS_PER_PAGE
+        thispage = int(page)
+        offset = search.es_offset(limit, thispage)
+    else:
+        limit = settings.RESULTS_PER_PAGE
+        offset = 0
+    
+    if isinstance(request, HttpRequest):
+        params = request.GET.copy()
+    elif isinstance(request, RestRequest):
+        params = request.query_params.dict()
+    querycost.guard_params(params, request)
+    searcher = search.Searcher(models.get_docstore())
+    searcher.prepare(
+        params=params,
+        params_whitelist=['fulltext'] + models.SEARCH_INCLUDE_FIELDS_PERSON,
+        search_models=['namesperson'],
+        sort=[],
+        #fields=models.SEARCH_INCLUDE_FIELDS_PERSON,
+        fields=['id','model','nr_id','preferred_name'],
+        fields_nested=[],
+        fields_agg=models.AGG_FIELDS_PERSON,
+        #highlight_fields=highlight_fields,
+        wildcards=False,
+    )
+    searcher.s = years.prepare(searcher.s, params)
+    return searcher,limit,offset
+
+def _search_data(request, results):
+    return results.to_dict(
+        request=request,
+        format_functions=models.FORMATTERS,
+        #pad=True,
+    )
+
+
+@api_view(['GET'])
+def search_all(request, format=None):
+    """Search all record types at once; hit counts and top hits of each
+    
+    `fulltext`: Search string using Elasticsearch query_string syntax.
+    `limit`: Top hits of each type (default 5, max 25).
+    `mode`: "variants" to match spelling variants of the names in `fulltext`
+    (Ohta/Ota, Inouye/Inoue, Yamazaki/Yamasaki) instead; much cheaper than
+    wildcard or fuzzy searches.
+    
+    All types are searched in one msearch request.
+    """
+    try:
+        fulltext,limit,searches = _search_all_prepare(request)
+    except ValueError as err:
+        return Response({'detail': str(err)}, status=status.HTTP_400_BAD_REQUEST)
+    responses = models.execute_multisearch(searches, request)
+    return Response(_search_all_data(request, fulltext, limit, responses))
+
+async def search_all_async(request, format=None):
+    """Async version of search_all"""
+    data = None
+    status_code = status.HTTP_200_OK
+    if request.method == 'GET':
+        try:
+            fulltext,limit,searches = _search_all_prepare(request)
+            responses = await models.aexecute_multisearch(searches, request)
+            data = _search_all_data(request, fulltext, limit, responses)
+        except ValueError as err:
+            data = {'detail': str(err)}
+            status_code = status.HTTP_400_BAD_REQUEST
+    return async_response(request, data, ['get'], status_code)
+
+def _search_all_prepare(request):
+    """Fulltext, limit, and a Search of each model for search_all
+    
+    @raises: ValueError if no fulltext, a bad limit, or a bad mode;
+             querycost.QueryCostError if fulltext is too expensive
+    """
+    fulltext = request.GET.get('fulltext', '').strip()
+    if not fulltext:
+        raise ValueError('fulltext is required')
+    limit = int(request.GET.get('limit', SEARCH_ALL_LIMIT))
+    limit = max(0, min(limit, settings.RESULTS_PER_PAGE))
+    mode = request.GET.get('mode', 'fulltext')
+    if mode == 'variants':
+        # exact lookups of name keys, see namekeys
+        query = namekeys.query(fulltext)
+    elif mode == 'fulltext':
+        query = dsl.Q(
+            'query_string', query=querycost.guard(fulltext, request),
+            fields=['fulltext']
         )
-        searcher.prepare(
-            params=params,
-            params_whitelist=['fulltext'] + models.SEARCH_INCLUDE_FIELDS_PERSON,
-            search_models=['namesperson'],
-            sort=[],
-            #fields=models.SEARCH_INCLUDE_FIELDS_PERSON,
-            fields=['id','model','nr_id','preferred_name'],
-            fields_nested=[],
-            fields_agg=models.AGG_FIELDS_PERSON,
-            #highlight_fields=highlight_fields,
-            wildcards=False,
-        )
-        results = searcher.execute(limit, offset)
-        data = results.to_dict(
-            request=request,
-            format_functions=models.FORMATTERS,
-            #pad=True,
-        )
-        return Response(data)
+    else:
+        raise ValueError(f'Unknown mode: {mode}')
+    searches = [
+        dsl.Search(index=models.MODELS_DOCTYPES[model]).query(
+            query
+        ).source(SEARCH_ALL_FIELDS[model])[:limit]
+        for model in models.SEARCH_MODELS
+    ]
+    return fulltext,limit,searches
+
+def _search_all_data(request, fulltext, limit, responses):
+    data = OrderedDict()
+    data['fulltext'] = fulltext
+    data['mode'] = request.GET.get('mode', 'fulltext')
+    data['limit'] = limit
+    data['total'] = 0
+    data['models'] = OrderedDict()
+    for model,response in zip(models.SEARCH_MODELS, responses):
+        d = OrderedDict()
+        if response is None:
+            d['total'] = 0
+            d['error'] = 'Search failed'
+            d['objects'] = []
+        else:
+            formatter = models.FORMATTERS[models.MODELS_DOCTYPES[model]]
+            d['total'] = response.hits.total.value
+            d['objects'] = [
+                formatter(hit.to_dict(), request, listitem=True)
+                for hit in response.hits
+            ]
+        # list pages only do fulltext searches
+        if model in SEARCH_ALL_LISTS and d['total'] > limit \
+        and data['mode'] == 'fulltext':
+            d['more'] = '?'.join([
+                reverse(SEARCH_ALL_LISTS[model], request=request),
+                urlencode({'fulltext': fulltext}),
+            ])
+        data['total'] += d['total']
+        data['models'][model] = d
+    return data
+
+
+class AsyncAPIView(APIView):
+    """Renders data fetched by an async view
+    
+    DRF views are sync-only, so the async API views (see urls_async) do
+    their I/O first and pass the data here for content negotiation and
+    rendering.  No authentication: the session lookup is a sync database
+    query, and these endpoints are public anyway.
+    """
+    authentication_classes = []
+    permission_classes = [AllowAny]
+    data = None
+    status_code = status.HTTP_200_OK
+
+    def get(self, request, *args, **kwargs):
+        return Response(self.data, status=self.status_code)
+
+    post = get
+
+def async_response(request, data, methods, status_code=status.HTTP_200_OK):
+    """Rendered DRF response for DATA
+    
+    @param request: Django request
+    @param data: dict
+    @param methods: list Allowed HTTP methods (lowercase); others get 405
+    @param status_code: int
+    @returns: Response
+    """
+    view = AsyncAPIView.as_view(
+        data=data, status_code=status_code,
+        http_method_names=methods + ['options']
+    )
+    return view(request).render()
 
 
 def model_objects(
@@ -208,9 +654,34 @@ def model_objects(
     @param fields: list
     @param limit: int
     @param offset: int
-    @param just_count: boolean
+    @param just_count: boolean Return only {'count': int}
     @returns: dict
     """
+    searcher = _model_searcher(request, model)
+    if just_count:
+        return {'count': models.count_search(searcher, request)}
+    results = models.execute_search(searcher, limit, offset, request)
+    return results.ordered_dict(
+        request, format_functions=models.FORMATTERS
+    )
+
+async def model_objects_async(
+        request, model, filters={}, sort_fields=[],
+        fields=models.SEARCH_INCLUDE_FIELDS, limit=DEFAULT_LIMIT, offset=0,
+        just_count=False
+):
+    """Async version of model_objects"""
+    searcher = _model_searcher(request, model)
+    if just_count:
+        return {'count': await models.acount_search(searcher, request)}
+    results = await models.aexecute_search(searcher, limit, offset, request)
+    return results.ordered_dict(
+        request, format_functions=models.FORMATTERS
+    )
+
+def _model_searcher(request, model):
+    """Prepared Searcher for model_objects
+    """
     if model in ['person', 'persons']:
         search_models = ['namesperson']
         params_allowlist = models.SEARCH_INCLUDE_FIELDS_PERSON
@@ -230,12 +701,8 @@ def model_objects(
         agg_fields = models.AGG_FIELDS_WRARECORD
         highlight_fields = models.HIGHLIGHT_FIELDS_WRARECORD
     
-    params=request.GET.copy()
-    searcher = search.Searcher(
-        docstore.Docstore(
-            models.INDEX_PREFIX, settings.DOCSTORE_HOST, settings
-        )
-    )
+    params = querycost.guard_params(request.GET.copy(), request)
+    searcher = search.Searcher(models.get_docstore())
     searcher.prepare(
         params=params,
         params_whitelist=['fulltext'] + params_allowlist,
@@ -247,7 +714,5 @@ def model_objects(
         #highlight_fields=highlight_fields,
         wildcards=False,
     )
-    results = searcher.execute(limit, offset)
-    return results.ordered_dict(
-        request, format_functions=models.FORMATTERS
-    )
+    searcher.s = years.prepare(searcher.s, params)
+    return searcher
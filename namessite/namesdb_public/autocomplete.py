@@ -0,0 +1,86 @@
+"""Name autocomplete (typeahead)
+
+Suggestions come from the completion suggester field models.SUGGEST_FIELD,
+built at index time from the name fields of each record (see
+models.assemble_suggest):
+
+    person     family_name, given_name, preferred_name
+    farrecord  last_name
+    wrarecord  lastname
+
+Completion suggesters are served from an in-memory structure on each shard
+without scoring or fetching documents, so they answer in a few milliseconds,
+unlike the query_string search with aggregations the search form runs.
+Suggestions can be restricted to a facility (a context of the suggester);
+every suggestion also has the context models.SUGGEST_ANY_FACILITY, which
+queries for any facility use, since a context-enabled completion field
+can't be queried without contexts.
+
+Results are kept in their own small cache (the 'autocomplete' entry in
+settings.CACHES) since the same few prefixes are typed again and again.
+
+    autocomplete.suggest('tan', 'person', facility='7-manzanar')
+"""
+import hashlib
+
+from django.conf import settings
+from django.core.cache import caches
+
+from . import admission
+from . import metrics
+from . import models
+
+MODELS = ['person', 'farrecord', 'wrarecord']
+MAX_PREFIX = 50
+MAX_LIMIT = 20
+
+
+def normalize(prefix):
+    """Collapse whitespace; too-long prefixes are truncated
+    """
+    return ' '.join(prefix.split())[:MAX_PREFIX]
+
+def _cache_key(model, prefix, facility, limit):
+    # prefixes may contain characters memcached does not allow in keys
+    text = f'{model}:{facility or ""}:{limit}:{prefix.lower()}'
+    return f'autocomplete:{hashlib.sha1(text.encode()).hexdigest()}'
+
+def suggest(prefix, model='person', facility=None, limit=None):
+    """Names starting with PREFIX
+
+    @param prefix: str
+    @param model: str 'person', 'farrecord', 'wrarecord'
+    @param facility: str Facility ID, e.g. '7-manzanar'
+    @param limit: int Max suggestions (default settings.AUTOCOMPLETE_LIMIT)
+    @returns: list of str
+    """
+    if model not in MODELS:
+        raise ValueError(f'Not a model with names: {model}')
+    prefix = normalize(prefix)
+    if len(prefix) < settings.AUTOCOMPLETE_MIN_LENGTH:
+        return []
+    limit = max(1, min(limit or settings.AUTOCOMPLETE_LIMIT, MAX_LIMIT))
+    cache = caches['autocomplete']
+    key = _cache_key(model, prefix, facility, limit)
+    names = cache.get(key)
+    metrics.cache_result('autocomplete', names is not None)
+    if names is not None:
+        return names
+    completion = {
+        'field': models.SUGGEST_FIELD, 'size': limit, 'skip_duplicates': True,
+        'contexts': {'facility': [facility or models.SUGGEST_ANY_FACILITY]},
+    }
+    body = {
+        '_source': False,
+        'suggest': {'names': {'prefix': prefix, 'completion': completion}},
+    }
+    index = models.MODELS_DOCTYPES[model]
+    es = models.get_docstore().es
+    with admission.admit('lookup'), metrics.es_timer(index, 'suggest'):
+        response = es.search(index=index, body=body)
+    names = [
+        option['text']
+        for option in response['suggest']['names'][0]['options']
+    ]
+    cache.set(key, names)
+    return names
@@ -0,0 +1,276 @@
+"""Batch name matching: match a list of names against person, FAR, and WRA records
+
+Partners send spreadsheets of thousands of names.  Rather than one search
+per name, names are grouped into msearch requests of
+settings.BATCHMATCH_BATCH_SIZE names (one search per name and record type),
+settings.BATCHMATCH_CONCURRENCY of which run at once, through their own
+admission gate ('batch', see admission) so that uploads do not take the
+slots of interactive searches.
+
+Input is CSV with a header row, or NDJSON, with these columns/keys:
+
+    name                    full name, or
+    family_name,given_name  (also last_name,first_name)
+    birth_year              optional (also year_of_birth, birthyear)
+    camp                    optional facility ID e.g. 7-manzanar (also facility)
+    id                      optional, returned with the matches
+
+The name must match; birth year and camp rank matches that agree higher.
+One result per input row is produced, in input order, as soon as its batch
+and all earlier ones are done:
+
+    {"row": 0, "id": "a1", "input": {...}, "matches": {"person": [...], ...}}
+
+If a batch fails (e.g. Elasticsearch is unavailable or the gate is full)
+each of its rows gets an "error" and matching goes on with the next batch.
+
+Since results are in order, an interrupted run is resumed by starting at
+the number of results already received (`start`).
+
+    POST /api/1.0/match/?start=0 (body: CSV or NDJSON)
+    python manage.py matchnames names.csv -o matches.ndjson [--resume]
+"""
+from concurrent.futures import ThreadPoolExecutor
+import csv
+import io
+import json
+import logging
+logger = logging.getLogger(__name__)
+import time
+
+from django.conf import settings
+
+from elastictools.docstore import elasticsearch_dsl as dsl
+
+from . import models
+
+MODELS = ['person', 'farrecord', 'wrarecord']
+# Fields the name is matched against
+NAME_FIELDS = {
+    'person': ['preferred_name', 'family_name', 'given_name', 'other_names'],
+    'farrecord': ['last_name', 'first_name', 'other_names'],
+    'wrarecord': ['lastname', 'firstname'],
+}
+BIRTH_YEAR_FIELDS = {
+    'person': 'birth_year',
+    'farrecord': 'year_of_birth',
+    'wrarecord': 'birthyear',
+}
+FACILITY_FIELDS = {
+    'farrecord': 'facility',
+    'wrarecord': 'facility',
+}
+# Fields of matched records in results
+RESULT_FIELDS = {
+    'person': ['nr_id', 'preferred_name', 'birth_year'],
+    'farrecord': ['far_record_id', 'facility', 'last_name', 'first_name', 'year_of_birth'],
+    'wrarecord': ['wra_record_id', 'facility', 'lastname', 'firstname', 'birthyear'],
+}
+# Input column aliases
+COLUMNS = {
+    'family_name': ['family_name', 'last_name', 'lastname'],
+    'given_name': ['given_name', 'first_name', 'firstname'],
+    'birth_year': ['birth_year', 'year_of_birth', 'birthyear'],
+    'camp': ['camp', 'facility'],
+}
+
+
+class InputError(ValueError):
+    pass
+
+
+# input ----------------------------------------------------------------
+
+def read_rows(text, content_type=''):
+    """Parse CSV (with header) or NDJSON
+
+    NDJSON if content_type says so or the first character is '{'.
+
+    @param text: str
+    @param content_type: str
+    @returns: list of dict
+    @raises: InputError
+    """
+    if 'json' in content_type or text.lstrip().startswith('{'):
+        rows = []
+        for n,line in enumerate(text.splitlines()):
+            if not line.strip():
+                continue
+            try:
+                rows.append(json.loads(line))
+            except ValueError:
+                raise InputError(f'Line {n + 1} is not JSON')
+    else:
+        rows = list(csv.DictReader(io.StringIO(text)))
+    if len(rows) > settings.BATCHMATCH_MAX_ROWS:
+        raise InputError(
+            f'{len(rows)} rows (max {settings.BATCHMATCH_MAX_ROWS}); send fewer'
+        )
+    return [normalize(row) for row in rows]
+
+def _column(row, name):
+    for key in COLUMNS[name]:
+        if row.get(key):
+            return str(row[key]).strip()
+    return ''
+
+def normalize(row):
+    """Name, birth year, camp, and id of an input row
+    """
+    name = str(row.get('name') or '').strip()
+    if not name:
+        name = ' '.join(
+            part for part in [_column(row, 'given_name'), _column(row, 'family_name')]
+            if part
+        )
+    return {
+        'id': row.get('id'),
+        'name': name,
+        'birth_year': _column(row, 'birth_year'),
+        'camp': _column(row, 'camp'),
+    }
+
+
+# matching -------------------------------------------------------------
+
+def search(model, row, limit):
+    """Search for records of MODEL matching an input row
+    """
+    should = []
+    # an integer field: a term that isn't a year would fail the whole search
+    year = models.year_int(row['birth_year']) if row['birth_year'] else None
+    if year is not None:
+        should.append(dsl.Q('term', **{BIRTH_YEAR_FIELDS[model]: year}))
+    if row['camp'] and model in FACILITY_FIELDS:
+        should.append(dsl.Q('term', **{FACILITY_FIELDS[model]: row['camp']}))
+    query = dsl.Q('bool', must=[
+        dsl.Q(
+            'multi_match', query=row['name'], fields=NAME_FIELDS[model],
+            type='cross_fields', operator='and',
+        )
+    ], should=should)
+    return dsl.Search(
+        index=models.MODELS_DOCTYPES[model]
+    ).query(query).source(RESULT_FIELDS[model])[:limit]
+
+def match_batch(rows, start, limit):
+    """Match a batch of rows with one msearch
+
+    @param rows: list of normalized rows
+    @param start: int Row number of the first row
+    @param limit: int Max matches per row and model
+    @returns: list of results
+    """
+    searches = []
+    for row in rows:
+        if row['name']:
+            searches += [search(model, row, limit) for model in MODELS]
+    responses = iter(
+        models.execute_multisearch(searches, gate='batch') if searches else []
+    )
+    results = []
+    for n,row in enumerate(rows):
+        result = {'row': start + n, 'id': row['id'], 'input': row, 'matches': {}}
+        if not row['name']:
+            result['error'] = 'No name'
+        else:
+            for model in MODELS:
+                response = next(responses)
+                if response is None:
+                    result['error'] = 'Search failed'
+                    continue
+                result['matches'][model] = [
+                    dict(hit.to_dict(), id=hit.meta.id, score=hit.meta.score)
+                    for hit in response.hits
+                ]
+        results.append(result)
+    return results
+
+def failed_batch(rows, start, err):
+    """Results for a batch whose msearch failed
+    """
+    logger.error(f'batch match rows {start}-{start + len(rows) - 1}: {err}')
+    return [
+        {'row': start + n, 'id': row['id'], 'input': row, 'matches': {},
+         'error': str(err)}
+        for n,row in enumerate(rows)
+    ]
+
+def match(rows, start=0, limit=None, batch_size=None, concurrency=None, progress=None):
+    """Match rows, yielding results in input order
+
+    @param rows: list of normalized rows
+    @param start: int Skip rows before this one (resume)
+    @param limit: int Max matches per row and model
+    @param batch_size: int Rows per msearch
+    @param concurrency: int Concurrent msearches
+    @param progress: function(done, total, seconds), called when a batch is done
+    @returns: generator of dict
+    """
+    limit = limit or settings.BATCHMATCH_MATCHES
+    batch_size = batch_size or settings.BATCHMATCH_BATCH_SIZE
+    concurrency = concurrency or settings.BATCHMATCH_CONCURRENCY
+    began = time.perf_counter()
+    offsets = range(start, len(rows), batch_size)
+    done = 0
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        # submit at most CONCURRENCY batches ahead of the one being yielded
+        futures = []
+        offsets = iter(offsets)
+        def submit():
+            offset = next(offsets, None)
+            if offset is not None:
+                batch = rows[offset:offset + batch_size]
+                futures.append((batch, offset, executor.submit(
+                    match_batch, batch, offset, limit
+                )))
+        for _ in range(concurrency):
+            submit()
+        while futures:
+            batch,offset,future = futures.pop(0)
+            try:
+                results = future.result()
+            except Exception as err:
+                results = failed_batch(batch, offset, err)
+            submit()
+            done += len(results)
+            if progress:
+                progress(start + done, len(rows), time.perf_counter() - began)
+            yield from results
+
+def progress_record(done, total, seconds, start=0):
+    """Progress and throughput
+    """
+    rate = (done - start) / seconds if seconds else 0
+    return {
+        'done': done,
+        'total': total,
+        'seconds': round(seconds, 3),
+        'rows_per_second': round(rate, 1),
+        'eta_seconds': round((total - done) / rate, 1) if rate else None,
+    }
+
+def stream(rows, start=0, progress=False):
+    """Match rows as NDJSON lines: results, progress records, and a summary
+
+    @param rows: list of normalized rows
+    @param start: int Skip rows before this one (resume)
+    @param progress: bool Add a {"progress": {...}} line after each batch
+    @returns: generator of bytes
+    """
+    reports = []
+    last = progress_record(start, len(rows), 0, start)
+    def report(done, total, seconds):
+        nonlocal last
+        last = progress_record(done, total, seconds, start)
+        if progress:
+            reports.append(last)
+    matched = errors = 0
+    for result in match(rows, start, progress=report):
+        matched += 1 if any(result['matches'].values()) else 0
+        errors += 1 if 'error' in result else 0
+        yield (json.dumps(result) + '\n').encode()
+        if reports and result['row'] + 1 == reports[0]['done']:
+            yield (json.dumps({'progress': reports.pop(0)}) + '\n').encode()
+    summary = dict(last, start=start, matched=matched, errors=errors)
+    yield (json.dumps({'summary': summary}) + '\n').encode()
@@ -0,0 +1,368 @@
+"""Hot-path microbenchmarks
+
+Runs without Elasticsearch: documents come from the memstore stand-in
+loaded with sampledata, and search result handling is measured against a
+recorded response so that only our code (and elastictools/dsl) is timed.
+
+    python manage.py benchmark
+    python manage.py benchmark --save /tmp/bench.json
+    python manage.py benchmark --compare /tmp/bench.json
+
+Each benchmark reports operations per second (best of several runs) and
+the peak memory allocated during one operation (tracemalloc).
+"""
+from copy import deepcopy
+from datetime import datetime
+import json
+import platform
+import timeit
+import tracemalloc
+from types import SimpleNamespace
+
+from django.conf import settings
+from django.core.paginator import Paginator
+from django.template.loader import render_to_string
+from django.test import RequestFactory
+from django.test.utils import override_settings
+from django.urls import reverse
+
+from elastictools import search
+from elastictools.docstore import elasticsearch_dsl as dsl
+
+from . import forms
+from . import memstore
+from . import models
+
+# Regressions: ops/sec lower or peak allocations higher than baseline by
+# more than this fraction
+TOLERANCE = 0.25
+# ...and peak allocations by at least this many bytes (small peaks are noisy)
+TOLERANCE_BYTES = 1024
+REPEAT = 5
+# Buckets per field for the SearchForm benchmark
+FORM_AGG_FIELDS = 8
+FORM_AGG_BUCKETS = 500
+
+BENCHMARKS = {}
+
+
+def benchmark(name):
+    """Register a benchmark setup function
+
+    The setup function is called once and returns the zero-argument
+    callable that is timed.
+    """
+    def register(setup):
+        BENCHMARKS[name] = setup
+        return setup
+    return register
+
+
+class RecordedClient():
+    """Elasticsearch client that answers every search with the same response
+    """
+
+    def __init__(self, response):
+        self.response = response
+
+    def search(self, body=None, index=None, **kwargs):
+        return deepcopy(self.response)
+
+
+class Fixtures():
+    """Documents, request, and contexts shared by the benchmarks
+    """
+
+    def __init__(self):
+        self.es = memstore.client(settings)
+        self.docstore = memstore.Docstore(
+            models.INDEX_PREFIX, settings.DOCSTORE_HOST, settings
+        )
+        host = next(
+            (h.lstrip('.') for h in settings.ALLOWED_HOSTS if h != '*'),
+            'localhost'
+        )
+        self.rf = RequestFactory(HTTP_HOST=host)
+        self.request = self.rf.get('/')
+        self.documents = {
+            index: self.first(index)
+            for index in models.FORMATTERS.keys()
+        }
+        # person with the most family members exercises the most links
+        response = self.es.search(
+            index='namesperson', body={'query': {'match_all': {}}, 'size': 1000}
+        )
+        self.person = max(
+            response['hits']['hits'],
+            key=lambda hit: (
+                len(hit['_source'].get('family', []))
+                + len(hit['_source'].get('far_records', []))
+                + len(hit['_source'].get('wra_records', []))
+            )
+        )
+
+    def first(self, index):
+        return self.es.search(index=index, body={'size': 1})['hits']['hits'][0]
+
+    def searcher(self, es=None):
+        ds = self.docstore
+        if es:
+            ds = SimpleNamespace(es=es)
+        return search.Searcher(ds)
+
+    def prepare_persons(self, searcher, params):
+        searcher.prepare(
+            params=params,
+            params_whitelist=['fulltext'] + models.SEARCH_INCLUDE_FIELDS_PERSON,
+            search_models=['namesperson'],
+            sort=[],
+            fields=models.SEARCH_INCLUDE_FIELDS_PERSON,
+            fields_nested=[],
+            fields_agg=models.AGG_FIELDS_PERSON,
+            wildcards=False,
+        )
+        return searcher
+
+    def search_request(self, fulltext='tanaka'):
+        return self.rf.get('/persons/', {'fulltext': fulltext})
+
+    def recorded_searcher(self, request):
+        """Searcher whose client replays a response recorded from memstore
+        """
+        searcher = self.prepare_persons(
+            self.searcher(), request.GET.copy()
+        )
+        s = searcher.s[0:settings.RESULTS_PER_PAGE]
+        raw = self.es.search(index=s._index, body=s.to_dict())
+        return self.prepare_persons(
+            self.searcher(RecordedClient(raw)), request.GET.copy()
+        )
+
+
+_fixtures = None
+
+def fixtures():
+    global _fixtures
+    if _fixtures is None:
+        _fixtures = Fixtures()
+    return _fixtures
+
+
+# benchmarks -----------------------------------------------------------
+# Formatters modify the documents they are given so each op works on a copy.
+
+@benchmark('format_object_detail')
+def bench_format_object_detail(fx):
+    def run():
+        models.format_object_detail(deepcopy(fx.person), fx.request)
+    return run
+
+def _formatter(index):
+    def setup(fx):
+        formatter = models.FORMATTERS[index]
+        document = fx.documents[index]['_source']
+        def run():
+            formatter(deepcopy(document), fx.request)
+        return run
+    return setup
+
+for _index in models.FORMATTERS.keys():
+    benchmark(f'formatter_{_index}')(_formatter(_index))
+
+@benchmark('join_highlight_text')
+def bench_join_highlight_text(fx):
+    highlights = SimpleNamespace(**{
+        field: [f'<em>{field}</em> one', f'<em>{field}</em> two']
+        for field in models.FIELDS_PERSON
+    })
+    def run():
+        models.join_highlight_text('person', highlights)
+    return run
+
+@benchmark('fields_enriched')
+def bench_fields_enriched(fx):
+    record = models.Person.from_dict(
+        fx.person['_id'], deepcopy(fx.person['_source'])
+    )
+    def run():
+        models.Record.fields_enriched(record, label=True, description=True)
+    return run
+
+@benchmark('search_prepare')
+def bench_search_prepare(fx):
+    request = fx.rf.get('/persons/', {
+        'fulltext': 'tanaka', 'gender': 'M', 'facility_id': '10-tulelake',
+    })
+    def run():
+        fx.prepare_persons(fx.searcher(), request.GET.copy())
+    return run
+
+@benchmark('search_execute')
+def bench_search_execute(fx):
+    request = fx.search_request()
+    searcher = fx.recorded_searcher(request)
+    def run():
+        results = searcher.execute(settings.RESULTS_PER_PAGE, 0)
+        results.ordered_dict(
+            request=request, format_functions=models.FORMATTERS, pad=True
+        )
+    return run
+
+@benchmark('search_form')
+def bench_search_form(fx):
+    results = SimpleNamespace(aggregations={
+        f'field{n}': [
+            {'key': f'value{m}', 'doc_count': str(m)}
+            for m in range(FORM_AGG_BUCKETS)
+        ]
+        for n in range(FORM_AGG_FIELDS)
+    })
+    def run():
+        forms.SearchForm(search_results=results)
+    return run
+
+@benchmark('render_person')
+def bench_render_person(fx):
+    nr_id = fx.person['_id']
+    naan,noid = nr_id.split('/')
+    s = dsl.Search(using=fx.es, index='namespersonlocation')
+    s = s.filter('term', person_id=nr_id).sort('exit_date', 'entry_date')
+    locations = [
+        {
+            fieldname: getattr(hit, fieldname, '')
+            for fieldname in models.FIELDS_PERSONLOCATION
+        }
+        for hit in s.execute()
+    ]
+    for location in locations:
+        location['divid'] = f"m{location['id'].replace('/','')}"
+    context = {
+        'display_fields_person': models.DISPLAY_FIELDS_PERSON,
+        'record': models.format_object_detail(deepcopy(fx.person), fx.request),
+        'locations': locations,
+        'ddrobjects_ui_url': f'{settings.DDR_UI_URL}/nrid/{naan}/{noid}/',
+        'ddrobjects_api_url': f'{settings.DDR_API_URL}/api/0.2/nrid/{naan}/{noid}/',
+        'ddrobjects_status': 200,
+        'ddrobjects': [],
+        'api_url': reverse('namespub-api-person', args=[naan,noid]),
+    }
+    def run():
+        render_to_string('namesdb_public/person.html', context, fx.request)
+    return run
+
+@benchmark('render_person_search')
+def bench_render_person_search(fx):
+    request = fx.search_request()
+    searcher = fx.recorded_searcher(request)
+    results = searcher.execute(settings.RESULTS_PER_PAGE, 0)
+    paginator = Paginator(
+        results.ordered_dict(
+            request=request, format_functions=models.FORMATTERS, pad=True,
+        )['objects'],
+        results.page_size,
+    )
+    context = {
+        'model': 'person',
+        'searching': True,
+        'filters': True,
+        'api_url': f"{reverse('namespub-api-persons')}?{request.META['QUERY_STRING']}",
+        'results': results,
+        'paginator': paginator,
+        'page': paginator.page(results.this_page),
+        'form': forms.SearchForm(
+            data=request.GET.copy(), search_results=results
+        ),
+    }
+    def run():
+        render_to_string('namesdb_public/person-search.html', context, request)
+    return run
+
+
+# running --------------------------------------------------------------
+
+def measure(func, repeat=REPEAT):
+    """Time func and measure its peak allocations
+
+    @param func: callable
+    @param repeat: int Number of timing runs; the best is kept
+    @returns: dict {'ops': float, 'peak_bytes': int}
+    """
+    func()  # warm caches
+    timer = timeit.Timer(func)
+    number,_ = timer.autorange()
+    best = min(timer.repeat(repeat=repeat, number=number))
+    tracing = tracemalloc.is_tracing()
+    if not tracing:
+        tracemalloc.start()
+    tracemalloc.reset_peak()
+    current,_ = tracemalloc.get_traced_memory()
+    func()
+    _,peak = tracemalloc.get_traced_memory()
+    if not tracing:
+        tracemalloc.stop()
+    return {
+        'ops': number / best,
+        'peak_bytes': peak - current,
+    }
+
+def run(names=None, repeat=REPEAT):
+    """Run selected (default all) benchmarks
+
+    @param names: list
+    @param repeat: int
+    @returns: dict {name: {'ops': float, 'peak_bytes': int}}
+    """
+    unknown = set(names or []) - set(BENCHMARKS.keys())
+    if unknown:
+        raise KeyError(f"Unknown benchmark(s): {', '.join(sorted(unknown))}")
+    # anything that looks up its own docstore (e.g. form choices) gets memstore
+    with override_settings(DOCSTORE_BACKEND='memory'):
+        fx = fixtures()
+        return {
+            name: measure(setup(fx), repeat)
+            for name,setup in BENCHMARKS.items()
+            if (not names) or (name in names)
+        }
+
+def save(results, path):
+    """Write results to a baseline file
+    """
+    data = {
+        'timestamp': datetime.now().isoformat(timespec='seconds'),
+        'python': platform.python_version(),
+        'machine': platform.node(),
+        'results': results,
+    }
+    with open(path, 'w') as f:
+        json.dump(data, f, indent=2, sort_keys=True)
+
+def load(path):
+    with open(path, 'r') as f:
+        return json.load(f)
+
+def compare(results, baseline, tolerance=TOLERANCE):
+    """List benchmarks that regressed relative to a baseline
+
+    Benchmarks missing from either side are ignored.
+
+    @param results: dict Output of run()
+    @param baseline: dict Contents of a save()d baseline file
+    @param tolerance: float Allowed fractional change
+    @returns: list of (name, metric, baseline value, current value)
+    """
+    regressions = []
+    for name,current in results.items():
+        base = baseline['results'].get(name)
+        if not base:
+            continue
+        if current['ops'] < base['ops'] * (1 - tolerance):
+            regressions.append((name, 'ops', base['ops'], current['ops']))
+        limit = max(
+            base['peak_bytes'] * (1 + tolerance),
+            base['peak_bytes'] + TOLERANCE_BYTES
+        )
+        if current['peak_bytes'] > limit:
+            regressions.append(
+                (name, 'peak_bytes', base['peak_bytes'], current['peak_bytes'])
+            )
+    return regressions
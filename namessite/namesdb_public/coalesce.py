@@ -0,0 +1,200 @@
+"""Single-flight coalescing of identical concurrent backend calls
+
+When a link to a person or a popular search is shared, dozens of identical
+requests arrive at once and each would make the same Elasticsearch call.
+call(parts, fn) runs fn once for all concurrent callers whose PARTS are equal;
+the others wait for it and get a copy of its result (or its exception).
+Nothing is kept after the call completes, so this is not a cache.
+
+Across worker processes (settings.COALESCE_SHARED_CACHE names a Django cache
+shared by the workers, e.g. memcached or redis), the first caller also takes
+a lock in the cache with cache.add() and publishes its result there for
+settings.COALESCE_RESULT_TTL seconds.  Callers in other workers poll for the
+result for up to settings.COALESCE_WAIT seconds, then make the call
+themselves.
+
+Results are raw Elasticsearch responses: formatting depends on the request
+(URLs include the host) and modifies the data, so each caller formats its
+own copy.
+
+    raw = coalesce.call(('get', index, oid), lambda: es.get(index=index, id=oid))
+"""
+import asyncio
+from copy import deepcopy
+import hashlib
+import json
+import math
+import threading
+import time
+
+from django.conf import settings
+from django.core.cache import caches
+
+from . import metrics
+
+# Seconds between polls for another worker's result
+POLL_INTERVAL = 0.01
+_MISSING = object()
+# Result of an async flight whose leader was cancelled
+_ABANDONED = object()
+
+
+def enabled():
+    return getattr(settings, 'COALESCE_ENABLED', False)
+
+def key(parts):
+    """Stable key for a call
+
+    @param parts: list or tuple; first item is the operation name (metrics label)
+    @returns: str
+    """
+    text = json.dumps(parts, sort_keys=True, default=str)
+    return hashlib.sha1(text.encode()).hexdigest()
+
+
+class _Flight():
+    """One in-flight call and the callers waiting on it
+    """
+
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+        self.waiters = 0
+
+
+_flights = {}
+_flights_lock = threading.Lock()
+
+def call(parts, fn):
+    """Run fn() once for concurrent callers with the same PARTS
+
+    @param parts: list or tuple (see key)
+    @param fn: callable
+    @returns: fn() or a copy of it
+    """
+    if not enabled():
+        return fn()
+    k = key(parts)
+    with _flights_lock:
+        flight = _flights.get(k)
+        leader = flight is None
+        if leader:
+            flight = _flights[k] = _Flight()
+        else:
+            flight.waiters += 1
+    if not leader:
+        flight.done.wait()
+        metrics.inc('namesdb_coalesced_calls_total', op=parts[0], scope='process')
+        if flight.error:
+            raise flight.error
+        return deepcopy(flight.result)
+    try:
+        flight.result = _shared_call(k, parts[0], fn)
+    except BaseException as err:
+        flight.error = err
+        raise
+    finally:
+        # once removed no caller can join, so flight.waiters is final
+        with _flights_lock:
+            del _flights[k]
+        flight.done.set()
+    if flight.waiters:
+        return deepcopy(flight.result)
+    return flight.result
+
+def _shared_call(k, op, fn):
+    alias = settings.COALESCE_SHARED_CACHE
+    if not alias:
+        return fn()
+    cache = caches[alias]
+    lock_key = f'coalesce:{k}:lock'
+    result_key = f'coalesce:{k}:result'
+    if cache.add(lock_key, 1, timeout=math.ceil(settings.COALESCE_WAIT)):
+        try:
+            result = fn()
+            cache.set(result_key, result, timeout=settings.COALESCE_RESULT_TTL)
+            return result
+        finally:
+            cache.delete(lock_key)
+    deadline = time.monotonic() + settings.COALESCE_WAIT
+    while time.monotonic() < deadline:
+        locked = cache.get(lock_key) is not None
+        result = cache.get(result_key, _MISSING)
+        if result is not _MISSING:
+            metrics.inc('namesdb_coalesced_calls_total', op=op, scope='host')
+            return result
+        if not locked:
+            # the other worker's call failed
+            break
+        time.sleep(POLL_INTERVAL)
+    return fn()
+
+
+_aflights = {}
+
+async def acall(parts, fn):
+    """Async version of call
+
+    @param parts: list or tuple (see key)
+    @param fn: coroutine function
+    @returns: await fn() or a copy of it
+    """
+    if not enabled():
+        return await fn()
+    k = key(parts)
+    while k in _aflights:
+        flight,waiters = _aflights[k]
+        waiters[0] += 1
+        result = await asyncio.shield(flight)
+        if result is _ABANDONED:
+            # the first waiter to get here becomes the new leader
+            continue
+        metrics.inc('namesdb_coalesced_calls_total', op=parts[0], scope='process')
+        return deepcopy(result)
+    flight = asyncio.get_running_loop().create_future()
+    waiters = [0]
+    _aflights[k] = (flight,waiters)
+    try:
+        result = await _ashared_call(k, parts[0], fn)
+        flight.set_result(result)
+    except Exception as err:
+        flight.set_exception(err)
+        # don't warn about an exception nobody waited for
+        flight.exception()
+        raise
+    finally:
+        del _aflights[k]
+        if not flight.done():
+            # The leader was cancelled (its client went away); the waiters
+            # still want the result, so they make the call themselves.
+            flight.set_result(_ABANDONED)
+    if waiters[0]:
+        return deepcopy(result)
+    return result
+
+async def _ashared_call(k, op, fn):
+    alias = settings.COALESCE_SHARED_CACHE
+    if not alias:
+        return await fn()
+    cache = caches[alias]
+    lock_key = f'coalesce:{k}:lock'
+    result_key = f'coalesce:{k}:result'
+    if await cache.aadd(lock_key, 1, timeout=math.ceil(settings.COALESCE_WAIT)):
+        try:
+            result = await fn()
+            await cache.aset(result_key, result, timeout=settings.COALESCE_RESULT_TTL)
+            return result
+        finally:
+            await cache.adelete(lock_key)
+    deadline = time.monotonic() + settings.COALESCE_WAIT
+    while time.monotonic() < deadline:
+        locked = await cache.aget(lock_key) is not None
+        result = await cache.aget(result_key, _MISSING)
+        if result is not _MISSING:
+            metrics.inc('namesdb_coalesced_calls_total', op=op, scope='host')
+            return result
+        if not locked:
+            break
+        await asyncio.sleep(POLL_INTERVAL)
+    return await fn()
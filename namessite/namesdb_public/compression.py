@@ -0,0 +1,272 @@
+"""Response compression (brotli, gzip) with a cache of compressed bodies
+
+CompressionMiddleware negotiates Content-Encoding from Accept-Encoding and
+compresses HTML, JSON, and other text responses.  brotli is used when the
+Brotli package is installed and the client accepts it, gzip otherwise.
+
+Responses that may be cached publicly (Cache-Control: public with a max-age,
+e.g. record pages, see conditional) are stored in the Django cache named by
+settings.COMPRESSION_CACHE already compressed, one entry per encoding, for
+up to settings.COMPRESSION_CACHE_TTL seconds or until the next generation
+(see conditional.generation).  Hot pages are then served without rendering
+or recompressing; bodies stored in the cache are compressed harder since it
+only happens once.
+
+Streaming responses (exports, sitemaps) are compressed incrementally, one
+flushed block per chunk, so nothing is buffered.
+"""
+import gzip
+import zlib
+
+from django.conf import settings
+from django.core.cache import caches
+from django.http import HttpResponse
+from django.utils.cache import (
+    get_cache_key, get_conditional_response, get_max_age, learn_cache_key,
+    patch_vary_headers,
+)
+from django.utils.http import parse_http_date_safe
+
+from . import conditional
+from . import metrics
+
+# Preference order when the client accepts several
+ENCODINGS = ['br', 'gzip']
+COMPRESSIBLE_TYPES = [
+    'text/html', 'text/plain', 'text/css', 'text/csv', 'text/xml',
+    'application/json', 'application/xml', 'application/x-ndjson',
+    'application/javascript', 'text/javascript', 'application/rss+xml',
+]
+CACHE_KEY_PREFIX = 'namesdb-compressed'
+# Headers not stored with cached bodies
+UNCACHED_HEADERS = ['content-length', 'set-cookie']
+
+
+def enabled():
+    return getattr(settings, 'COMPRESSION_ENABLED', False)
+
+_brotli = None
+
+def brotli():
+    """The brotli module (Brotli or brotlicffi), or None if not installed
+    """
+    global _brotli
+    if _brotli is None:
+        try:
+            import brotli as module
+        except ImportError:
+            try:
+                import brotlicffi as module
+            except ImportError:
+                module = False
+        _brotli = module
+    return _brotli or None
+
+def available():
+    return [e for e in ENCODINGS if e != 'br' or brotli()]
+
+
+# encoding -------------------------------------------------------------
+
+def negotiate(accept_encoding):
+    """Best available encoding the client accepts
+
+    @param accept_encoding: str Accept-Encoding header
+    @returns: str 'br', 'gzip', or None
+    """
+    accepted = {}
+    for item in accept_encoding.split(','):
+        name,_,params = item.strip().partition(';')
+        q = 1.0
+        if params.strip().startswith('q='):
+            try:
+                q = float(params.strip()[2:])
+            except ValueError:
+                q = 0
+        accepted[name.strip().lower()] = q
+    for encoding in available():
+        if accepted.get(encoding, accepted.get('*', 0)) > 0:
+            return encoding
+    return None
+
+def compress(data, encoding, level=None):
+    """Compress bytes
+
+    @param data: bytes
+    @param encoding: str 'br' or 'gzip'
+    @param level: int Brotli quality or gzip level (default from settings)
+    @returns: bytes
+    """
+    if encoding == 'br':
+        return brotli().compress(
+            data, quality=level or settings.COMPRESSION_BROTLI_QUALITY
+        )
+    return gzip.compress(
+        data, compresslevel=level or settings.COMPRESSION_GZIP_LEVEL, mtime=0
+    )
+
+def compress_stream(chunks, encoding):
+    """Compress an iterable of bytes incrementally
+
+    Each chunk is flushed so the client receives it without waiting for
+    the rest of the stream.
+
+    @param chunks: iterable of bytes
+    @param encoding: str 'br' or 'gzip'
+    @returns: generator of bytes
+    """
+    if encoding == 'br':
+        compressor = brotli().Compressor(quality=settings.COMPRESSION_BROTLI_QUALITY)
+        for chunk in chunks:
+            data = compressor.process(chunk) + compressor.flush()
+            if data:
+                yield data
+        yield compressor.finish()
+        return
+    # wbits=31: gzip container
+    compressor = zlib.compressobj(settings.COMPRESSION_GZIP_LEVEL, zlib.DEFLATED, 31)
+    for chunk in chunks:
+        data = compressor.compress(chunk) + compressor.flush(zlib.Z_SYNC_FLUSH)
+        if data:
+            yield data
+    yield compressor.flush()
+
+def compressible(response):
+    content_type = response.get('Content-Type', '').split(';')[0].strip().lower()
+    return (
+        content_type in COMPRESSIBLE_TYPES
+        and not response.has_header('Content-Encoding')
+    )
+
+def _weaken_etag(response):
+    # compressed and uncompressed bodies are not byte-for-byte equal
+    etag = response.get('ETag')
+    if etag and etag.startswith('"'):
+        response['ETag'] = f'W/{etag}'
+
+def compress_response(response, encoding):
+    """Compress response body in place, if worthwhile
+
+    @returns: response
+    """
+    patch_vary_headers(response, ['Accept-Encoding'])
+    if not encoding or not compressible(response):
+        return response
+    if response.streaming:
+        response.streaming_content = compress_stream(
+            response.streaming_content, encoding
+        )
+        del response['Content-Length']
+    else:
+        if len(response.content) < settings.COMPRESSION_MIN_SIZE:
+            return response
+        compressed = compress(response.content, encoding)
+        if len(compressed) >= len(response.content):
+            return response
+        response.content = compressed
+        response['Content-Length'] = str(len(compressed))
+    _weaken_etag(response)
+    response['Content-Encoding'] = encoding
+    return response
+
+
+# cache of compressed responses ----------------------------------------
+
+def _cache():
+    if not settings.COMPRESSION_CACHE:
+        return None
+    return caches[settings.COMPRESSION_CACHE]
+
+def _key_prefix(encoding):
+    # a new generation (reindex or deploy) invalidates cached pages
+    label,_ = conditional.generation()
+    return f'{CACHE_KEY_PREFIX}-{label}-{encoding or "identity"}'
+
+def cacheable(request, response):
+    """Cache-Control: public with a max-age, no cookies, 200 GET
+    """
+    cache_control = response.get('Cache-Control', '')
+    return (
+        request.method == 'GET'
+        and response.status_code == 200
+        and not response.streaming
+        and 'public' in cache_control
+        and 'private' not in cache_control
+        and (get_max_age(response) or 0) > 0
+        and not response.cookies
+    )
+
+def _timeout(response):
+    return min(get_max_age(response), settings.COMPRESSION_CACHE_TTL)
+
+def _entry(response, encoding):
+    """Cache entry: (status, headers, body) with the body compressed
+    """
+    body = response.content
+    headers = [
+        (key, value) for key,value in response.items()
+        if key.lower() not in UNCACHED_HEADERS
+    ]
+    if encoding and compressible(response) \
+    and len(body) >= settings.COMPRESSION_MIN_SIZE:
+        compressed = compress(body, encoding, _cache_level(encoding))
+        if len(compressed) < len(body):
+            body = compressed
+            headers.append(('Content-Encoding', encoding))
+    return (response.status_code, headers, body)
+
+def _cache_level(encoding):
+    if encoding == 'br':
+        return settings.COMPRESSION_CACHE_BROTLI_QUALITY
+    return settings.COMPRESSION_CACHE_GZIP_LEVEL
+
+def _response(entry):
+    status,headers,body = entry
+    response = HttpResponse(body, status=status)
+    for key,value in headers:
+        response[key] = value
+    if response.has_header('Content-Encoding'):
+        _weaken_etag(response)
+    response['Content-Length'] = str(len(body))
+    patch_vary_headers(response, ['Accept-Encoding'])
+    return response
+
+def cached_response(request, encoding):
+    """Cached response for request in ENCODING, or None
+
+    Answers 304 if the client's copy is current.
+    """
+    cache = _cache()
+    if cache is None or request.method not in ['GET', 'HEAD']:
+        return None
+    key = get_cache_key(request, _key_prefix(encoding), 'GET', cache=cache)
+    if not key:
+        # never cached a response for this URL
+        return None
+    entry = cache.get(key)
+    metrics.cache_result('compressed', entry is not None)
+    if entry is None:
+        return None
+    response = _response(entry)
+    return get_conditional_response(
+        request, etag=response.get('ETag'),
+        last_modified=parse_http_date_safe(response.get('Last-Modified', '')),
+        response=response,
+    )
+
+def store(request, response, encoding):
+    """Cache response compressed with ENCODING, if it may be cached
+
+    @returns: HttpResponse Served from the cache entry (already compressed),
+              or None if not cacheable
+    """
+    cache = _cache()
+    if cache is None or not cacheable(request, response):
+        return None
+    timeout = _timeout(response)
+    key = learn_cache_key(
+        request, response, timeout, _key_prefix(encoding), cache=cache
+    )
+    entry = _entry(response, encoding)
+    cache.set(key, entry, timeout)
+    return _response(entry)
@@ -0,0 +1,265 @@
+"""Conditional GET for record detail pages and API
+
+Person, FAR and WRA records carry a `timestamp`, and FAR pages never
+change, so their responses get validators (ETag and Last-Modified) and a
+Cache-Control header that lets nginx and CDNs cache them.  Revalidations
+(If-None-Match / If-Modified-Since) are checked before the record is
+fetched, formatted, or rendered:
+
+    record   one lookup of the record's timestamp (_source filtered), or none
+             if its validators are in the per-process cache
+    farpage  no lookup at all
+
+Validators combine the record timestamp with the "generation": the time of
+the last reindex or deploy, settings.CONDITIONAL_GENERATION (ISO datetime).
+If that is blank the newest modification time of this app's code and
+templates (under settings.BASE_DIR) is used, so a deploy invalidates
+cached pages.
+
+    @conditional.record('person')
+    def person(request, naan, noid): ...
+"""
+import asyncio
+from collections import OrderedDict
+from datetime import datetime, timezone
+from functools import wraps
+import hashlib
+from pathlib import Path
+import threading
+import time
+
+from django.conf import settings
+from django.utils.cache import (
+    get_conditional_response, patch_cache_control, patch_vary_headers
+)
+from django.utils.http import http_date
+
+from . import models
+
+# Max records in the validator cache
+CACHE_SIZE = 10000
+
+
+def enabled():
+    return getattr(settings, 'CONDITIONAL_ENABLED', False)
+
+
+# validators -----------------------------------------------------------
+
+_generation = None
+
+def generation():
+    """Label and time (epoch seconds) of the current data and code
+
+    @returns: (str, float)
+    """
+    global _generation
+    if _generation is None or _generation[0] != settings.CONDITIONAL_GENERATION:
+        if settings.CONDITIONAL_GENERATION:
+            when = _epoch(settings.CONDITIONAL_GENERATION)
+        else:
+            when = max(
+                path.stat().st_mtime for path in Path(settings.BASE_DIR).rglob('*')
+                if path.suffix in ['.py', '.html']
+            )
+        _generation = (settings.CONDITIONAL_GENERATION, int(when))
+    return f'{_generation[1]}', _generation[1]
+
+def _epoch(timestamp):
+    """Epoch seconds of an ISO datetime string (naive means UTC), or None
+    """
+    try:
+        dt = datetime.fromisoformat(str(timestamp))
+    except ValueError:
+        return None
+    if dt.tzinfo is None:
+        dt = dt.replace(tzinfo=timezone.utc)
+    return dt.timestamp()
+
+def validators(*parts, timestamp=None):
+    """ETag and Last-Modified for a response
+
+    @param parts: str Identify the resource
+    @param timestamp: str Record timestamp (ISO)
+    @returns: (etag, last_modified epoch seconds)
+    """
+    label,generated = generation()
+    digest = hashlib.sha1(
+        ':'.join([label, *parts, str(timestamp)]).encode()
+    ).hexdigest()[:20]
+    modified = max(generated, _epoch(timestamp) or 0)
+    # weak: the same record is served compressed or not
+    return f'W/"{digest}"', int(modified)
+
+
+class ValidatorCache():
+    """Validators of recently requested records (per process)
+    """
+
+    def __init__(self, size=CACHE_SIZE):
+        self.size = size
+        self.items = OrderedDict()  # key: (validators, expires)
+        self.lock = threading.Lock()
+
+    def get(self, key):
+        with self.lock:
+            item = self.items.get(key)
+            if item and item[1] > time.monotonic():
+                self.items.move_to_end(key)
+                return item[0]
+        return None
+
+    def set(self, key, value, ttl):
+        with self.lock:
+            self.items[key] = (value, time.monotonic() + ttl)
+            self.items.move_to_end(key)
+            while len(self.items) > self.size:
+                self.items.popitem(last=False)
+
+    def clear(self):
+        with self.lock:
+            self.items.clear()
+
+CACHE = ValidatorCache()
+
+def record_validators(model, oid):
+    """Validators for a record, or None if there is no such record
+    """
+    key = (model, oid)
+    cached = CACHE.get(key)
+    if cached:
+        return cached
+    source = models.docstore_fields(model, oid, ['timestamp'])
+    if source is None:
+        return None
+    value = validators(model, oid, timestamp=source.get('timestamp'))
+    CACHE.set(key, value, settings.CONDITIONAL_VALIDATOR_TTL)
+    return value
+
+async def arecord_validators(model, oid):
+    """Async version of record_validators"""
+    key = (model, oid)
+    cached = CACHE.get(key)
+    if cached:
+        return cached
+    source = await models.adocstore_fields(model, oid, ['timestamp'])
+    if source is None:
+        return None
+    value = validators(model, oid, timestamp=source.get('timestamp'))
+    CACHE.set(key, value, settings.CONDITIONAL_VALIDATOR_TTL)
+    return value
+
+
+# decorators -----------------------------------------------------------
+
+def _object_id(kwargs):
+    if 'naan' in kwargs:
+        return f"{kwargs['naan']}/{kwargs['noid']}"
+    return kwargs['object_id']
+
+def _applies(request):
+    return enabled() and request.method in ['GET', 'HEAD']
+
+def _respond(request, value, max_age, vary, view, *args, **kwargs):
+    """304 if the client's copy is current, else the view's response
+
+    Both get validators and Cache-Control.
+    """
+    etag,last_modified = value
+    response = get_conditional_response(
+        request, etag=etag, last_modified=last_modified
+    )
+    if response is None:
+        response = view(request, *args, **kwargs)
+    return _headers(response, value, max_age, vary)
+
+async def _arespond(request, value, max_age, vary, view, *args, **kwargs):
+    etag,last_modified = value
+    response = get_conditional_response(
+        request, etag=etag, last_modified=last_modified
+    )
+    if response is None:
+        response = await view(request, *args, **kwargs)
+    return _headers(response, value, max_age, vary)
+
+def _headers(response, value, max_age, vary):
+    if response.status_code not in [200, 304]:
+        return response
+    etag,last_modified = value
+    response['ETag'] = etag
+    response['Last-Modified'] = http_date(last_modified)
+    patch_cache_control(
+        response, public=True,
+        max_age=max_age, s_maxage=max(max_age, settings.CONDITIONAL_S_MAXAGE),
+    )
+    if vary:
+        patch_vary_headers(response, vary)
+    return response
+
+def record(model, vary=None):
+    """Conditional GET for a record detail view (sync or async)
+
+    @param model: str 'person', 'farrecord', 'wrarecord'
+    @param vary: list Headers the response varies on (e.g. ['Accept'])
+    """
+    def decorator(view):
+        if asyncio.iscoroutinefunction(view):
+            @wraps(view)
+            async def async_wrapper(request, *args, **kwargs):
+                if not _applies(request):
+                    return await view(request, *args, **kwargs)
+                value = await arecord_validators(model, _object_id(kwargs))
+                request.conditional_validators = value
+                if value is None:
+                    return await view(request, *args, **kwargs)
+                return await _arespond(
+                    request, value, settings.CONDITIONAL_MAX_AGE, vary,
+                    view, *args, **kwargs
+                )
+            return async_wrapper
+        @wraps(view)
+        def wrapper(request, *args, **kwargs):
+            if not _applies(request):
+                return view(request, *args, **kwargs)
+            value = record_validators(model, _object_id(kwargs))
+            # HEAD views can tell from this whether the record exists
+            request.conditional_validators = value
+            if value is None:
+                return view(request, *args, **kwargs)
+            return _respond(
+                request, value, settings.CONDITIONAL_MAX_AGE, vary,
+                view, *args, **kwargs
+            )
+        return wrapper
+    return decorator
+
+def farpage(vary=None):
+    """Conditional GET for a FAR page view (sync or async); no lookups
+
+    FAR pages never change so they are cached for CONDITIONAL_FARPAGE_MAX_AGE.
+    """
+    def decorator(view):
+        def value(kwargs):
+            return validators(
+                'farpage', kwargs['facility_id'], str(kwargs['far_page'])
+            )
+        if asyncio.iscoroutinefunction(view):
+            @wraps(view)
+            async def async_wrapper(request, *args, **kwargs):
+                if not _applies(request):
+                    return await view(request, *args, **kwargs)
+                return await _arespond(
+                    request, value(kwargs), settings.CONDITIONAL_FARPAGE_MAX_AGE,
+                    vary, view, *args, **kwargs
+                )
+            return async_wrapper
+        @wraps(view)
+        def wrapper(request, *args, **kwargs):
+            if not _applies(request):
+                return view(request, *args, **kwargs)
+            return _respond(
+                request, value(kwargs), settings.CONDITIONAL_FARPAGE_MAX_AGE,
+                vary, view, *args, **kwargs
+            )
+        return wrapper
+    return decorator
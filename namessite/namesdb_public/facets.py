@@ -0,0 +1,118 @@
+"""Search facets (aggregations) fetched apart from hits, and cached
+
+The search form's facets (citizenship, birth year, camp, ...) are terms
+aggregations over every match, and cost far more than the page of hits.
+They depend only on the query and filters, not on the page, so
+models.execute_search splits each search in two:
+
+    hits    the page of results, no aggregations
+    facets  size 0, aggregations only
+
+Facets are kept in the Django cache named by settings.FACETS_CACHE, keyed
+by the facet search body and the generation (see conditional.generation).
+On a miss both searches go out in one msearch request; on a hit (paging,
+or another user's identical search) only the hits search does.
+"""
+import hashlib
+import json
+import logging
+logger = logging.getLogger(__name__)
+
+from django.conf import settings
+from django.core.cache import caches
+
+from . import metrics
+
+CACHE_KEY_PREFIX = 'namesdb-facets'
+
+
+def split(s):
+    """Hits and facets searches for S
+
+    @param s: elasticsearch_dsl.Search (sliced)
+    @returns: (hits Search, facets Search) or (S, None) if S has no aggregations
+    """
+    if not s.aggs.to_dict():
+        return s,None
+    hits = s._clone()
+    hits.aggs._params = {'aggs': {}}
+    # a sort or highlight is no use without hits
+    facets = s[0:0].sort()
+    facets._highlight = {}
+    return hits,facets
+
+def _cache():
+    if not settings.FACETS_CACHE:
+        return None
+    return caches[settings.FACETS_CACHE]
+
+def cache_key(facets):
+    from . import conditional
+    label,_ = conditional.generation()
+    body = json.dumps(
+        [facets._index, facets.to_dict(), facets._params], sort_keys=True, default=str
+    )
+    return f'{CACHE_KEY_PREFIX}-{label}-{hashlib.sha1(body.encode()).hexdigest()}'
+
+def cached(facets):
+    """Cached aggregations for a facets search, or None
+
+    @param facets: elasticsearch_dsl.Search or None
+    @returns: dict or None
+    """
+    cache = _cache()
+    if facets is None or cache is None:
+        return None
+    aggregations = cache.get(cache_key(facets))
+    metrics.cache_result('facets', aggregations is not None)
+    return aggregations
+
+def store(facets, raw):
+    """Aggregations of a facets search response; cached unless it failed
+
+    @param facets: elasticsearch_dsl.Search
+    @param raw: dict msearch response
+    @returns: dict
+    """
+    aggregations = _aggregations(facets, raw)
+    cache = _cache()
+    if aggregations is not None and cache is not None:
+        cache.set(cache_key(facets), aggregations, settings.FACETS_CACHE_TTL)
+    return {} if aggregations is None else aggregations
+
+async def acached(facets):
+    """Async version of cached"""
+    cache = _cache()
+    if facets is None or cache is None:
+        return None
+    aggregations = await cache.aget(cache_key(facets))
+    metrics.cache_result('facets', aggregations is not None)
+    return aggregations
+
+async def astore(facets, raw):
+    """Async version of store"""
+    aggregations = _aggregations(facets, raw)
+    cache = _cache()
+    if aggregations is not None and cache is not None:
+        await cache.aset(cache_key(facets), aggregations, settings.FACETS_CACHE_TTL)
+    return {} if aggregations is None else aggregations
+
+def _aggregations(facets, raw):
+    """Aggregations of a facets search response, or None if it failed
+    """
+    if 'error' in raw:
+        # hits are still shown, without facets
+        logger.error(f"facets {facets._index}: {raw['error']}")
+        return None
+    return raw.get('aggregations', {})
+
+def merge(raw, aggregations):
+    """Hits response with AGGREGATIONS added, as if from one search
+
+    @param raw: dict
+    @param aggregations: dict or None
+    @returns: dict
+    """
+    if aggregations is None:
+        return raw
+    return dict(raw, aggregations=aggregations)
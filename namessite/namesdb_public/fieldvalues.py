@@ -0,0 +1,138 @@
+"""Every distinct value of a facet field, and its count
+
+Facet fields (models.AGG_FIELDS_*) like preexclusion_residence_city or
+birthplace have more values than a terms aggregation should return in one
+go.  models.composite_values pages through them with a composite
+aggregation; this module streams them to API clients as NDJSON
+
+    {"value": "Los Angeles", "count": 1234}
+    ...
+    {"summary": {"model": "person", "field": "...", "values": 5678, "complete": true}}
+
+and keeps the pages in the settings.FIELD_VALUES_CACHE Django cache, keyed
+by the generation (see conditional.generation).  Clients can resume an
+interrupted stream with `after`, the last value they received.
+"""
+import hashlib
+import json
+import logging
+logger = logging.getLogger(__name__)
+
+from django.conf import settings
+from django.core.cache import caches
+
+from elastictools.docstore import elasticsearch_dsl as dsl
+
+from . import metrics
+from . import models
+
+CACHE_KEY_PREFIX = 'namesdb-fieldvalues'
+FIELDS = {
+    'person': models.AGG_FIELDS_PERSON,
+    'farrecord': models.AGG_FIELDS_FARRECORD,
+    'wrarecord': models.AGG_FIELDS_WRARECORD,
+}
+
+
+def check(model, field):
+    """@raises: KeyError if FIELD is not a facet field of MODEL
+    """
+    if field not in FIELDS.get(model, {}):
+        raise KeyError(f'{model} has no facet field "{field}"')
+
+def _cache():
+    if not settings.FIELD_VALUES_CACHE:
+        return None
+    return caches[settings.FIELD_VALUES_CACHE]
+
+def cache_key(model, field, after=None):
+    from . import conditional
+    label,_ = conditional.generation()
+    page = 'first' if after is None else hashlib.sha1(str(after).encode()).hexdigest()
+    return f'{CACHE_KEY_PREFIX}-{label}-{model}-{field}-{page}'
+
+def cached(model, field, after=None):
+    """One cached page of an enumeration, or None
+
+    @returns: (list of [value, count], next after or None) or None
+    """
+    cache = _cache()
+    if cache is None:
+        return None
+    page = cache.get(cache_key(model, field, after))
+    metrics.cache_result('fieldvalues', page is not None)
+    return page
+
+def iterate(model, field, after=None):
+    """Values and counts of a facet field, from the cache or Elasticsearch
+
+    Values are cached a page (settings.FIELD_VALUES_PAGE_SIZE) at a time,
+    keyed by the value the page starts after, so no single cache entry
+    grows with the field (memcached refuses items over 1 MB) and a client
+    resuming at a page boundary is served from the cache.  Pages are read
+    from the cache until one is missing, then from Elasticsearch.  Pages
+    read from Elasticsearch are cached only if they start at a page
+    boundary, so arbitrary AFTER values don't fill the cache.
+
+    @param model: str 'person', 'farrecord', 'wrarecord'
+    @param field: str (see check)
+    @param after: Start after this value
+    @returns: generator of (value, count)
+    """
+    aligned = after is None
+    while True:
+        page = cached(model, field, after)
+        if page is None:
+            break
+        aligned = True
+        values,after = page
+        for value,count in values:
+            yield value,count
+        if after is None:
+            return
+    s = dsl.Search(
+        using=models.get_docstore().es, index=models.MODELS_DOCTYPES[model]
+    )
+    cache = _cache() if aligned else None
+    page_size = settings.FIELD_VALUES_PAGE_SIZE
+    values = []
+    for value,count in models.composite_values(s, field, after, page_size):
+        values.append([value, count])
+        yield value,count
+        if len(values) == page_size:
+            if cache is not None:
+                cache.set(
+                    cache_key(model, field, after), (values, value),
+                    settings.FIELD_VALUES_CACHE_TTL
+                )
+            after = value
+            values = []
+    if cache is not None:
+        cache.set(
+            cache_key(model, field, after), (values, None),
+            settings.FIELD_VALUES_CACHE_TTL
+        )
+
+def stream(model, field, after=None):
+    """Values and counts as NDJSON lines, then a summary
+
+    A failure partway through ends the stream with an {"error": ...} line
+    and a summary with "complete": false.
+
+    @param model: str 'person', 'farrecord', 'wrarecord'
+    @param field: str (see check)
+    @param after: Start after this value
+    @returns: generator of bytes
+    """
+    n = 0
+    complete = True
+    try:
+        for value,count in iterate(model, field, after):
+            n += 1
+            yield (json.dumps({'value': value, 'count': count}) + '\n').encode()
+    except Exception as err:
+        logger.error(f'field values {model} {field}: {err}')
+        complete = False
+        yield (json.dumps({'error': str(err)}) + '\n').encode()
+    summary = {'model': model, 'field': field, 'values': n, 'complete': complete}
+    yield (json.dumps({'summary': summary}) + '\n').encode()
@@ -0,0 +1,179 @@
+"""Choice lists and pretty labels for search form fields
+
+Facility choices used to be loaded with a full scan of the facility index
+when forms.py was imported, so every worker waited for Elasticsearch at
+boot and never saw new facilities until restarted.  Now they are loaded on
+first use and kept for settings.FORMS_CHOICES_TTL seconds, after which the
+stale values keep being served while a background thread reloads them.
+
+Each successful load is written to settings.FORMS_CHOICES_SNAPSHOT.  A
+fresh worker starts from the snapshot if there is one, so neither boot nor
+the first request has to wait for (or fail because of) Elasticsearch.
+
+    >>> from namesdb_public import formchoices
+    >>> formchoices.choices()
+    {'facility_id-choices': [('1-topaz', 'Topaz'), ...]}
+    >>> formchoices.labels()
+    {'facility_id': {'1-topaz': 'Topaz', ...}}
+"""
+import json
+import logging
+logger = logging.getLogger(__name__)
+import os
+from pathlib import Path
+import tempfile
+import threading
+import time
+
+from django.conf import settings
+
+from . import metrics
+from . import models
+
+
+def facility_choices():
+    return [
+        (f['facility_id'], f['title']) for f in models.Facility.facilities()
+    ]
+
+# field: function returning list of (value, label)
+LOADERS = {
+    'facility_id': facility_choices,
+}
+
+
+class Registry():
+    """Lazily loaded, TTL-refreshed choices with a disk snapshot fallback
+    """
+
+    def __init__(self, loaders=LOADERS):
+        self.loaders = loaders
+        self.lock = threading.Lock()
+        self.data = None        # {field: [(value, label), ...]}
+        self.label_map = None   # {field: {value: label}}
+        self.loaded = 0         # time of last successful load
+        self.attempted = 0      # time of last load attempt
+        self.refreshing = False
+
+    def _set(self, data, loaded):
+        self.data = data
+        self.label_map = {
+            field: {value: label for value,label in items}
+            for field,items in data.items()
+        }
+        self.loaded = loaded
+
+    def load(self):
+        """Load all choices from their sources and save a snapshot
+
+        @returns: bool Success
+        """
+        self.attempted = time.time()
+        try:
+            data = {
+                field: [tuple(item) for item in loader()]
+                for field,loader in self.loaders.items()
+            }
+        except Exception as err:
+            logger.warning(f'Could not load form choices: {err}')
+            metrics.inc('namesdb_choices_loads_total', result='error')
+            return False
+        with self.lock:
+            self._set(data, time.time())
+        metrics.inc('namesdb_choices_loads_total', result='ok')
+        self.save_snapshot()
+        return True
+
+    def save_snapshot(self):
+        path = Path(settings.FORMS_CHOICES_SNAPSHOT)
+        try:
+            # write-then-rename so other workers never read a partial file
+            with tempfile.NamedTemporaryFile(
+                    'w', dir=path.parent, prefix=f'.{path.name}', delete=False
+            ) as f:
+                json.dump({'loaded': self.loaded, 'data': self.data}, f)
+            os.replace(f.name, path)
+        except OSError as err:
+            logger.warning(f'Could not write {path}: {err}')
+
+    def load_snapshot(self):
+        """@returns: bool Success"""
+        try:
+            with open(settings.FORMS_CHOICES_SNAPSHOT, 'r') as f:
+                snapshot = json.load(f)
+            data = {
+                field: [tuple(item) for item in items]
+                for field,items in snapshot['data'].items()
+            }
+        except (OSError, ValueError, KeyError, TypeError):
+            return False
+        with self.lock:
+            self._set(data, snapshot['loaded'])
+        metrics.inc('namesdb_choices_loads_total', result='snapshot')
+        return True
+
+    def _refresh(self):
+        try:
+            self.load()
+        finally:
+            self.refreshing = False
+
+    def refresh_in_background(self):
+        with self.lock:
+            if self.refreshing:
+                return
+            self.refreshing = True
+        threading.Thread(target=self._refresh, daemon=True).start()
+
+    def ensure(self):
+        """Make sure there is something to serve, refreshing if stale
+        """
+        if not settings.DOCSTORE_ENABLED:
+            if self.data is None:
+                self._set({field: [] for field in self.loaders.keys()}, 0)
+            return
+        now = time.time()
+        if self.data is None:
+            # Nothing to serve yet: load now, but don't retry on every
+            # request if Elasticsearch is down.
+            if now - self.attempted < settings.FORMS_CHOICES_RETRY:
+                return
+            if not self.load_snapshot():
+                self.load()
+            if self.data is None:
+                return
+        stale = now - self.loaded >= settings.FORMS_CHOICES_TTL
+        retry = now - self.attempted >= settings.FORMS_CHOICES_RETRY
+        if stale and retry:
+            self.refresh_in_background()
+
+    def choices(self):
+        """{'FIELD-choices': [(value, label), ...]}
+        """
+        self.ensure()
+        return {
+            f'{field}-choices': list(items)
+            for field,items in (self.data or {}).items()
+        }
+
+    def labels(self):
+        """{FIELD: {value: label}}
+        """
+        self.ensure()
+        return self.label_map or {}
+
+    def reset(self):
+        with self.lock:
+            self.data = None
+            self.label_map = None
+            self.loaded = 0
+            self.attempted = 0
+
+
+REGISTRY = Registry()
+
+def choices():
+    return REGISTRY.choices()
+
+def labels():
+    return REGISTRY.labels()
@@ -7,52 +7,42 @@ from django import forms
 from django.conf import settings
 from django.core.cache import cache
 
+from . import formchoices
 from . import models
+from . import years
 
-# sorted version of facility and topics tree as choice fields
-# {
-#     'topics-choices': [
-#         [u'topics-1', u'Immigration and citizenship'],
-#         ...
-#     ],
-#     'facility-choices: [...],
-# }
-#FORMS_CHOICES = docstore.Docstore().es.get(
-#    doc_type='forms',
-#    id='forms-choices'
-#)['_source']
 # TODO should not be hard-coded - move to ddr-vocabs?
-if settings.DOCSTORE_ENABLED:
-    FORMS_CHOICES = {
-        'facility_id-choices': [
-            (f['facility_id'], f['title']) for f in models.Facility.facilities()
-        ],
-    }
-else:
-    FORMS_CHOICES = {'facility_id-choices': []}
 FORMS_CHOICES_DEFAULT = {
     'facility': [
         ('', 'All Camps'),
     ],
 }
 
-# Pretty labels for multiple choice fields
+# Choice lists and pretty labels for multiple choice fields are loaded
+# lazily and refreshed periodically (see formchoices.py), so that importing
+# this module does not touch Elasticsearch.
 # (After initial search the choice lists come from search aggs lists
 # which only include IDs and doc counts.)
+# FORMS_CHOICES
+# {
+#     'facility_id-choices': [
+#         (u'1-topaz', u'Topaz'),
+#         ...
+#     ],
+# }
+# FORMS_CHOICE_LABELS
 # {
-#     'topics': {
-#         '1': u'Immigration and citizenship',
+#     'facility_id': {
+#         '1-topaz': u'Topaz',
 #         ...
 #     },
-#     'facility: {...},
 # }
-FORMS_CHOICE_LABELS = {}
-for key in FORMS_CHOICES.keys():
-    field = key.replace('-choices','')
-    FORMS_CHOICE_LABELS[field] = {
-        key: val
-        for key,val in FORMS_CHOICES[key]
-    }
+def __getattr__(name):
+    if name == 'FORMS_CHOICES':
+        return formchoices.choices()
+    if name == 'FORMS_CHOICE_LABELS':
+        return formchoices.labels()
+    raise AttributeError(f'module {__name__!r} has no attribute {name!r}')
 
 
 class SearchForm(forms.Form):
@@ -83,13 +73,40 @@ class SearchForm(forms.Form):
             ),
         ]
         
+        # birth year range; the year facet is a histogram (see years)
+        distribution = []
+        if search_results and search_results.aggregations:
+            for fieldname in models.YEAR_FIELDS.values():
+                distribution += years.buckets(search_results.aggregations, fieldname)
+        for param,placeholder in [(years.PARAM_MIN, 'Born from'), (years.PARAM_MAX, 'to')]:
+            fields.append((
+                param,
+                forms.IntegerField(
+                    required=False,
+                    min_value=0,
+                    max_value=9999,
+                    help_text=', '.join(
+                        f'{low}-{high} ({count})' for low,high,count in distribution
+                    ) if param == years.PARAM_MIN else '',
+                    widget=forms.NumberInput(
+                        attrs={
+                            'class': 'form-control',
+                            'placeholder': placeholder,
+                        }
+                    ),
+                )
+            ))
+        
         # fill in options and doc counts from aggregations
         if search_results and search_results.aggregations:
+            choice_labels = formchoices.labels()
             for fieldname,aggs in search_results.aggregations.items():
+                if distribution and fieldname in models.YEAR_FIELDS.values():
+                    continue
                 choices = []
                 for item in aggs:
                     try:
-                        label = FORMS_CHOICE_LABELS[fieldname][item['key']]
+                        label = choice_labels[fieldname][item['key']]
                     except:
                         label = item['key']
                     choice = (
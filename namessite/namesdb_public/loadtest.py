@@ -0,0 +1,354 @@
+"""Load test: replay a mix of realistic traffic against a running site
+
+Each simulated user repeatedly picks a scenario according to the mix
+weights and runs its sequence of requests:
+
+    person   Person detail page
+    farpage  FAR page browsing: a walk of prev/next links from a random page
+    search   Faceted person search, sometimes followed by a filter and page 2
+    api      API list paging (limit/offset)
+    crawl    Crawler-style deep pagination through search results
+
+Names, IDs, and FAR pages come from an access log sample (see accesslog)
+or from sampledata, which matches what the memory docstore backend serves.
+
+    python manage.py loadtest http://127.0.0.1:8000 --users 8 --duration 60
+    python manage.py loadtest --inprocess --mix person=1,search=1
+"""
+from collections import defaultdict
+import random
+import re
+import threading
+import time
+from urllib.parse import urlencode
+
+from django.urls import reverse
+import httpx
+
+from . import accesslog
+from . import sampledata
+
+SCENARIOS = ['person', 'farpage', 'search', 'api', 'crawl']
+DEFAULT_MIX = {
+    'person': 40,
+    'farpage': 20,
+    'search': 25,
+    'api': 10,
+    'crawl': 5,
+}
+FARPAGE_WALK = (3, 12)    # min, max pages per FAR page browsing session
+CRAWL_PAGES = (5, 40)     # min, max result pages per crawl
+API_PAGES = (1, 5)
+API_LIMIT = 25
+SEARCH_FACETS = ['gender', 'citizenship', 'preexclusion_residence_state']
+
+PERSON_PATH = re.compile(r'/persons/(?P<naan>[^/]+)/(?P<noid>[^/]+)')
+FARPAGE_PATH = re.compile(r'/farpages/(?P<facility_id>[^/]+)/(?P<far_page>\d+)')
+
+
+def parse_mix(text):
+    """Parse "person=40,search=20" into a weights dict
+    """
+    mix = {}
+    for item in text.split(','):
+        name,weight = item.split('=')
+        name = name.strip()
+        if name not in SCENARIOS:
+            raise ValueError(f'Unknown scenario "{name}"')
+        mix[name] = float(weight)
+    return mix
+
+
+class Workload():
+    """Pools of IDs and search terms to draw requests from
+
+    Pools keep duplicates so random.choice reproduces the frequencies seen
+    in an access log.
+    """
+
+    def __init__(self, nr_ids=[], terms=[], farpages=[], facets=[]):
+        self.nr_ids = list(nr_ids)
+        self.terms = list(terms)
+        self.farpages = list(farpages)   # (facility_id, far_page)
+        self.facets = list(facets)       # (field, value)
+        self.last_page = defaultdict(int)
+        for facility_id,far_page in self.farpages:
+            self.last_page[facility_id] = max(
+                self.last_page[facility_id], far_page
+            )
+
+    def __repr__(self):
+        return (
+            f'<Workload nr_ids:{len(self.nr_ids)} terms:{len(self.terms)} '
+            f'farpages:{len(self.farpages)} facets:{len(self.facets)}>'
+        )
+
+    @staticmethod
+    def from_sampledata(persons=1000, seed=0):
+        """Workload matching the memory backend's synthetic data
+        """
+        nr_ids = []; farpages = []; facets = set()
+        for index,_,source in sampledata.generate(persons, seed):
+            if index == 'namesperson':
+                nr_ids.append(source['nr_id'])
+                for field in SEARCH_FACETS:
+                    if source.get(field):
+                        facets.add((field, source[field]))
+            elif index == 'namesfarpage':
+                farpages.append((source['facility_id'], int(source['page'])))
+        terms = sampledata.FAMILY_NAMES + [
+            name
+            for names in list(sampledata.GIVEN_NAMES_ISSEI.values()) \
+                + list(sampledata.GIVEN_NAMES_NISEI.values())
+            for name in names
+        ]
+        return Workload(nr_ids, terms, farpages, sorted(facets))
+
+    @staticmethod
+    def from_access_log(paths, fallback=None):
+        """Workload drawn from successful GETs in access logs
+
+        @param paths: str or list Log files
+        @param fallback: Workload Used for any pool the logs leave empty
+        @returns: Workload
+        """
+        nr_ids = []; terms = []; farpages = []; facets = []
+        for entry in accesslog.entries(paths):
+            path = entry['url_path']
+            if m := PERSON_PATH.search(path):
+                nr_ids.append(f"{m.group('naan')}/{m.group('noid')}")
+            elif m := FARPAGE_PATH.search(path):
+                farpages.append((m.group('facility_id'), int(m.group('far_page'))))
+            for term in entry['query'].get('fulltext', []):
+                terms.append(term)
+            for field in SEARCH_FACETS:
+                for value in entry['query'].get(field, []):
+                    facets.append((field, value))
+        if fallback:
+            nr_ids = nr_ids or fallback.nr_ids
+            terms = terms or fallback.terms
+            farpages = farpages or fallback.farpages
+            facets = facets or fallback.facets
+        return Workload(nr_ids, terms, farpages, facets)
+
+
+# scenarios ------------------------------------------------------------
+# Each returns a list of (endpoint, path) requests to make in order.
+
+def _query(path, params):
+    return f'{path}?{urlencode(params)}'
+
+def scenario_person(workload, rng):
+    naan,noid = rng.choice(workload.nr_ids).split('/')
+    return [('person', reverse('namespub-person', args=[naan,noid]))]
+
+def scenario_farpage(workload, rng):
+    facility_id,far_page = rng.choice(workload.farpages)
+    last_page = max(workload.last_page[facility_id], 1)
+    direction = rng.choice([1, -1])
+    steps = []
+    for _ in range(rng.randint(*FARPAGE_WALK)):
+        steps.append(
+            ('farpage', reverse('namespub-farpage', args=[facility_id,far_page]))
+        )
+        if not (1 <= far_page + direction <= last_page):
+            direction = -direction
+        far_page = min(max(far_page + direction, 1), last_page)
+    return steps
+
+def scenario_search(workload, rng):
+    path = reverse('namespub-persons')
+    params = [('fulltext', rng.choice(workload.terms))]
+    steps = [('search', _query(path, params))]
+    if workload.facets and rng.random() < 0.5:
+        params.append(rng.choice(workload.facets))
+        steps.append(('search_facet', _query(path, params)))
+    if rng.random() < 0.3:
+        steps.append(('search_page', _query(path, params + [('page', 2)])))
+    return steps
+
+def scenario_api(workload, rng):
+    path = reverse('namespub-api-persons')
+    return [
+        ('api_list', _query(path, [('limit', API_LIMIT), ('offset', n * API_LIMIT)]))
+        for n in range(rng.randint(*API_PAGES))
+    ]
+
+def scenario_crawl(workload, rng):
+    path = reverse('namespub-persons')
+    term = rng.choice(workload.terms)
+    return [
+        ('crawl', _query(path, [('fulltext', term), ('page', page)]))
+        for page in range(1, rng.randint(*CRAWL_PAGES) + 1)
+    ]
+
+SCENARIO_FUNCTIONS = {
+    'person': scenario_person,
+    'farpage': scenario_farpage,
+    'search': scenario_search,
+    'api': scenario_api,
+    'crawl': scenario_crawl,
+}
+
+
+# transports -----------------------------------------------------------
+
+class HttpTransport():
+    """Requests to a running site
+    """
+
+    def __init__(self, base_url, timeout=30):
+        self.client = httpx.Client(
+            base_url=base_url.rstrip('/'), timeout=timeout,
+            follow_redirects=True,
+        )
+
+    def get(self, path):
+        """@returns: int HTTP status"""
+        return self.client.get(path).status_code
+
+
+class ClientTransport():
+    """In-process requests using the Django test client
+    """
+
+    def __init__(self):
+        from django.test import Client
+        # The test client's exception capture is process-global, so with
+        # several threads one request's error would surface in another's.
+        self.client = Client(raise_request_exception=False)
+
+    def get(self, path):
+        return self.client.get(path, follow=True).status_code
+
+
+# running --------------------------------------------------------------
+
+def percentile(values, p):
+    """Nearest-rank percentile of sorted values
+    """
+    if not values:
+        return 0
+    index = min(len(values) - 1, max(0, int(round(p / 100 * len(values))) - 1))
+    return values[index]
+
+
+class Stats():
+    """Latencies and errors per endpoint, shared by all user threads
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.latencies = defaultdict(list)
+        self.errors = defaultdict(int)
+        self.statuses = defaultdict(lambda: defaultdict(int))
+
+    def record(self, endpoint, status, seconds):
+        with self.lock:
+            self.latencies[endpoint].append(seconds)
+            self.statuses[endpoint][status] += 1
+            if not status or status >= 400:
+                self.errors[endpoint] += 1
+
+    def report(self, elapsed):
+        """Summary per endpoint plus a 'total' row
+
+        @param elapsed: float Test duration in seconds
+        @returns: dict {endpoint: {requests, errors, error_rate, rps,
+                  mean, p50, p90, p99, max}}; latencies in ms
+        """
+        def summarize(latencies, errors):
+            latencies = sorted(latencies)
+            count = len(latencies)
+            return {
+                'requests': count,
+                'errors': errors,
+                'error_rate': errors / count if count else 0,
+                'rps': count / elapsed if elapsed else 0,
+                'mean': 1000 * sum(latencies) / count if count else 0,
+                'p50': 1000 * percentile(latencies, 50),
+                'p90': 1000 * percentile(latencies, 90),
+                'p99': 1000 * percentile(latencies, 99),
+                'max': 1000 * (latencies[-1] if latencies else 0),
+            }
+        with self.lock:
+            report = {
+                endpoint: summarize(latencies, self.errors[endpoint])
+                for endpoint,latencies in sorted(self.latencies.items())
+            }
+            report['total'] = summarize(
+                [l for latencies in self.latencies.values() for l in latencies],
+                sum(self.errors.values()),
+            )
+        return report
+
+
+def user(transport, workload, mix, stats, stop, seed, think=0, max_requests=None):
+    """One simulated user: run scenarios until stop is set
+
+    @param transport: HttpTransport or ClientTransport
+    @param workload: Workload
+    @param mix: dict {scenario: weight}
+    @param stats: Stats
+    @param stop: threading.Event
+    @param seed: int
+    @param think: float Max seconds to pause between requests
+    @param max_requests: int Stop after this many requests
+    """
+    rng = random.Random(seed)
+    scenarios = list(mix.keys())
+    weights = [mix[name] for name in scenarios]
+    made = 0
+    while not stop.is_set():
+        scenario = rng.choices(scenarios, weights)[0]
+        for endpoint,path in SCENARIO_FUNCTIONS[scenario](workload, rng):
+            if stop.is_set() or (max_requests and made >= max_requests):
+                return
+            start = time.perf_counter()
+            try:
+                status = transport.get(path)
+            except Exception:
+                status = 0
+            stats.record(endpoint, status, time.perf_counter() - start)
+            made += 1
+            if think:
+                time.sleep(rng.uniform(0, think))
+            # a real user (or crawler) has no link to follow from an error
+            if not status or status >= 400:
+                break
+
+def run(transport_factory, workload, mix=DEFAULT_MIX, users=4, duration=30,
+        requests=None, think=0, seed=0):
+    """Run a load test
+
+    @param transport_factory: callable returning a transport per user
+    @param workload: Workload
+    @param mix: dict {scenario: weight}
+    @param users: int Concurrent users (threads)
+    @param duration: float Seconds
+    @param requests: int Max requests per user (stops early)
+    @param think: float Max think time between requests (seconds)
+    @param seed: int
+    @returns: dict (see Stats.report)
+    """
+    stats = Stats()
+    stop = threading.Event()
+    threads = [
+        threading.Thread(
+            target=user,
+            args=(transport_factory(), workload, mix, stats, stop, seed + n,
+                  think, requests),
+            daemon=True,
+        )
+        for n in range(users)
+    ]
+    start = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    deadline = start + duration
+    for thread in threads:
+        thread.join(max(0, deadline - time.perf_counter()))
+    stop.set()
+    for thread in threads:
+        thread.join()
+    return stats.report(time.perf_counter() - start)
@@ -0,0 +1,71 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from namesdb_public import benchmarks
+
+
+class Command(BaseCommand):
+    help = 'Run hot-path benchmarks against synthetic data (no Elasticsearch needed).'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            'names', nargs='*',
+            help='Benchmarks to run (default: all).'
+        )
+        parser.add_argument(
+            '-l', '--list', action='store_true',
+            help='List benchmarks and exit.'
+        )
+        parser.add_argument(
+            '-r', '--repeat', type=int, default=benchmarks.REPEAT,
+            help='Timing runs per benchmark; the best is reported.'
+        )
+        parser.add_argument(
+            '-s', '--save', metavar='PATH',
+            help='Save results as a baseline file.'
+        )
+        parser.add_argument(
+            '-c', '--compare', metavar='PATH',
+            help='Compare with baseline file; exit nonzero on regression.'
+        )
+        parser.add_argument(
+            '-t', '--tolerance', type=float, default=benchmarks.TOLERANCE,
+            help='Allowed fractional slowdown/allocation growth when comparing.'
+        )
+
+    def handle(self, *args, **options):
+        if options['list']:
+            for name in benchmarks.BENCHMARKS.keys():
+                self.stdout.write(name)
+            return
+        baseline = None
+        if options['compare']:
+            baseline = benchmarks.load(options['compare'])
+        try:
+            results = benchmarks.run(options['names'], options['repeat'])
+        except KeyError as err:
+            raise CommandError(err.args[0])
+
+        self.stdout.write(f"{'benchmark':<32} {'ops/sec':>12} {'peak KiB':>10} {'baseline':>12}")
+        for name,result in results.items():
+            base = ''
+            if baseline and baseline['results'].get(name):
+                ratio = result['ops'] / baseline['results'][name]['ops']
+                base = f'{ratio:.2f}x'
+            self.stdout.write(
+                f"{name:<32} {result['ops']:>12,.1f} "
+                f"{result['peak_bytes'] / 1024:>10,.1f} {base:>12}"
+            )
+
+        if options['save']:
+            benchmarks.save(results, options['save'])
+            self.stdout.write(f"Saved {options['save']}")
+        if baseline:
+            regressions = benchmarks.compare(
+                results, baseline, options['tolerance']
+            )
+            for name,metric,base,current in regressions:
+                self.stderr.write(
+                    f'REGRESSION {name} {metric}: {base:,.1f} -> {current:,.1f}'
+                )
+            if regressions:
+                raise CommandError(f'{len(regressions)} regression(s)')
@@ -0,0 +1,107 @@
+import json
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.test.utils import override_settings
+
+from namesdb_public import loadtest
+
+
+class Command(BaseCommand):
+    help = 'Replay a mix of realistic traffic against a site and report latencies.'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            'url', nargs='?',
+            help='Base URL of the site e.g. http://127.0.0.1:8000'
+        )
+        parser.add_argument(
+            '-i', '--inprocess', action='store_true',
+            help='Test this process with the Django test client and the memory docstore backend instead of a URL.'
+        )
+        parser.add_argument(
+            '-u', '--users', type=int, default=4,
+            help='Concurrent simulated users.'
+        )
+        parser.add_argument(
+            '-d', '--duration', type=float, default=30,
+            help='Seconds to run.'
+        )
+        parser.add_argument(
+            '-n', '--requests', type=int,
+            help='Stop each user after this many requests.'
+        )
+        parser.add_argument(
+            '-m', '--mix',
+            default=','.join(f'{k}={v}' for k,v in loadtest.DEFAULT_MIX.items()),
+            help=f"Scenario weights ({', '.join(loadtest.SCENARIOS)})."
+        )
+        parser.add_argument(
+            '-a', '--access-log', action='append', default=[],
+            help='Draw IDs and search terms from access log(s) (combined format, may be .gz).'
+        )
+        parser.add_argument(
+            '-p', '--persons', type=int, default=settings.DOCSTORE_MEMORY_PERSONS,
+            help='Size of the generated workload (match the memory backend).'
+        )
+        parser.add_argument(
+            '--seed', type=int, default=settings.DOCSTORE_MEMORY_SEED,
+            help='Random seed for generated data and user behavior.'
+        )
+        parser.add_argument(
+            '-t', '--think', type=float, default=0,
+            help='Max seconds each user pauses between requests.'
+        )
+        parser.add_argument(
+            '-j', '--json', metavar='PATH',
+            help='Also write the report as JSON.'
+        )
+
+    def handle(self, *args, **options):
+        if not (options['url'] or options['inprocess']):
+            raise CommandError('Specify a URL or --inprocess.')
+        try:
+            mix = loadtest.parse_mix(options['mix'])
+        except ValueError as err:
+            raise CommandError(err)
+
+        workload = loadtest.Workload.from_sampledata(
+            options['persons'], options['seed']
+        )
+        if options['access_log']:
+            workload = loadtest.Workload.from_access_log(
+                options['access_log'], fallback=workload
+            )
+        self.stdout.write(f'{workload}')
+
+        kwargs = dict(
+            workload=workload, mix=mix, users=options['users'],
+            duration=options['duration'], requests=options['requests'],
+            think=options['think'], seed=options['seed'],
+        )
+        if options['inprocess']:
+            with override_settings(
+                DOCSTORE_BACKEND='memory',
+                ALLOWED_HOSTS=settings.ALLOWED_HOSTS + ['testserver'],
+            ):
+                report = loadtest.run(loadtest.ClientTransport, **kwargs)
+        else:
+            report = loadtest.run(
+                lambda: loadtest.HttpTransport(options['url']), **kwargs
+            )
+
+        self.stdout.write(
+            f"{'endpoint':<16} {'requests':>9} {'errors':>7} {'err%':>6} "
+            f"{'req/s':>8} {'mean':>8} {'p50':>8} {'p90':>8} {'p99':>8} {'max':>8}"
+        )
+        for endpoint,r in report.items():
+            self.stdout.write(
+                f"{endpoint:<16} {r['requests']:>9} {r['errors']:>7} "
+                f"{100 * r['error_rate']:>6.1f} {r['rps']:>8.1f} "
+                f"{r['mean']:>8.1f} {r['p50']:>8.1f} {r['p90']:>8.1f} "
+                f"{r['p99']:>8.1f} {r['max']:>8.1f}"
+            )
+        self.stdout.write('(latencies in ms)')
+        if options['json']:
+            with open(options['json'], 'w') as f:
+                json.dump(report, f, indent=2)
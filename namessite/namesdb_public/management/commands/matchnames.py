@@ -0,0 +1,82 @@
+import json
+from pathlib import Path
+import sys
+
+from django.core.management.base import BaseCommand, CommandError
+
+from namesdb_public import batchmatch
+
+
+class Command(BaseCommand):
+    help = 'Match a CSV or NDJSON list of names against persons, FAR and WRA records.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('input', help='CSV (with header row) or NDJSON file.')
+        parser.add_argument(
+            '-o', '--output',
+            help='NDJSON output file (default: stdout).'
+        )
+        parser.add_argument(
+            '-r', '--resume', action='store_true',
+            help='Skip names already in --output and append the rest.'
+        )
+        parser.add_argument(
+            '-b', '--batch-size', type=int,
+            help='Names per msearch (default: settings.BATCHMATCH_BATCH_SIZE).'
+        )
+        parser.add_argument(
+            '-c', '--concurrency', type=int,
+            help='msearch requests at once (default: settings.BATCHMATCH_CONCURRENCY).'
+        )
+
+    def handle(self, *args, **options):
+        if options['resume'] and not options['output']:
+            raise CommandError('--resume needs --output.')
+        try:
+            rows = batchmatch.read_rows(Path(options['input']).read_text('utf-8-sig'))
+        except (OSError, ValueError) as err:
+            raise CommandError(err)
+        start = 0
+        output = Path(options['output']) if options['output'] else None
+        if options['resume'] and output.exists():
+            start = _results(output)
+        def progress(done, total, seconds):
+            report = batchmatch.progress_record(done, total, seconds, start)
+            self.stderr.write(
+                f"{report['done']}/{report['total']} "
+                f"{report['rows_per_second']} names/s"
+            )
+        results = batchmatch.match(
+            rows, start,
+            batch_size=options['batch_size'], concurrency=options['concurrency'],
+            progress=progress,
+        )
+        f = output.open('a' if start else 'w') if output else sys.stdout
+        try:
+            for result in results:
+                # one line per name, flushed, so an interrupted run can resume
+                f.write(json.dumps(result) + '\n')
+                f.flush()
+        finally:
+            if output:
+                f.close()
+        self.stderr.write(f'Matched {len(rows) - start} names ({start} skipped).')
+
+
+def _results(path):
+    """Number of complete result lines in a previous output file
+
+    A partly written last line is removed.
+    """
+    count = 0
+    size = 0
+    with path.open('rb') as f:
+        for line in f:
+            if not line.endswith(b'\n'):
+                break
+            count += 1
+            size += len(line)
+    if size < path.stat().st_size:
+        with path.open('r+b') as f:
+            f.truncate(size)
+    return count
@@ -0,0 +1,36 @@
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+from namesdb_public import sitemap
+
+
+class Command(BaseCommand):
+    help = 'Write sitemaps of all record pages and the sitemap index.'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '-o', '--output',
+            help='Output directory (default: settings.SITEMAP_DIR).'
+        )
+        parser.add_argument(
+            '-b', '--base-url',
+            help='Scheme and host of the site (default: settings.SITEMAP_BASE_URL).'
+        )
+        parser.add_argument(
+            '-s', '--shard-size', type=int,
+            help=f'URLs per sitemap file (max {sitemap.MAX_SHARD_SIZE}).'
+        )
+
+    def handle(self, *args, **options):
+        if not (options['output'] or settings.SITEMAP_DIR):
+            raise CommandError('No output directory: give --output or configure [sitemap] dir.')
+        try:
+            result = sitemap.write(
+                options['output'], options['base_url'], options['shard_size']
+            )
+        except OSError as err:
+            raise CommandError(err)
+        self.stdout.write(
+            f"Wrote {result['urls']} URLs in {result['sitemaps']} sitemaps, "
+            f"index {result['index']}"
+        )
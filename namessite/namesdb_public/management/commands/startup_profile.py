@@ -0,0 +1,67 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from namesdb_public import startup
+
+
+class Command(BaseCommand):
+    help = 'Report import times and time to first request for a fresh worker.'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '-p', '--path', default='/',
+            help='Path of the first request (default: /).'
+        )
+        parser.add_argument(
+            '-q', '--query', default='',
+            help='Query string of the first request.'
+        )
+        parser.add_argument(
+            '-n', '--top', type=int, default=20,
+            help='Number of imports and packages to list.'
+        )
+        parser.add_argument(
+            '-r', '--repeat', type=int, default=3,
+            help='Start this many workers and report the fastest.'
+        )
+        parser.add_argument(
+            '-b', '--budget', type=float,
+            help='Fail if boot plus first request takes longer (seconds).'
+        )
+
+    def handle(self, *args, **options):
+        runs = []
+        for _ in range(max(options['repeat'], 1)):
+            try:
+                runs.append(startup.profile(options['path'], options['query']))
+            except RuntimeError as err:
+                raise CommandError(f'Worker failed to start: {err}')
+        result = min(runs, key=lambda run: run['total'])
+        top = options['top']
+        ms = lambda seconds: f'{seconds * 1000:9.1f} ms'
+
+        self.stdout.write(f"Slowest top-level imports (cumulative)")
+        toplevel = sorted(
+            [i for i in result['imports'] if i[3] == 0], key=lambda i: -i[2]
+        )
+        for name,_,cumulative,_ in toplevel[:top]:
+            self.stdout.write(f'  {ms(cumulative)}  {name}')
+        self.stdout.write(f"Import time by package (self)")
+        for package,seconds in startup.package_totals(result['imports'])[:top]:
+            self.stdout.write(f'  {ms(seconds)}  {package}')
+        self.stdout.write(f"Loaded by Django: apps, middleware, URLconf (cumulative)")
+        dynamic = sorted(result['dynamic_imports'], key=lambda i: -i[1])
+        for name,seconds in dynamic[:top]:
+            self.stdout.write(f'  {ms(seconds)}  {name}')
+        self.stdout.write(f"App modules imported directly (cumulative)")
+        for name,seconds in startup.app_modules(result['imports']):
+            self.stdout.write(f'  {ms(seconds)}  {name}')
+
+        self.stdout.write(f"Worker boot (settings, apps, middleware) {ms(result['boot'])}")
+        self.stdout.write(f"First request {options['path']} [{result['status']}]      {ms(result['first_request'])}")
+        self.stdout.write(f"Time to first request                    {ms(result['total'])}")
+        self.stdout.write(f"Process wall time                        {ms(result['process'])}")
+        budget = options['budget']
+        if budget and result['total'] > budget:
+            raise CommandError(
+                f"Time to first request {result['total']:.2f}s exceeds budget {budget:.2f}s"
+            )
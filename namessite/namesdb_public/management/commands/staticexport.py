@@ -0,0 +1,37 @@
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+from namesdb_public import staticexport
+
+
+class Command(BaseCommand):
+    help = 'Render record and FAR pages to static files for nginx.'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '-o', '--output',
+            help='Export directory (default: settings.STATIC_EXPORT_DIR).'
+        )
+        parser.add_argument(
+            '-c', '--concurrency', type=int,
+            help='Concurrent renders.'
+        )
+        parser.add_argument(
+            '--full', action='store_true',
+            help='Render every page, not just new and changed records.'
+        )
+
+    def handle(self, *args, **options):
+        if not (options['output'] or settings.STATIC_EXPORT_DIR):
+            raise CommandError('No export directory: give --output or configure [staticexport] dir.')
+        try:
+            result = staticexport.build(
+                options['output'], options['full'], options['concurrency']
+            )
+        except OSError as err:
+            raise CommandError(err)
+        self.stdout.write(
+            f"Exported {result['pages']} pages to {result['build']} in "
+            f"{result['seconds']:.1f}s ({result['rendered']} rendered, "
+            f"{result['linked']} unchanged, {result['errors']} errors)"
+        )
@@ -0,0 +1,53 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from namesdb_public import warmup
+
+
+class Command(BaseCommand):
+    help = 'Warm caches by fetching the most requested records and searches.'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '-a', '--access-log', action='append', default=[],
+            help='Access log(s) to take targets from (default: settings.WARMUP_ACCESS_LOG).'
+        )
+        parser.add_argument(
+            '-l', '--list',
+            help='File of URLs to warm, one per line (default: settings.WARMUP_LIST).'
+        )
+        parser.add_argument(
+            '-n', '--top', type=int,
+            help='Number of records of each type, and of searches, to warm.'
+        )
+        parser.add_argument(
+            '-c', '--concurrency', type=int,
+            help='Concurrent fetches.'
+        )
+        parser.add_argument(
+            '-t', '--timeout', type=float,
+            help='Stop after this many seconds.'
+        )
+        parser.add_argument(
+            '--dry-run', action='store_true',
+            help='List targets without fetching them.'
+        )
+
+    def handle(self, *args, **options):
+        try:
+            targets = warmup.configured_targets(
+                options['access_log'], options['list'], options['top']
+            )
+        except OSError as err:
+            raise CommandError(err)
+        if not targets:
+            raise CommandError('No targets: give --access-log or --list, or configure [warmup].')
+        if options['dry_run']:
+            for kind,model,value in targets:
+                self.stdout.write(f'{kind:<7} {model:<10} {value}')
+            return
+        result = warmup.run(targets, options['concurrency'], options['timeout'])
+        self.stdout.write(
+            f"Warmed {result['ok']}/{result['targets']} targets in "
+            f"{result['seconds']:.1f}s ({result['errors']} errors, "
+            f"{result['skipped']} skipped)"
+        )
@@ -0,0 +1,862 @@
+"""In-memory stand-in for the Elasticsearch cluster
+
+Implements the subset of the elasticsearch-py client API that this app
+(and elasticsearch_dsl/elastictools on its behalf) uses: get, mget, exists,
+search (bool/term/terms/range/query_string/... queries, terms/histogram/
+composite aggregations, sort, _source filtering, from/size), scroll (so
+Search.scan() works), count and msearch.  It is not fast and it is not
+Elasticsearch; it is good enough to run the full request pipeline in CI and
+on laptops without a cluster.
+
+Select it with `docstore_backend=memory` in the [database] section of the
+config file.  Indices are filled with sampledata (settings.DOCSTORE_MEMORY_PERSONS
+Persons) or with documents from settings.DOCSTORE_MEMORY_FIXTURES, an NDJSON
+file of {"_index": ..., "_id": ..., "_source": {...}} objects.
+
+    >>> from namesdb_public import models
+    >>> es = models.get_docstore().es
+    >>> es.search(index='namesperson', body={'query': {'match_all': {}}})
+"""
+from copy import deepcopy
+from fnmatch import fnmatchcase
+import itertools
+import json
+import re
+import threading
+import uuid
+
+from elasticsearch.exceptions import NotFoundError, RequestError
+
+TOKEN_SPLIT = re.compile(r'[^\w*?]+', re.UNICODE)
+DEFAULT_SIZE = 10
+
+
+def _tokens(value):
+    """Lowercased words in value, roughly like the standard analyzer
+    """
+    return [t for t in TOKEN_SPLIT.split(str(value).lower()) if t]
+
+def _values(doc, path):
+    """All values at dotted path in doc, flattening lists
+    """
+    values = [doc]
+    for part in path.split('.'):
+        found = []
+        for value in values:
+            if isinstance(value, dict) and part in value:
+                found.append(value[part])
+        values = []
+        for value in found:
+            if isinstance(value, list):
+                values.extend(value)
+            else:
+                values.append(value)
+    if not values and path.endswith(('.keyword', '.raw')):
+        return _values(doc, path.rsplit('.', 1)[0])
+    return [v for v in values if v is not None]
+
+def _number(value):
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        return None
+
+def _compare(a, b):
+    """Compare numerically when possible, otherwise as strings
+    """
+    na,nb = _number(a),_number(b)
+    if na is not None and nb is not None:
+        return (na > nb) - (na < nb)
+    a,b = str(a),str(b)
+    return (a > b) - (a < b)
+
+def _term_matches(value, term):
+    if str(value) == str(term):
+        return True
+    # text fields are analyzed
+    if isinstance(value, str) and (' ' in value or value != value.lower()):
+        return str(term).lower() in _tokens(value)
+    return False
+
+def _first(params):
+    """(field, value) of a single-field query clause like {'term': {f: v}}
+    """
+    params = {k:v for k,v in params.items() if k not in ['boost', '_name']}
+    field,value = next(iter(params.items()))
+    return field,value
+
+
+# query_string -------------------------------------------------------------
+
+QS_TOKEN = re.compile(
+    r'\s*(?:(?P<lparen>\()|(?P<rparen>\))|(?P<phrase>"[^"]*")'
+    r'|(?P<regex>/[^/]*/)|(?P<word>[^\s()"]+))'
+)
+
+def _parse_query_string(text):
+    """Parse Lucene query_string syntax into nested tuples
+
+    ('or', [...]), ('and', [...]), ('not', clause), ('term', field, text),
+    ('phrase', field, text), ('regex', field, pattern)
+    """
+    tokens = []
+    for match in QS_TOKEN.finditer(text):
+        kind = match.lastgroup
+        tokens.append((kind, match.group(kind)))
+    pos = 0
+
+    def peek():
+        return tokens[pos] if pos < len(tokens) else (None, None)
+
+    def parse_or():
+        nonlocal pos
+        clauses = [parse_and()]
+        while peek() == ('word', 'OR') or peek() == ('word', '||'):
+            pos += 1
+            clauses.append(parse_and())
+        return clauses[0] if len(clauses) == 1 else ('or', clauses)
+
+    def parse_and():
+        # implicit operator is OR (Elasticsearch default_operator)
+        nonlocal pos
+        items = [parse_unary()]
+        while True:
+            kind,value = peek()
+            if kind is None or kind == 'rparen' or value in ['OR', '||']:
+                break
+            if value in ['AND', '&&']:
+                pos += 1
+                items[-1] = required(items[-1])
+                items.append(required(parse_unary()))
+                continue
+            items.append(parse_unary())
+        musts = [c[1] for c in items if c[0] == 'must']
+        nots = [c for c in items if c[0] == 'not']
+        optional = [c for c in items if c[0] not in ['must', 'not']]
+        if not (musts or nots):
+            return optional[0] if len(optional) == 1 else ('or', optional)
+        if optional and not musts:
+            musts.append(('or', optional))
+        return ('and', musts + nots)
+
+    def required(clause):
+        return clause if clause[0] in ['must', 'not'] else ('must', clause)
+
+    def parse_unary():
+        nonlocal pos
+        kind,value = peek()
+        if value in ['NOT', '!']:
+            pos += 1
+            return ('not', parse_unary())
+        if kind == 'word' and value.startswith('-') and len(value) > 1:
+            tokens[pos] = ('word', value[1:])
+            return ('not', parse_unary())
+        if kind == 'word' and value.startswith('+') and len(value) > 1:
+            tokens[pos] = ('word', value[1:])
+            return ('must', parse_unary())
+        return parse_atom()
+
+    def parse_atom(field=None):
+        nonlocal pos
+        kind,value = peek()
+        pos += 1
+        if kind == 'lparen':
+            clause = parse_or()
+            if peek()[0] == 'rparen':
+                pos += 1
+            return clause if field is None else ('field', field, clause)
+        if kind == 'phrase':
+            return ('phrase', field, value.strip('"'))
+        if kind == 'regex':
+            return ('regex', field, value.strip('/'))
+        if kind == 'word':
+            if ':' in value and not value.startswith(':') and field is None:
+                name,_,rest = value.partition(':')
+                name = name.replace('\\', '')
+                if rest:
+                    tokens.insert(pos, ('word', rest))
+                return parse_atom(field=name)
+            value = re.sub(r'~\d*$', '', value)  # fuzziness is ignored
+            value = re.sub(r'\^[\d.]+$', '', value)  # so is boost
+            return ('term', field, value)
+        return ('or', [])
+
+    if not tokens:
+        return ('or', [])
+    return parse_or()
+
+def _qs_match(clause, doc, fields):
+    kind = clause[0]
+    if kind == 'or':
+        return any(_qs_match(c, doc, fields) for c in clause[1])
+    if kind == 'and':
+        return all(_qs_match(c, doc, fields) for c in clause[1])
+    if kind == 'not':
+        return not _qs_match(clause[1], doc, fields)
+    if kind == 'must':
+        return _qs_match(clause[1], doc, fields)
+    if kind == 'field':
+        return _qs_match(clause[2], doc, [clause[1]])
+    field,text = clause[1],clause[2]
+    search_fields = [field] if field else fields
+    for name in search_fields:
+        for value in _field_values(doc, name):
+            if kind == 'phrase':
+                if ' '.join(_tokens(text)) in ' '.join(_tokens(value)):
+                    return True
+            elif kind == 'regex':
+                if any(re.fullmatch(text, t) for t in _tokens(value)):
+                    return True
+            else:
+                words = _tokens(text)
+                if not words:
+                    continue
+                value_tokens = _tokens(value)
+                if all(
+                        any(fnmatchcase(t, word) for t in value_tokens)
+                        for word in words
+                ):
+                    return True
+    return False
+
+def _field_values(doc, name):
+    if name in ['*', '_all']:
+        return [v for v in _all_strings(doc)]
+    if '*' in name:
+        return [
+            v for key in doc if fnmatchcase(key, name)
+            for v in _values(doc, key)
+        ]
+    return _values(doc, name)
+
+def _all_strings(value):
+    if isinstance(value, dict):
+        for v in value.values():
+            yield from _all_strings(v)
+    elif isinstance(value, list):
+        for v in value:
+            yield from _all_strings(v)
+    elif isinstance(value, (str, int, float)):
+        yield value
+
+
+# queries ------------------------------------------------------------------
+
+def matches(query, doc, doc_id=None):
+    """True if doc (a _source dict) matches Elasticsearch query dict
+    """
+    if not query:
+        return True
+    (kind,params), = query.items()
+    if kind == 'match_all':
+        return True
+    if kind == 'match_none':
+        return False
+    if kind == 'bool':
+        def clauses(key):
+            value = params.get(key, [])
+            return value if isinstance(value, list) else [value]
+        if not all(matches(q, doc, doc_id) for q in clauses('must') + clauses('filter')):
+            return False
+        if any(matches(q, doc, doc_id) for q in clauses('must_not')):
+            return False
+        should = clauses('should')
+        if should:
+            minimum = params.get('minimum_should_match')
+            if minimum is None:
+                minimum = 0 if (clauses('must') or clauses('filter')) else 1
+            return sum(1 for q in should if matches(q, doc, doc_id)) >= int(minimum)
+        return True
+    if kind in ['constant_score', 'function_score']:
+        return matches(params.get('filter') or params.get('query'), doc, doc_id)
+    if kind == 'nested':
+        return matches(params['query'], doc, doc_id)
+    if kind == 'ids':
+        return doc_id in params['values']
+    if kind == 'exists':
+        return bool(_values(doc, params['field']))
+    if kind == 'term':
+        field,term = _first(params)
+        if isinstance(term, dict):
+            term = term['value']
+        return any(_term_matches(v, term) for v in _values(doc, field))
+    if kind == 'terms':
+        field,terms = _first(params)
+        return any(
+            _term_matches(v, term) for v in _values(doc, field) for term in terms
+        )
+    if kind == 'range':
+        field,bounds = _first(params)
+        ops = {
+            'gt': lambda c: c > 0, 'gte': lambda c: c >= 0,
+            'lt': lambda c: c < 0, 'lte': lambda c: c <= 0,
+        }
+        return any(
+            all(
+                ops[op](_compare(v, bound))
+                for op,bound in bounds.items() if op in ops
+            )
+            for v in _values(doc, field)
+        )
+    if kind in ['prefix', 'wildcard']:
+        field,value = _first(params)
+        if isinstance(value, dict):
+            value = value.get('value', value.get('wildcard'))
+        pattern = f'{value}*' if kind == 'prefix' else value
+        return any(
+            fnmatchcase(str(v).lower(), str(pattern).lower())
+            or any(fnmatchcase(t, str(pattern).lower()) for t in _tokens(v))
+            for v in _values(doc, field)
+        )
+    if kind in ['match', 'match_phrase']:
+        field,text = _first(params)
+        if isinstance(text, dict):
+            text = text['query']
+        words = _tokens(text)
+        for v in _values(doc, field):
+            if kind == 'match_phrase':
+                if ' '.join(words) in ' '.join(_tokens(v)):
+                    return True
+            elif set(words) & set(_tokens(v)):
+                return True
+        return False
+    if kind == 'multi_match':
+        return any(
+            matches({'match': {field.split('^')[0]: params['query']}}, doc, doc_id)
+            for field in params.get('fields', ['*'])
+        )
+    if kind in ['query_string', 'simple_query_string']:
+        fields = params.get('fields') or [params.get('default_field', '*')]
+        fields = [f.split('^')[0] for f in fields]
+        clause = _parse_query_string(str(params['query']))
+        if str(params.get('default_operator', 'or')).lower() == 'and' \
+           and clause[0] == 'or':
+            clause = ('and', clause[1])
+        return _qs_match(clause, doc, fields)
+    raise RequestError(400, 'parsing_exception', f'memstore: unsupported query "{kind}"')
+
+
+# aggregations -------------------------------------------------------------
+
+def _bucket_aggs(agg, docs):
+    sub = agg.get('aggs') or agg.get('aggregations')
+    return aggregate(sub, docs) if sub else {}
+
+def aggregate(aggs, docs):
+    """Compute aggregations over list of (id, source) tuples
+    """
+    results = {}
+    for name,agg in (aggs or {}).items():
+        kind = next(k for k in agg if k not in ['aggs', 'aggregations', 'meta'])
+        params = agg[kind]
+        if kind == 'terms':
+            counts = {}
+            members = {}
+            for doc_id,doc in docs:
+                for value in set(map(_hashable, _values(doc, params['field']))):
+                    counts[value] = counts.get(value, 0) + 1
+                    members.setdefault(value, []).append((doc_id, doc))
+            order = params.get('order', {'_count': 'desc'})
+            if isinstance(order, list):
+                order = order[0]
+            (order_by,direction), = order.items()
+            if order_by in ['_key', '_term']:
+                keys = sorted(counts, key=_sort_key, reverse=direction == 'desc')
+            else:
+                keys = sorted(
+                    sorted(counts, key=_sort_key),
+                    key=lambda k: counts[k], reverse=direction == 'desc'
+                )
+            keys = [k for k in keys if counts[k] >= params.get('min_doc_count', 1)]
+            size = params.get('size', 10)
+            results[name] = {
+                'doc_count_error_upper_bound': 0,
+                'sum_other_doc_count': sum(counts[k] for k in keys[size:]),
+                'buckets': [
+                    dict(key=key, doc_count=counts[key],
+                         **_bucket_aggs(agg, members[key]))
+                    for key in keys[:size]
+                ],
+            }
+        elif kind == 'histogram':
+            interval = params['interval']
+            counts = {}
+            members = {}
+            for doc_id,doc in docs:
+                for value in _values(doc, params['field']):
+                    number = _number(value)
+                    if number is None:
+                        continue
+                    key = (number // interval) * interval
+                    counts[key] = counts.get(key, 0) + 1
+                    members.setdefault(key, []).append((doc_id, doc))
+            min_count = params.get('min_doc_count', 0)
+            keys = sorted(counts)
+            if keys and not min_count:
+                keys = [
+                    keys[0] + n * interval
+                    for n in range(int((keys[-1] - keys[0]) // interval) + 1)
+                ]
+            results[name] = {'buckets': [
+                dict(key=key, doc_count=counts.get(key, 0),
+                     **_bucket_aggs(agg, members.get(key, [])))
+                for key in keys if counts.get(key, 0) >= min_count
+            ]}
+        elif kind == 'composite':
+            sources = [
+                (source_name, source[next(iter(source))]['field'])
+                for source_def in params['sources']
+                for source_name,source in source_def.items()
+            ]
+            counts = {}
+            for doc_id,doc in docs:
+                value_lists = [
+                    sorted(set(map(_hashable, _values(doc, field))), key=_sort_key)
+                    for _,field in sources
+                ]
+                for combo in itertools.product(*value_lists):
+                    counts[combo] = counts.get(combo, 0) + 1
+            keys = sorted(counts, key=lambda combo: [_sort_key(v) for v in combo])
+            after = params.get('after')
+            if after:
+                after = [after[source_name] for source_name,_ in sources]
+                keys = [
+                    k for k in keys
+                    if [_sort_key(v) for v in k] > [_sort_key(v) for v in after]
+                ]
+            page = keys[:params.get('size', 10)]
+            buckets = [
+                {
+                    'key': {source_name: value for (source_name,_),value in zip(sources, combo)},
+                    'doc_count': counts[combo],
+                }
+                for combo in page
+            ]
+            results[name] = {'buckets': buckets}
+            if buckets:
+                results[name]['after_key'] = buckets[-1]['key']
+        elif kind in ['cardinality', 'value_count', 'min', 'max']:
+            values = [
+                v for _,doc in docs for v in _values(doc, params['field'])
+            ]
+            if kind == 'cardinality':
+                value = len(set(map(_hashable, values)))
+            elif kind == 'value_count':
+                value = len(values)
+            else:
+                numbers = [n for n in map(_number, values) if n is not None]
+                value = (min if kind == 'min' else max)(numbers) if numbers else None
+            results[name] = {'value': value}
+        elif kind == 'filter':
+            selected = [(i,d) for i,d in docs if matches(params, d, i)]
+            results[name] = dict(doc_count=len(selected), **_bucket_aggs(agg, selected))
+        else:
+            raise RequestError(
+                400, 'parsing_exception', f'memstore: unsupported aggregation "{kind}"'
+            )
+    return results
+
+def _hashable(value):
+    return json.dumps(value, sort_keys=True) if isinstance(value, (dict, list)) else value
+
+def _sort_key(value):
+    number = _number(value)
+    if number is not None and not isinstance(value, bool):
+        return (0, number, '')
+    return (1, 0, str(value))
+
+
+# client -------------------------------------------------------------------
+
+def _source_filter(source, includes=None, excludes=None):
+    if includes is False:
+        return None
+    if isinstance(includes, str):
+        includes = includes.split(',')
+    if isinstance(excludes, str):
+        excludes = excludes.split(',')
+    if includes and includes is not True:
+        source = {
+            key: val for key,val in source.items()
+            if any(fnmatchcase(key, pattern) for pattern in includes)
+        }
+    if excludes:
+        source = {
+            key: val for key,val in source.items()
+            if not any(fnmatchcase(key, pattern) for pattern in excludes)
+        }
+    return source
+
+def _body_source_filter(body):
+    spec = body.get('_source', True)
+    if isinstance(spec, dict):
+        return spec.get('includes', spec.get('include')), spec.get('excludes', spec.get('exclude'))
+    return spec, None
+
+def _sorted_hits(hits, sort):
+    if not sort:
+        return hits
+    if not isinstance(sort, list):
+        sort = [sort]
+    for spec in reversed(sort):
+        if isinstance(spec, str):
+            field,order = spec,'asc'
+            if field.startswith('-'):
+                field,order = field[1:],'desc'
+        else:
+            (field,order), = spec.items()
+            if isinstance(order, dict):
+                order = order.get('order', 'asc')
+        if field in ['_doc', '_score']:
+            continue
+        def key(hit, field=field):
+            if field == '_id':
+                values = [hit[0]]
+            else:
+                values = _values(hit[1], field)
+            if not values:
+                return (1, (0, 0, ''))  # missing values sort last
+            return (0, _sort_key(min(values, key=_sort_key)))
+        present = [h for h in hits if key(h)[0] == 0]
+        missing = [h for h in hits if key(h)[0] == 1]
+        hits = sorted(present, key=key, reverse=(order == 'desc')) + missing
+    return hits
+
+# Keyword args of Elasticsearch.search() that are URL parameters; the
+# remainder are parts of the request body (elasticsearch-py >= 7.15 and
+# elasticsearch_dsl pass e.g. query=, aggs=, from_= instead of body=).
+URL_PARAMS = [
+    'allow_partial_search_results', 'expand_wildcards', 'filter_path',
+    'ignore', 'ignore_unavailable', 'preference', 'q', 'request_cache',
+    'request_timeout', 'rest_total_hits_as_int', 'routing', 'search_type',
+    'timeout', 'typed_keys',
+]
+
+def _request_body(body, kwargs):
+    body = deepcopy(body or {})
+    for key,value in kwargs.items():
+        if key in URL_PARAMS:
+            continue
+        body['from' if key == 'from_' else key] = deepcopy(value)
+    return body
+
+def _shards():
+    return {'total': 1, 'successful': 1, 'skipped': 0, 'failed': 0}
+
+
+class Indices():
+    """Subset of elasticsearch.client.IndicesClient
+    """
+
+    def __init__(self, client):
+        self.client = client
+
+    def exists(self, index, **kwargs):
+        return all(name in self.client.data for name in self.client._indices(index))
+
+    def refresh(self, index=None, **kwargs):
+        return {'_shards': _shards()}
+
+    def stats(self, index=None, **kwargs):
+        return {'_all': {'primaries': {'docs': {
+            'count': sum(len(self.client.data.get(i, {})) for i in self.client._indices(index))
+        }}}}
+
+
+class Nodes():
+    """Subset of elasticsearch.client.NodesClient
+    """
+
+    def __init__(self, client):
+        self.client = client
+
+    def stats(self, node_id=None, metric=None, index_metric=None, **kwargs):
+        # one node; nothing is cached
+        return {'nodes': {'memstore': {'name': 'memstore', 'indices': {
+            'request_cache': {
+                'memory_size_in_bytes': 0, 'evictions': 0,
+                'hit_count': 0, 'miss_count': 0,
+            },
+        }}}}
+
+
+class Elasticsearch():
+    """Subset of elasticsearch.Elasticsearch backed by dicts
+    """
+
+    def __init__(self):
+        self.data = {}  # {index: {id: source}}
+        self.scrolls = {}
+        self.lock = threading.Lock()
+        self.indices = Indices(self)
+        self.nodes = Nodes(self)
+
+    def __repr__(self):
+        return f'<memstore.Elasticsearch {len(self.data)} indices>'
+
+    def _indices(self, index):
+        if index is None or index in ['_all', '*']:
+            return list(self.data)
+        if isinstance(index, str):
+            index = index.split(',')
+        names = []
+        for name in index:
+            if '*' in name:
+                names += [i for i in self.data if fnmatchcase(i, name)]
+            else:
+                names.append(name)
+        return names
+
+    def load(self, documents):
+        """Add documents (iterable of (index, id, source))
+        """
+        with self.lock:
+            for index,doc_id,source in documents:
+                self.data.setdefault(index, {})[str(doc_id)] = source
+
+    def load_ndjson(self, path):
+        """Add documents from NDJSON file of {_index, _id, _source} objects
+        """
+        with open(path, 'r') as f:
+            self.load(
+                (doc['_index'], doc['_id'], doc['_source'])
+                for doc in map(json.loads, f) if doc
+            )
+
+    def info(self, **kwargs):
+        return {'version': {'number': '7.17.0', 'distribution': 'memstore'}}
+
+    def ping(self, **kwargs):
+        return True
+
+    def index(self, index, body=None, id=None, document=None, **kwargs):
+        doc_id = str(id or uuid.uuid4().hex)
+        self.load([(index, doc_id, deepcopy(document or body))])
+        return {'_index': index, '_id': doc_id, 'result': 'created'}
+
+    def get(self, index, id, params=None, **kwargs):
+        source = self.data.get(index, {}).get(str(id))
+        if source is None:
+            raise NotFoundError(
+                404, 'not_found',
+                {'_index': index, '_id': id, 'found': False}
+            )
+        includes = kwargs.get('_source', kwargs.get('_source_includes'))
+        return {
+            '_index': index, '_id': str(id), '_version': 1,
+            '_seq_no': 0, '_primary_term': 1, 'found': True,
+            '_source': _source_filter(
+                deepcopy(source), includes, kwargs.get('_source_excludes')
+            ),
+        }
+
+    def exists(self, index, id, **kwargs):
+        return str(id) in self.data.get(index, {})
+
+    def mget(self, body, index=None, **kwargs):
+        if 'ids' in body:
+            wanted = [(index, doc_id) for doc_id in body['ids']]
+        else:
+            wanted = [(d.get('_index', index), d['_id']) for d in body['docs']]
+        docs = []
+        for doc_index,doc_id in wanted:
+            try:
+                docs.append(self.get(doc_index, doc_id, **kwargs))
+            except NotFoundError:
+                docs.append({'_index': doc_index, '_id': doc_id, 'found': False})
+        return {'docs': docs}
+
+    def _matching(self, index, body):
+        query = (body or {}).get('query')
+        return [
+            (doc_id, name, source)
+            for name in self._indices(index)
+            for doc_id,source in self.data.get(name, {}).items()
+            if matches(query, source, doc_id)
+        ]
+
+    def count(self, body=None, index=None, params=None, **kwargs):
+        body = _request_body(body, kwargs)
+        return {'count': len(self._matching(index, body)), '_shards': _shards()}
+
+    def search(self, body=None, index=None, scroll=None, params=None, **kwargs):
+        body = _request_body(body, kwargs)
+        size = int(body.get('size', DEFAULT_SIZE))
+        from_ = int(body.get('from', 0))
+        hits = self._matching(index, body)
+        aggs = body.get('aggs') or body.get('aggregations')
+        response = {
+            'took': 0,
+            'timed_out': False,
+            '_shards': _shards(),
+            'hits': {
+                'total': {'value': len(hits), 'relation': 'eq'},
+                'max_score': 1.0 if hits else None,
+                'hits': [],
+            },
+        }
+        if aggs:
+            response['aggregations'] = aggregate(
+                aggs, [(doc_id, source) for doc_id,_,source in hits]
+            )
+        if 'suggest' in body:
+            response['suggest'] = self._suggest(body['suggest'], index)
+        ordered = _sorted_hits(
+            [(doc_id, source, name) for doc_id,name,source in hits],
+            body.get('sort')
+        )
+        includes,excludes = _body_source_filter(body)
+        formatted = [
+            {
+                '_index': name, '_type': '_doc', '_id': doc_id, '_score': 1.0,
+                '_source': _source_filter(deepcopy(source), includes, excludes),
+            }
+            for doc_id,source,name in ordered
+        ]
+        if scroll:
+            scroll_id = uuid.uuid4().hex
+            with self.lock:
+                self.scrolls[scroll_id] = (formatted[size:], size)
+            response['_scroll_id'] = scroll_id
+            formatted = formatted[:size]
+        else:
+            formatted = formatted[from_:from_+size]
+        response['hits']['hits'] = formatted
+        return response
+
+    def _suggest(self, suggest, index):
+        """Completion suggester over list-of-input fields
+        """
+        results = {}
+        for name,params in suggest.items():
+            if name == 'text':
+                continue
+            prefix = params.get('prefix', params.get('text', suggest.get('text', ''))).lower()
+            completion = params['completion']
+            contexts = completion.get('contexts', {})
+            options = []
+            for doc_index in self._indices(index):
+                for doc_id,source in self.data.get(doc_index, {}).items():
+                    for value in _values(source, completion['field']):
+                        inputs = value.get('input', []) if isinstance(value, dict) else value
+                        if isinstance(inputs, str):
+                            inputs = [inputs]
+                        doc_contexts = value.get('contexts', {}) if isinstance(value, dict) else {}
+                        if any(
+                                not set(map(str, wanted)) & set(map(str, doc_contexts.get(key, [])))
+                                for key,wanted in contexts.items()
+                        ):
+                            continue
+                        text = next(
+                            (i for i in inputs if str(i).lower().startswith(prefix)),
+                            None
+                        )
+                        if text is not None:
+                            options.append({
+                                'text': text, '_index': doc_index, '_id': doc_id,
+                                '_score': 1.0, '_source': deepcopy(source),
+                            })
+                            break
+            options = sorted(options, key=lambda o: (o['text'].lower(), o['_id']))
+            if completion.get('skip_duplicates'):
+                seen = set()
+                options = [
+                    o for o in options
+                    if o['text'].lower() not in seen and not seen.add(o['text'].lower())
+                ]
+            results[name] = [{
+                'text': prefix, 'offset': 0, 'length': len(prefix),
+                'options': options[:completion.get('size', 5)],
+            }]
+        return results
+
+    def scroll(self, body=None, scroll_id=None, scroll=None, params=None, **kwargs):
+        if body:
+            scroll_id = body.get('scroll_id', scroll_id)
+        with self.lock:
+            remaining,size = self.scrolls.get(scroll_id, ([], DEFAULT_SIZE))
+            self.scrolls[scroll_id] = (remaining[size:], size)
+        return {
+            '_scroll_id': scroll_id,
+            'took': 0, 'timed_out': False, '_shards': _shards(),
+            'hits': {
+                'total': {'value': len(remaining), 'relation': 'eq'},
+                'max_score': None, 'hits': remaining[:size],
+            },
+        }
+
+    def clear_scroll(self, body=None, scroll_id=None, params=None, **kwargs):
+        ids = (body or {}).get('scroll_id', scroll_id) or []
+        if isinstance(ids, str):
+            ids = [ids]
+        with self.lock:
+            for scroll_id in ids:
+                self.scrolls.pop(scroll_id, None)
+        return {'succeeded': True, 'num_freed': len(ids)}
+
+    def msearch(self, body, index=None, **kwargs):
+        if isinstance(body, (str, bytes)):
+            body = [json.loads(line) for line in body.splitlines() if line.strip()]
+        responses = []
+        for header,search_body in zip(body[::2], body[1::2]):
+            response = self.search(body=search_body, index=header.get('index', index))
+            response['status'] = 200
+            responses.append(response)
+        return {'took': 0, 'responses': responses}
+
+
+_client = None
+_client_lock = threading.Lock()
+
+def client(settings):
+    """Per-process client, loaded with data on first use
+    """
+    global _client
+    with _client_lock:
+        if _client is None:
+            es = Elasticsearch()
+            if getattr(settings, 'DOCSTORE_MEMORY_FIXTURES', None):
+                es.load_ndjson(settings.DOCSTORE_MEMORY_FIXTURES)
+            else:
+                from . import sampledata
+                es.load(sampledata.generate(
+                    persons=settings.DOCSTORE_MEMORY_PERSONS,
+                    seed=settings.DOCSTORE_MEMORY_SEED,
+                ))
+            _client = es
+        return _client
+
+
+class AsyncElasticsearch():
+    """Coroutine interface to the stand-in, for the async views
+    
+    Calls run inline; the stand-in does no I/O.
+    """
+
+    def __init__(self, es):
+        self.es = es
+
+    def __getattr__(self, name):
+        method = getattr(self.es, name)
+        async def call(*args, **kwargs):
+            return method(*args, **kwargs)
+        return call
+
+    async def close(self):
+        pass
+
+
+class Docstore():
+    """Stand-in for elastictools.docstore.Docstore
+    """
+
+    def __init__(self, index_prefix, host, settings):
+        self.index_prefix = index_prefix
+        self.host = host
+        self.es = client(settings)
+
+    def __repr__(self):
+        return f'<memstore.Docstore {self.index_prefix}>'
+
+    def index_name(self, model):
+        return f'{self.index_prefix}{model}'
@@ -0,0 +1,396 @@
+"""Process-shared metrics exposed in Prometheus text format
+
+Gunicorn runs several worker processes so in-memory counters only show one
+worker's share of the traffic.  Each worker keeps its counters, gauges, and
+histograms in memory and periodically dumps them to a JSON file named after
+its PID in settings.METRICS_DIR.  The metrics view reads every file in the
+directory and sums them, so no external service (statsd, pushgateway, redis)
+is needed.
+
+Files left behind by dead workers are folded into an archive file so that
+counters survive worker restarts; their gauges (e.g. in-flight requests) are
+dropped.
+
+    from . import metrics
+    metrics.inc('namesdb_ddr_api_errors_total')
+    with metrics.timer('namesdb_es_request_duration_seconds',
+                       index='namesperson', op='get'):
+        ...
+    metrics.render()  # -> Prometheus text
+"""
+from contextlib import contextmanager
+import fcntl
+import json
+import logging
+logger = logging.getLogger(__name__)
+import os
+from pathlib import Path
+import threading
+import time
+
+from django.conf import settings
+
+CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+
+# Upper bounds (seconds) of histogram buckets
+BUCKETS = [0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0]
+
+# name: (type, help)
+METRICS = {
+    'namesdb_view_duration_seconds': (
+        'histogram', 'Django view latency'
+    ),
+    'namesdb_view_requests_total': (
+        'counter', 'Requests by view and response status'
+    ),
+    'namesdb_requests_in_flight': (
+        'gauge', 'Requests currently being processed'
+    ),
+    'namesdb_es_request_duration_seconds': (
+        'histogram', 'Elasticsearch call latency by index and operation'
+    ),
+    'namesdb_es_request_errors_total': (
+        'counter', 'Elasticsearch calls that raised an exception'
+    ),
+    'namesdb_ddr_api_duration_seconds': (
+        'histogram', 'DDR API call latency'
+    ),
+    'namesdb_ddr_api_errors_total': (
+        'counter', 'DDR API calls that failed or returned non-200'
+    ),
+    'namesdb_cache_requests_total': (
+        'counter', 'App-level cache lookups by cache and result (hit/miss)'
+    ),
+    'namesdb_choices_loads_total': (
+        'counter', 'Form choice list loads by result (ok/error/snapshot)'
+    ),
+    'namesdb_coalesced_calls_total': (
+        'counter', 'Backend calls answered by an identical in-flight call, by op and scope (process/host)'
+    ),
+    'namesdb_admission_rejected_total': (
+        'counter', 'Requests turned away by gate and reason (queue/timeout/ratelimit)'
+    ),
+    'namesdb_query_guard_total': (
+        'counter', 'Fulltext queries by cost guard result (ok/rewritten/rejected) and reason'
+    ),
+    'namesdb_es_request_cache_hits_total': (
+        'counter', 'Elasticsearch shard request cache hits (all nodes)'
+    ),
+    'namesdb_es_request_cache_misses_total': (
+        'counter', 'Elasticsearch shard request cache misses (all nodes)'
+    ),
+    'namesdb_es_request_cache_evictions_total': (
+        'counter', 'Elasticsearch shard request cache evictions (all nodes)'
+    ),
+    'namesdb_es_request_cache_memory_bytes': (
+        'gauge', 'Elasticsearch shard request cache size (all nodes)'
+    ),
+    'namesdb_es_request_cache_hit_ratio': (
+        'gauge', 'Elasticsearch shard request cache hits / lookups since node start'
+    ),
+}
+
+ARCHIVE_FILENAME = 'metrics-archive.json'
+LOCK_FILENAME = 'metrics.lock'
+
+
+def enabled():
+    return getattr(settings, 'METRICS_ENABLED', False)
+
+
+class Registry():
+    """Metrics recorded by this process
+
+    Keys are (name, labels) where labels is a sorted tuple of (key,value)
+    pairs so that they can be used in dicts and serialized to JSON.
+    """
+
+    def __init__(self, path=None):
+        self.lock = threading.Lock()
+        self.pid = os.getpid()
+        self.path = path
+        self.last_flush = 0
+        self.counters = {}
+        self.gauges = {}
+        self.histograms = {}
+
+    def inc(self, name, value, labels):
+        key = (name, labels)
+        with self.lock:
+            self.counters[key] = self.counters.get(key, 0) + value
+
+    def gauge_add(self, name, value, labels):
+        key = (name, labels)
+        with self.lock:
+            self.gauges[key] = self.gauges.get(key, 0) + value
+
+    def observe(self, name, value, labels):
+        key = (name, labels)
+        with self.lock:
+            hist = self.histograms.get(key)
+            if hist is None:
+                # [bucket counts..., sum, count]
+                hist = self.histograms[key] = [0] * len(BUCKETS) + [0.0, 0]
+            for n,bound in enumerate(BUCKETS):
+                if value <= bound:
+                    hist[n] += 1
+            hist[-2] += value
+            hist[-1] += 1
+
+    def dump(self):
+        """Serializable copy of the metrics
+        """
+        with self.lock:
+            return {
+                'pid': self.pid,
+                'counters': [
+                    [name, list(labels), value]
+                    for (name,labels),value in self.counters.items()
+                ],
+                'gauges': [
+                    [name, list(labels), value]
+                    for (name,labels),value in self.gauges.items()
+                ],
+                'histograms': [
+                    [name, list(labels), list(hist)]
+                    for (name,labels),hist in self.histograms.items()
+                ],
+            }
+
+    def flush(self, force=False):
+        """Write metrics to this process' file if flush interval has passed
+        """
+        if not self.path:
+            return
+        now = time.monotonic()
+        if not force and (now - self.last_flush < settings.METRICS_FLUSH_INTERVAL):
+            return
+        self.last_flush = now
+        try:
+            _write_json(self.path, self.dump())
+        except OSError as err:
+            logger.error(f'Could not write metrics file {self.path}: {err}')
+
+
+_registry = None
+_registry_lock = threading.Lock()
+
+def _get_registry():
+    """Registry for the current process; reset after fork
+    """
+    global _registry
+    pid = os.getpid()
+    if _registry and _registry.pid == pid:
+        return _registry
+    with _registry_lock:
+        if _registry and _registry.pid == pid:
+            return _registry
+        metrics_dir = Path(settings.METRICS_DIR)
+        path = metrics_dir / f'metrics-{pid}.json'
+        try:
+            metrics_dir.mkdir(parents=True, exist_ok=True)
+            if path.exists():
+                # left behind by a dead process that had the same PID
+                path.rename(metrics_dir / f'metrics-{pid}-{time.time_ns()}.json')
+        except OSError as err:
+            logger.error(f'Metrics dir {metrics_dir} not writable: {err}')
+            path = None
+        _registry = Registry(path)
+        return _registry
+
+
+def _labels(labels):
+    return tuple(sorted((key, str(val)) for key,val in labels.items()))
+
+def inc(name, value=1, **labels):
+    """Increment a counter
+    """
+    if enabled():
+        _get_registry().inc(name, value, _labels(labels))
+
+def gauge_add(name, value, **labels):
+    """Add (or subtract) value to a gauge
+    """
+    if enabled():
+        _get_registry().gauge_add(name, value, _labels(labels))
+
+def observe(name, value, **labels):
+    """Record an observation (in seconds) in a histogram
+    """
+    if enabled():
+        _get_registry().observe(name, value, _labels(labels))
+
+def cache_result(cache, hit):
+    """Count an app-level cache hit or miss
+    """
+    inc('namesdb_cache_requests_total', cache=cache, result='hit' if hit else 'miss')
+
+def flush(force=False):
+    """Write this process' metrics to disk (rate-limited unless force)
+    """
+    if enabled():
+        _get_registry().flush(force)
+
+
+@contextmanager
+def timer(name, errors=None, **labels):
+    """Observe the duration of the enclosed block in histogram NAME
+
+    If the block raises, counter ERRORS (if given) is incremented and the
+    exception is re-raised.
+
+    @param name: str Histogram name
+    @param errors: str Counter name
+    @param labels: Labels for both metrics
+    """
+    if not enabled():
+        yield
+        return
+    start = time.perf_counter()
+    try:
+        yield
+    except Exception:
+        if errors:
+            inc(errors, **labels)
+        raise
+    finally:
+        observe(name, time.perf_counter() - start, **labels)
+
+def es_timer(index, op):
+    """Time an Elasticsearch call
+    """
+    return timer(
+        'namesdb_es_request_duration_seconds',
+        errors='namesdb_es_request_errors_total',
+        index=index, op=op,
+    )
+
+
+# collection -----------------------------------------------------------
+
+def _write_json(path, data):
+    """Write data atomically so readers never see a partial file
+    """
+    tmp = f'{path}.{os.getpid()}.tmp'
+    with open(tmp, 'w') as f:
+        json.dump(data, f)
+    os.replace(tmp, path)
+
+def _pid_alive(pid):
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True
+    return True
+
+def _merge(totals, data, gauges=True):
+    for name,labels,value in data.get('counters', []):
+        key = (name, tuple(tuple(x) for x in labels))
+        totals['counters'][key] = totals['counters'].get(key, 0) + value
+    if gauges:
+        for name,labels,value in data.get('gauges', []):
+            key = (name, tuple(tuple(x) for x in labels))
+            totals['gauges'][key] = totals['gauges'].get(key, 0) + value
+    for name,labels,hist in data.get('histograms', []):
+        key = (name, tuple(tuple(x) for x in labels))
+        total = totals['histograms'].get(key)
+        if total is None:
+            totals['histograms'][key] = list(hist)
+        else:
+            totals['histograms'][key] = [a + b for a,b in zip(total, hist)]
+
+def _to_lists(totals):
+    return {
+        kind: [[name, list(labels), value] for (name,labels),value in items.items()]
+        for kind,items in totals.items()
+    }
+
+def collect():
+    """Sum metrics from all worker files (and this process' live registry)
+
+    Files from dead workers are merged into the archive file and removed.
+    @returns: dict {'counters': {}, 'gauges': {}, 'histograms': {}}
+    """
+    registry = _get_registry()
+    registry.flush(force=True)
+    metrics_dir = Path(settings.METRICS_DIR)
+    totals = {'counters': {}, 'gauges': {}, 'histograms': {}}
+    with open(metrics_dir / LOCK_FILENAME, 'a') as lockfile:
+        fcntl.flock(lockfile, fcntl.LOCK_EX)
+        archive_path = metrics_dir / ARCHIVE_FILENAME
+        archive = {'counters': {}, 'gauges': {}, 'histograms': {}}
+        if archive_path.exists():
+            _merge(archive, json.loads(archive_path.read_text()), gauges=False)
+        dead = []
+        for path in metrics_dir.glob('metrics-*.json'):
+            if path.name == ARCHIVE_FILENAME:
+                continue
+            try:
+                data = json.loads(path.read_text())
+            except (OSError, ValueError):
+                continue  # removed or being replaced
+            if data.get('pid') == registry.pid and path == registry.path:
+                _merge(totals, registry.dump())
+            elif path.name == f"metrics-{data.get('pid')}.json" \
+                 and _pid_alive(data['pid']):
+                _merge(totals, data)
+            else:
+                _merge(archive, data, gauges=False)
+                dead.append(path)
+        if dead:
+            _write_json(archive_path, _to_lists(archive))
+            for path in dead:
+                path.unlink(missing_ok=True)
+        _merge(totals, _to_lists(archive), gauges=False)
+    return totals
+
+
+# output ---------------------------------------------------------------
+
+def _escape(value):
+    return value.replace('\\', r'\\').replace('\n', r'\n').replace('"', r'\"')
+
+def _format_labels(labels, extra=()):
+    pairs = list(labels) + list(extra)
+    if not pairs:
+        return ''
+    return '{' + ','.join(f'{key}="{_escape(val)}"' for key,val in pairs) + '}'
+
+def _format_value(value):
+    if isinstance(value, float) and value.is_integer():
+        value = int(value)
+    return str(value)
+
+def render(totals=None):
+    """Render metrics in Prometheus text exposition format
+
+    @param totals: dict Output of collect() (default: collect now)
+    @returns: str
+    """
+    if totals is None:
+        totals = collect()
+    series = {}
+    for kind in ['counters', 'gauges', 'histograms']:
+        for (name,labels),value in totals[kind].items():
+            series.setdefault(name, []).append((labels, value))
+    lines = []
+    for name in sorted(series):
+        mtype,help_ = METRICS.get(name, ('untyped', ''))
+        lines.append(f'# HELP {name} {help_}')
+        lines.append(f'# TYPE {name} {mtype}')
+        for labels,value in sorted(series[name]):
+            if mtype == 'histogram':
+                for bound,count in zip(BUCKETS, value):
+                    le = (('le', _format_value(bound)),)
+                    lines.append(
+                        f'{name}_bucket{_format_labels(labels, le)} {count}'
+                    )
+                inf = (('le', '+Inf'),)
+                lines.append(f'{name}_bucket{_format_labels(labels, inf)} {value[-1]}')
+                lines.append(f'{name}_sum{_format_labels(labels)} {value[-2]}')
+                lines.append(f'{name}_count{_format_labels(labels)} {value[-1]}')
+            else:
+                lines.append(f'{name}{_format_labels(labels)} {_format_value(value)}')
+    return '\n'.join(lines) + '\n'
@@ -0,0 +1,195 @@
+import asyncio
+import math
+import time
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.http import HttpResponse
+from django.urls import Resolver404, resolve
+
+from . import admission
+from . import compression
+from . import metrics
+
+
+class MetricsMiddleware():
+    """Record per-view latency and in-flight request counts
+
+    Place near the top of settings.MIDDLEWARE so that time spent in other
+    middleware is included.  Works under WSGI and ASGI.
+    """
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        self.is_async = asyncio.iscoroutinefunction(get_response)
+        if self.is_async:
+            # lets Django see that this instance is a coroutine function
+            self._is_coroutine = asyncio.coroutines._is_coroutine
+
+    def __call__(self, request):
+        if self.is_async:
+            return self.__acall__(request)
+        if not metrics.enabled():
+            return self.get_response(request)
+        _started()
+        start = time.perf_counter()
+        status = 500
+        try:
+            response = self.get_response(request)
+            status = response.status_code
+            return response
+        finally:
+            _record(request, status, start)
+
+    async def __acall__(self, request):
+        if not metrics.enabled():
+            return await self.get_response(request)
+        _started()
+        start = time.perf_counter()
+        status = 500
+        try:
+            response = await self.get_response(request)
+            status = response.status_code
+            return response
+        finally:
+            _record(request, status, start)
+
+
+class AdmissionMiddleware():
+    """Per-client rate limits (429) and Elasticsearch overload responses (503)
+
+    See admission.  Place after MetricsMiddleware so rejected requests are
+    counted.
+    """
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        self.is_async = asyncio.iscoroutinefunction(get_response)
+        if self.is_async:
+            self._is_coroutine = asyncio.coroutines._is_coroutine
+
+    def __call__(self, request):
+        if self.is_async:
+            return self.__acall__(request)
+        return self._ratelimited(request) or self.get_response(request)
+
+    async def __acall__(self, request):
+        return self._ratelimited(request) or await self.get_response(request)
+
+    def _ratelimited(self, request):
+        if not admission.ratelimit_enabled():
+            return None
+        key,rate = admission.client_key(request)
+        allowed,retry_after = admission.limiter().allow(key, rate)
+        if allowed:
+            return None
+        metrics.inc(
+            'namesdb_admission_rejected_total', gate='client', reason='ratelimit'
+        )
+        return _retry_response(
+            429, 'Too many requests, please slow down.', retry_after
+        )
+
+    def process_exception(self, request, exception):
+        if isinstance(exception, admission.Overloaded):
+            return _retry_response(
+                503, 'Server busy, please try again shortly.',
+                settings.ADMISSION_RETRY_AFTER
+            )
+        return None
+
+
+class CompressionMiddleware():
+    """Compress responses; serve cached, already compressed ones
+
+    See compression.  Place after MetricsMiddleware and AdmissionMiddleware
+    and before middleware that adds response headers, so that cached
+    responses include those headers.
+    """
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        self.is_async = asyncio.iscoroutinefunction(get_response)
+        if self.is_async:
+            self._is_coroutine = asyncio.coroutines._is_coroutine
+
+    def __call__(self, request):
+        if self.is_async:
+            return self.__acall__(request)
+        if not compression.enabled():
+            return self.get_response(request)
+        encoding = compression.negotiate(request.headers.get('Accept-Encoding', ''))
+        cached = self._cached(request, encoding)
+        if cached:
+            return cached
+        return self._compress(request, self.get_response(request), encoding)
+
+    async def __acall__(self, request):
+        if not compression.enabled():
+            return await self.get_response(request)
+        encoding = compression.negotiate(request.headers.get('Accept-Encoding', ''))
+        # The cache lookups (including django.utils.cache's Vary header
+        # lookups, which have no async API) and compression block, so they
+        # run in a thread rather than on the event loop.
+        cached = await sync_to_async(self._cached, thread_sensitive=False)(
+            request, encoding
+        )
+        if cached:
+            return cached
+        response = await self.get_response(request)
+        return await sync_to_async(self._compress, thread_sensitive=False)(
+            request, response, encoding
+        )
+
+    def _cached(self, request, encoding):
+        response = compression.cached_response(request, encoding)
+        if response:
+            # label metrics with the view even though it did not run
+            try:
+                request.resolver_match = resolve(request.path_info)
+            except Resolver404:
+                pass
+        return response
+
+    def _compress(self, request, response, encoding):
+        return (
+            compression.store(request, response, encoding)
+            or compression.compress_response(response, encoding)
+        )
+
+
+def _retry_response(status, message, retry_after):
+    response = HttpResponse(message, status=status, content_type='text/plain')
+    response['Retry-After'] = str(max(1, math.ceil(retry_after)))
+    return response
+
+def _started():
+    metrics.gauge_add('namesdb_requests_in_flight', 1)
+    # other workers' files are all /metrics sees of their in-flight requests;
+    # flushing only when requests end would always show them idle
+    metrics.flush()
+
+def _record(request, status, start):
+    elapsed = time.perf_counter() - start
+    metrics.gauge_add('namesdb_requests_in_flight', -1)
+    view = _view_name(request)
+    metrics.observe('namesdb_view_duration_seconds', elapsed, view=view)
+    metrics.inc(
+        'namesdb_view_requests_total',
+        view=view, method=request.method, status=status
+    )
+    metrics.flush()
+
+def _view_name(request):
+    """URL name of the resolved view; avoids unbounded label values
+    """
+    match = getattr(request, 'resolver_match', None)
+    if match and match.url_name:
+        return match.url_name
+    return 'unresolved'
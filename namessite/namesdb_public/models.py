@@ -5,19 +5,28 @@ import json
 import logging
 logger = logging.getLogger(__name__)
 import os
+import re
 import sys
+import time
 
 logging.getLogger("elasticsearch").setLevel(logging.WARNING)
 
-import httpx
 from django.conf import settings
 from rest_framework.exceptions import NotFound
 from rest_framework.reverse import reverse
 
 from elastictools import docstore
 from elastictools.docstore import elasticsearch_dsl as dsl
+from elasticsearch.exceptions import NotFoundError, TransportError
 
+from . import admission
+from . import coalesce
 from . import definitions
+from . import facets
+from . import metrics
+from . import namekeys
+from . import requestcache
+from . import slowlog
 
 INDEX_PREFIX = 'names'
 
@@ -91,9 +100,16 @@ class Record(dsl.Document):
         for field in fieldnames:
             #print(f'    field {field}')
             if data.get(field):
+                value = data[field]
+                if field in YEAR_FIELDS.values():
+                    # integer fields (see years)
+                    value = year_int(value)
+                    if value is None:
+                        record.errors.append(f'{field}:{data[field]}')
+                        continue
                 try:
                     #print(f'      data[field] {data[field]}')
-                    setattr(record, field, data[field])
+                    setattr(record, field, value)
                     #print('       ok')
                 except dsl.exceptions.ValidationException:
                     err = ':'.join([field, data[field]])
@@ -123,18 +139,18 @@ class Record(dsl.Document):
     @staticmethod
     def field_values(class_, field, es=None, index=None):
         """Returns unique values and counts for specified field.
+        
+        All of them, however many (see composite_values), most frequent
+        first like a terms aggregation.
         """
         if es and index:
             s = dsl.Search(using=es, index=index)
         else:
             s = dsl.Search()
         s = s.doc_type(class_)
-        s.aggs.bucket('bucket', 'terms', field=field, size=1000)
-        response = s.execute()
-        return [
-            (x['key'], x['doc_count'])
-            for x in response.aggregations['bucket']['buckets']
-        ]
+        # composite values come in value order, which the stable sort keeps
+        # for values with the same count
+        return sorted(composite_values(s, field), key=lambda value: -value[1])
 
     @staticmethod
     def fields_enriched(record, label=False, description=False, list_fields=[]):
@@ -203,6 +219,42 @@ def assemble_fulltext(record, fieldnames):
             values.append(value)
     return ' '.join(values)
 
+# Completion suggester field for name autocomplete (see autocomplete)
+SUGGEST_FIELD = 'name_suggest'
+SUGGEST_CONTEXTS = [{'name': 'facility', 'type': 'category'}]
+# Facility context of every suggestion, for suggestions from any facility:
+# Elasticsearch 8 rejects completion queries without contexts on this field
+SUGGEST_ANY_FACILITY = '_any'
+
+def assemble_suggest(record, fieldnames, facilities):
+    """Completion suggester input from name fields
+    
+    @param record: Person, FarRecord, WraRecord
+    @param fieldnames: list
+    @param facilities: list Facility IDs (suggestion context)
+    @returns: dict
+    """
+    inputs = []
+    for fieldname in fieldnames:
+        value = getattr(record, fieldname, '')
+        if value and isinstance(value, str) and value.strip() not in inputs:
+            inputs.append(value.strip())
+    facilities = [SUGGEST_ANY_FACILITY] + [f for f in facilities if f]
+    return {'input': inputs, 'contexts': {'facility': facilities}}
+
+def assemble_namekeys(record, fieldnames):
+    """Normalized and phonetic name keys (see namekeys) from name fields
+    
+    @param record: Person, FarRecord, WraRecord
+    @param fieldnames: list
+    @returns: (list, list) name_keys, name_phonetic
+    """
+    values = [
+        value for value in [getattr(record, f, '') for f in fieldnames]
+        if value and isinstance(value, str)
+    ]
+    return namekeys.keys(values)
+
 
 FIELDS_PERSON = [
     'nr_id', 'family_name', 'given_name', 'given_name_alt', 'other_names',
@@ -255,6 +307,10 @@ HIGHLIGHT_FIELDS_PERSON = [
     'preexclusion_residence_city', 'postexclusion_residence_city',
 ]
 
+SUGGEST_FIELDS_PERSON = ['family_name', 'given_name', 'preferred_name']
+
+NAMEKEY_FIELDS_PERSON = ['family_name', 'given_name', 'given_name_alt', 'other_names']
+
 DISPLAY_FIELDS_PERSON = [
     'family_name',
     'given_name',
@@ -318,7 +374,7 @@ class Person(Record):
     preferred_name                = dsl.Text()
     #birth_date                    = dsl.Date()
     #birth_date_text               = dsl.Text()
-    birth_year                    = dsl.Keyword()
+    birth_year                    = dsl.Integer(fields={'keyword': dsl.Keyword()})
     birth_place                   = dsl.Text()
     death_date                    = dsl.Date()
     death_date_text               = dsl.Text()
@@ -339,6 +395,9 @@ class Person(Record):
     snac_url                      = dsl.Text()
     wikidata_url                  = dsl.Text()
     timestamp                     = dsl.Date()
+    name_suggest                  = dsl.Completion(contexts=SUGGEST_CONTEXTS)
+    name_keys                     = dsl.Keyword()
+    name_phonetic                 = dsl.Keyword()
     far_records                   = dsl.Nested(ListFarRecord)
     wra_records                   = dsl.Nested(ListWraRecord)
     family                        = dsl.Nested(ListFamily)
@@ -384,12 +443,30 @@ class Person(Record):
         # add fields to ease filtering by birth_year and facilities
         if data.get('birth_date'):
             record.birth_year = data['birth_date'].year
+        record.name_suggest = assemble_suggest(
+            record, SUGGEST_FIELDS_PERSON, Person._facilities(data)
+        )
+        record.name_keys,record.name_phonetic = assemble_namekeys(
+            record, NAMEKEY_FIELDS_PERSON
+        )
         # remove redacted fields
         for fieldname in EXCLUDE_FIELDS_PERSON:
             if hasattr(record, fieldname):
                delattr(record, fieldname)
         return record
     
+    @staticmethod
+    def _facilities(data):
+        """Facility IDs of a person's FAR records (IDs start with the facility)
+        """
+        return [
+            facility['id'] for facility in FarPage.facilities()
+            if any(
+                r.get('far_record_id', '').startswith((f"{facility['id']}-", f"{facility['id']}_"))
+                for r in data.get('far_records', [])
+            )
+        ]
+    
     @staticmethod
     def from_hit(hit):
         """Build Person object from Elasticsearch hit
@@ -411,14 +488,19 @@ class Person(Record):
     @staticmethod
     def locations(nr_id, request):
         """Get PersonLocations for Person"""
-        es = docstore.Docstore(
-            INDEX_PREFIX, settings.DOCSTORE_HOST, settings
-        ).es
-        s = dsl.Search(using=es, index='namespersonlocation')
+        s = Person._locations_search(nr_id).using(get_docstore().es)
+        return Person._locations(execute_dsl(s, 'lookup'))
+
+    @staticmethod
+    def _locations_search(nr_id):
+        s = dsl.Search(index='namespersonlocation')
         s = s.filter('term', **{'person_id': nr_id})
         # records with blank entry_dates (i.e. preexclusion) sort first
         s = s.sort('exit_date', 'entry_date')
-        response = s.execute()
+        return s
+
+    @staticmethod
+    def _locations(response):
         locations = [
             {
                 fieldname: getattr(hit, fieldname, '')
@@ -434,27 +516,61 @@ class Person(Record):
     @staticmethod
     def ddr_objects(nr_id, request):
         """Get DDR objects for Person"""
+        import httpx  # deferred: only needed here, and slow to import
+        ui_url,api_url,kwargs = Person._ddr_request(nr_id)
+        with metrics.timer(
+                'namesdb_ddr_api_duration_seconds',
+                errors='namesdb_ddr_api_errors_total'
+        ):
+            r = httpx.get(api_url, **kwargs)
+        return Person._ddr_response(r, ui_url, api_url)
+
+    @staticmethod
+    def _ddr_request(nr_id):
+        """UI and API URLs and httpx request kwargs for ddr_objects
+        """
         naan,noid = nr_id.split('/')
         # TODO cache this
         ui_url = f"{settings.DDR_UI_URL}/nrid/{naan}/{noid}/"
         api_url = f"{settings.DDR_API_URL}/api/0.2/nrid/{naan}/{noid}/"
+        kwargs = {'timeout': settings.DDR_API_TIMEOUT, 'follow_redirects': True}
         if settings.DDR_API_USERNAME and settings.DDR_API_PASSWORD:
-            r = httpx.get(
-                api_url, timeout=settings.DDR_API_TIMEOUT,
-                auth=(settings.DDR_API_USERNAME, settings.DDR_API_PASSWORD),
-                follow_redirects=True
-            )
-        else:
-            r = httpx.get(
-                api_url, timeout=settings.DDR_API_TIMEOUT,
-                follow_redirects=True
-            )
+            kwargs['auth'] = (settings.DDR_API_USERNAME, settings.DDR_API_PASSWORD)
+        return ui_url,api_url,kwargs
+
+    @staticmethod
+    def _ddr_response(r, ui_url, api_url):
+        if r.status_code != HTTPStatus.OK:
+            metrics.inc('namesdb_ddr_api_errors_total')
         if r.status_code == HTTPStatus.OK:
             data = r.json()
             if data.get('objects') and len(data['objects']):
                 return ui_url,api_url,r.status_code,data['objects']
         return ui_url,api_url,r.status_code,[]
 
+    @staticmethod
+    async def aget(oid, request):
+        """Async version of get"""
+        return await adocstore_object(request, 'person', oid)
+
+    @staticmethod
+    async def alocations(nr_id, request):
+        """Async version of locations"""
+        s = Person._locations_search(nr_id)
+        return Person._locations(await aexecute_dsl(s, 'lookup'))
+
+    @staticmethod
+    async def addr_objects(nr_id, request):
+        """Async version of ddr_objects"""
+        import httpx
+        ui_url,api_url,kwargs = Person._ddr_request(nr_id)
+        with metrics.timer(
+                'namesdb_ddr_api_duration_seconds',
+                errors='namesdb_ddr_api_errors_total'
+        ):
+            async with httpx.AsyncClient() as client:
+                r = await client.get(api_url, **kwargs)
+        return Person._ddr_response(r, ui_url, api_url)
 
 FIELDS_FACILITY = [
     'facility_id',
@@ -488,15 +604,14 @@ class Facility(dsl.Document):
 
     @staticmethod
     def facilities():
-        return [
-            hit.to_dict()
-            for hit in docstore.elasticsearch_dsl.Search(
-                    using=docstore.Docstore(
-                        INDEX_PREFIX, settings.DOCSTORE_HOST, settings
-                    ).es,
-                    index=f'{INDEX_PREFIX}facility'
-            ).scan()
-        ]
+        with metrics.es_timer(f'{INDEX_PREFIX}facility', 'scan'):
+            return [
+                hit.to_dict()
+                for hit in docstore.elasticsearch_dsl.Search(
+                        using=get_docstore().es,
+                        index=f'{INDEX_PREFIX}facility'
+                ).scan()
+            ]
 
     @staticmethod
     def from_dict(id_, data):
@@ -668,12 +783,29 @@ class FarPage(dsl.Document):
 
     @staticmethod
     def farrecords(facility_id, far_page, request):
-        ds = docstore.Docstore(INDEX_PREFIX, settings.DOCSTORE_HOST, settings)
-        s = FarRecord.search(using=ds.es)
+        s = FarPage._farrecords_search(facility_id, far_page)
+        s = s.using(get_docstore().es)
+        return execute_dsl(s, 'lookup')
+
+    @staticmethod
+    def _farrecords_search(facility_id, far_page):
+        s = FarRecord.search()
         s = s.filter('term', facility=facility_id)
         s = s.filter('term', far_page=int(far_page))
-        return s[:1000].execute()
+        return s[:1000]
 
+    @staticmethod
+    async def aget(facility_id, far_page, request):
+        """Async version of get"""
+        return await adocstore_object(
+            request, 'farpage', FarPage.es_id(facility_id, far_page)
+        )
+
+    @staticmethod
+    async def afarrecords(facility_id, far_page, request):
+        """Async version of farrecords"""
+        s = FarPage._farrecords_search(facility_id, far_page)
+        return await aexecute_dsl(s, 'lookup')
 
 FIELDS_FARRECORD = [
     'far_record_id', 'facility', 'far_page', 'original_order', 'family_number',
@@ -731,6 +863,10 @@ AGG_FIELDS_FARRECORD = {
 HIGHLIGHT_FIELDS_FARRECORD = [
 ]
 
+SUGGEST_FIELDS_FARRECORD = ['last_name']
+
+NAMEKEY_FIELDS_FARRECORD = ['last_name', 'first_name', 'other_names']
+
 class NestedPerson(dsl.InnerDoc):
     nr_id = dsl.Keyword()
     preferred_name = dsl.Text()
@@ -755,7 +891,7 @@ class FarRecord(Record):
     first_name              = dsl.Text()
     other_names             = dsl.Text()
     #date_of_birth           = dsl.Keyword()
-    year_of_birth           = dsl.Keyword()
+    year_of_birth           = dsl.Integer(fields={'keyword': dsl.Keyword()})
     sex                     = dsl.Keyword()
     marital_status          = dsl.Keyword()
     citizenship             = dsl.Keyword()
@@ -783,6 +919,9 @@ class FarRecord(Record):
     person                  = dsl.Nested(NestedPerson)
     family                  = dsl.Nested(ListFamily)
     timestamp               = dsl.Date()
+    name_suggest            = dsl.Completion(contexts=SUGGEST_CONTEXTS)
+    name_keys               = dsl.Keyword()
+    name_phonetic           = dsl.Keyword()
     
     class Index:
         model = 'farrecord'
@@ -795,6 +934,11 @@ class FarRecord(Record):
     def get(oid, request):
         """Get record for web app"""
         return docstore_object(request, 'farrecord', oid)
+
+    @staticmethod
+    async def aget(oid, request):
+        """Async version of get"""
+        return await adocstore_object(request, 'farrecord', oid)
     
     @staticmethod
     def from_dict(far_record_id, data):
@@ -816,6 +960,12 @@ class FarRecord(Record):
                 }
                 for person in data['family']
             ]
+        record.name_suggest = assemble_suggest(
+            record, SUGGEST_FIELDS_FARRECORD, [data.get('facility')]
+        )
+        record.name_keys,record.name_phonetic = assemble_namekeys(
+            record, NAMEKEY_FIELDS_FARRECORD
+        )
         # remove redacted fields
         for fieldname in EXCLUDE_FIELDS_FARRECORD:
             if hasattr(record, fieldname):
@@ -895,6 +1045,10 @@ AGG_FIELDS_WRARECORD = {
 HIGHLIGHT_FIELDS_WRARECORD = [
 ]
 
+SUGGEST_FIELDS_WRARECORD = ['lastname']
+
+NAMEKEY_FIELDS_WRARECORD = ['lastname', 'firstname']
+
 class ListFamily(dsl.InnerDoc):
     familyno = dsl.Keyword()
     wra_record_id = dsl.Keyword()
@@ -910,7 +1064,7 @@ class WraRecord(Record):
     lastname          = dsl.Text()
     firstname         = dsl.Text()
     middleinitial     = dsl.Text()
-    birthyear         = dsl.Keyword()
+    birthyear         = dsl.Integer(fields={'keyword': dsl.Keyword()})
     gender            = dsl.Keyword()
     originalstate     = dsl.Keyword()
     familyno          = dsl.Keyword()
@@ -944,6 +1098,9 @@ class WraRecord(Record):
     person            = dsl.Nested(NestedPerson)
     family            = dsl.Nested(ListFamily)
     timestamp         = dsl.Date()
+    name_suggest      = dsl.Completion(contexts=SUGGEST_CONTEXTS)
+    name_keys         = dsl.Keyword()
+    name_phonetic     = dsl.Keyword()
     
     class Index:
         model = 'wrarecord'
@@ -957,6 +1114,11 @@ class WraRecord(Record):
         """Get record for web app"""
         return docstore_object(request, 'wrarecord', oid)
 
+    @staticmethod
+    async def aget(oid, request):
+        """Async version of get"""
+        return await adocstore_object(request, 'wrarecord', oid)
+
     @staticmethod
     def from_dict(wra_record_id, data):
         """
@@ -980,6 +1142,12 @@ class WraRecord(Record):
                 }
                 for person in data['family']
             ]
+        record.name_suggest = assemble_suggest(
+            record, SUGGEST_FIELDS_WRARECORD, [data.get('facility')]
+        )
+        record.name_keys,record.name_phonetic = assemble_namekeys(
+            record, NAMEKEY_FIELDS_WRARECORD
+        )
         return record
     
     @staticmethod
@@ -997,6 +1165,23 @@ class WraRecord(Record):
         return Record.field_values(WraRecord, field, es, index)
 
 
+# Birth year of each model: integer fields, with a .keyword sub-field for
+# exact string matches (see years)
+YEAR_FIELDS = {
+    'person': 'birth_year',
+    'farrecord': 'year_of_birth',
+    'wrarecord': 'birthyear',
+}
+
+def year_int(value):
+    """Year as an int for the year fields, or None if it isn't one
+    
+    @param value: int or str e.g. 1920, '1920', ' 1920.0'
+    @returns: int or None
+    """
+    match = re.fullmatch(r'\s*(\d{1,4})(?:\.0*)?\s*', str(value))
+    return int(match.group(1)) if match else None
+
 DOCTYPES_BY_MODEL = {
     'person':    f'{INDEX_PREFIX}person',
     'farrecord': f'{INDEX_PREFIX}farrecord',
@@ -1039,15 +1224,392 @@ for fieldset in [AGG_FIELDS_PERSON, AGG_FIELDS_FARRECORD, AGG_FIELDS_WRARECORD,
 
 SEARCH_FORM_LABELS = {}
 
+def get_docstore():
+    """Docstore for the backend selected in settings.DOCSTORE_BACKEND
+    
+    'elasticsearch' (default) or 'memory' (see memstore).
+    """
+    if settings.DOCSTORE_BACKEND == 'memory':
+        from . import memstore
+        return memstore.Docstore(INDEX_PREFIX, settings.DOCSTORE_HOST, settings)
+    return docstore.Docstore(INDEX_PREFIX, settings.DOCSTORE_HOST, settings)
+
 def docstore_object(request, model, oid):
-    data = docstore.Docstore(
-        INDEX_PREFIX, settings.DOCSTORE_HOST, settings
-    ).es.get(
-        index=MODELS_DOCTYPES[model],
-        id=oid
+    index = MODELS_DOCTYPES[model]
+    es = get_docstore().es
+    def fetch():
+        with admission.admit('lookup'), metrics.es_timer(index, 'get'):
+            return es.get(index=index, id=oid)
+    data = coalesce.call(('get', index, oid), fetch)
+    return format_object_detail(data, request)
+
+def docstore_fields(model, oid, fields):
+    """Some fields of a record, without fetching the whole document
+    
+    @param model: str
+    @param oid: str
+    @param fields: list
+    @returns: dict (the filtered _source) or None if there is no such record
+    """
+    index = MODELS_DOCTYPES[model]
+    es = get_docstore().es
+    def fetch():
+        with admission.admit('lookup'), metrics.es_timer(index, 'get'):
+            return es.get(index=index, id=oid, _source_includes=fields)
+    try:
+        return coalesce.call(('get', index, oid, fields), fetch)['_source']
+    except NotFoundError:
+        return None
+
+def docstore_exists(model, oid):
+    """Whether a record exists, without fetching it
+    
+    @param model: str
+    @param oid: str
+    @returns: bool
+    """
+    index = MODELS_DOCTYPES[model]
+    es = get_docstore().es
+    def fetch():
+        with admission.admit('lookup'), metrics.es_timer(index, 'exists'):
+            return es.exists(index=index, id=oid)
+    return bool(coalesce.call(('exists', index, oid), fetch))
+
+def search_raw(s, gate='search'):
+    """Raw response to an elasticsearch_dsl Search
+    
+    Identical concurrent searches are coalesced (see coalesce) and the
+    call is admitted through GATE (see admission).
+    
+    @param s: elasticsearch_dsl.Search
+    @param gate: str 'lookup' or 'search'
+    @returns: dict
+    """
+    es = dsl.connections.get_connection(s._using)
+    index = ','.join(s._index or [])
+    body = s.to_dict()
+    def fetch():
+        with admission.admit(gate), metrics.es_timer(index, 'search'):
+            return es.search(index=s._index, body=body, **s._params)
+    return coalesce.call(('search', index, body, s._params), fetch)
+
+def composite_values(s, field, after=None, page_size=None):
+    """Distinct values of FIELD in the hits of S, and their counts
+    
+    Pages through a composite aggregation, so there is no cap on the
+    number of values and the cluster never builds the whole list at once.
+    
+    @param s: elasticsearch_dsl.Search
+    @param field: str
+    @param after: Start after this value (resume)
+    @param page_size: int Values per request (default settings.FIELD_VALUES_PAGE_SIZE)
+    @returns: generator of (value, doc_count) in value order
+    """
+    page_size = page_size or settings.FIELD_VALUES_PAGE_SIZE
+    after_key = {'value': after} if after is not None else None
+    while True:
+        page = s[0:0].sort().extra(track_total_hits=False)
+        page.aggs._params = {'aggs': {}}
+        composite = {
+            'sources': [{'value': {'terms': {'field': field}}}],
+            'size': page_size,
+        }
+        if after_key:
+            composite['after'] = after_key
+        page.aggs.bucket('values', 'composite', **composite)
+        result = search_raw(page).get('aggregations', {}).get('values', {})
+        buckets = result.get('buckets', [])
+        for bucket in buckets:
+            yield bucket['key']['value'],bucket['doc_count']
+        after_key = result.get('after_key')
+        if not after_key or len(buckets) < page_size:
+            return
+
+def execute_dsl(s, gate='search'):
+    """Execute an elasticsearch_dsl Search through search_raw
+    
+    @returns: elasticsearch_dsl.response.Response
+    """
+    return dsl.response.Response(s, search_raw(s, gate))
+
+def execute_search(searcher, limit, offset, request=None):
+    """Execute a prepared elastictools.search.Searcher
+    
+    All UI and API searches go through here so they can be instrumented,
+    admitted (see admission), coalesced (see coalesce), and slow ones
+    logged (see slowlog).  `took` includes time spent waiting for
+    admission or for a coalesced call.  Aggregations are fetched apart
+    from hits and cached (see facets), and both are routed to shard copies
+    with warm request caches (see requestcache).
+    
+    @param searcher: elastictools.search.Searcher
+    @param limit: int
+    @param offset: int
+    @param request: Django request (for the slow query log)
+    @returns: elastictools.search.SearchResults
+    """
+    s = searcher.s
+    start = time.perf_counter()
+    hits,facets_search = facets.split(s[int(offset):int(offset)+int(limit)])
+    aggregations = facets.cached(facets_search)
+    hits,routed_facets = requestcache.route(hits, facets_search, request)
+    if facets_search is None or aggregations is not None:
+        raw = search_raw(hits)
+    else:
+        # facets not cached: hits and facets in one request
+        raw,facets_raw = msearch_raw([hits, routed_facets])
+        aggregations = facets.store(facets_search, facets_raw)
+    raw = facets.merge(_checked(raw), aggregations)
+    took = (time.perf_counter() - start) * 1000
+    results = _prefetched_results(searcher, raw, limit, offset)
+    slowlog.log_search(
+        s, took, getattr(results, 'total', None), limit, offset, request
     )
+    return results
+
+
+def _count_search(searcher, request):
+    """Size-0 search for the exact number of hits of a prepared Searcher
+    """
+    s = searcher.s[0:0].sort().extra(track_total_hits=True)
+    s.aggs._params = {'aggs': {}}
+    s._highlight = {}
+    return requestcache.cacheable(s, request)
+
+def count_search(searcher, request=None):
+    """Number of records matching a prepared Searcher, without hits or aggregations
+    
+    A size-0 search with track_total_hits rather than _count, so the
+    count can come from the shard request cache (see requestcache).
+    
+    @param searcher: elastictools.search.Searcher
+    @param request: Django request (for the slow query log)
+    @returns: int
+    """
+    s = _count_search(searcher, request)
+    start = time.perf_counter()
+    total = search_raw(s)['hits']['total']['value']
+    took = (time.perf_counter() - start) * 1000
+    slowlog.log_search(s, took, total, 0, 0, request)
+    return total
+
+
+# Search params that go in msearch header lines
+MSEARCH_HEADER_PARAMS = ['preference', 'request_cache', 'routing', 'search_type']
+
+def _msearch_body(searches):
+    body = []
+    for s in searches:
+        header = {'index': ','.join(s._index or [])}
+        header.update({
+            key: value for key,value in s._params.items()
+            if key in MSEARCH_HEADER_PARAMS
+        })
+        body += [header, s.to_dict()]
+    return body
+
+def msearch_raw(searches, gate='search'):
+    """Raw responses to several elasticsearch_dsl Searches in one msearch
+    
+    Admitted, coalesced, and timed like search_raw.
+    
+    @param searches: list of elasticsearch_dsl.Search
+    @param gate: str 'lookup' or 'search'
+    @returns: list of dict, one per search ('error' if it failed)
+    """
+    es = get_docstore().es
+    body = _msearch_body(searches)
+    index = ','.join(header['index'] for header in body[::2])
+    def fetch():
+        with admission.admit(gate), metrics.es_timer(index, 'msearch'):
+            return es.msearch(body=body)
+    return coalesce.call(('msearch', index, body), fetch)['responses']
+
+def execute_multisearch(searches, request=None, gate='search'):
+    """Execute several searches in one msearch request
+    
+    Slow searches are logged (see slowlog) with the time Elasticsearch
+    reports for each.
+    
+    @param searches: list of elasticsearch_dsl.Search
+    @param request: Django request (for the slow query log)
+    @param gate: str Admission gate (see admission)
+    @returns: list of elasticsearch_dsl.response.Response (None if it failed)
+    """
+    return _multisearch_responses(searches, msearch_raw(searches, gate), request)
+
+def _multisearch_responses(searches, raws, request):
+    responses = []
+    for s,raw in zip(searches, raws):
+        if 'error' in raw:
+            logger.error(f"msearch {s._index}: {raw['error']}")
+            responses.append(None)
+            continue
+        response = dsl.response.Response(s, raw)
+        slowlog.log_search(
+            s, raw.get('took', 0), response.hits.total.value,
+            s._extra.get('size', 10), s._extra.get('from', 0), request
+        )
+        responses.append(response)
+    return responses
+
+
+def _checked(raw):
+    """Raise the error of a failed msearch response, like search would
+    """
+    if 'error' in raw:
+        error = raw['error']
+        raise TransportError(
+            raw.get('status', 500),
+            error.get('type', 'error') if isinstance(error, dict) else str(error),
+            error,
+        )
+    return raw
+
+class _PrefetchedClient():
+    """Answers a search with a response that was already fetched
+    
+    Lets elastictools build SearchResults from a coalesced or async response.
+    """
+
+    def __init__(self, response):
+        self.response = response
+
+    def search(self, body=None, index=None, **kwargs):
+        return self.response
+
+def _prefetched_results(searcher, raw, limit, offset):
+    s = searcher.s
+    searcher.s = s.using(_PrefetchedClient(raw))
+    try:
+        return searcher.execute(limit, offset)
+    finally:
+        searcher.s = s
+
+# async ----------------------------------------------------------------
+# Used by the async views (see namessite/asgi.py).  elasticsearch_dsl has
+# no async support so queries are still built with dsl (and elastictools),
+# then sent with the async client.
+
+_async_es = {}
+
+def get_async_es():
+    """Per-process async Elasticsearch client for settings.DOCSTORE_BACKEND
+    
+    The 'elasticsearch' backend requires aiohttp.
+    """
+    backend = settings.DOCSTORE_BACKEND
+    if backend not in _async_es:
+        if backend == 'memory':
+            from . import memstore
+            _async_es[backend] = memstore.AsyncElasticsearch(
+                memstore.client(settings)
+            )
+        else:
+            from elasticsearch import AsyncElasticsearch
+            if settings.DOCSTORE_SSL_CERTFILE and settings.DOCSTORE_PASSWORD:
+                _async_es[backend] = AsyncElasticsearch(
+                    [settings.DOCSTORE_HOST],
+                    use_ssl=True, ca_certs=settings.DOCSTORE_SSL_CERTFILE,
+                    http_auth=(settings.DOCSTORE_USERNAME, settings.DOCSTORE_PASSWORD),
+                )
+            else:
+                _async_es[backend] = AsyncElasticsearch([settings.DOCSTORE_HOST])
+    return _async_es[backend]
+
+async def adocstore_object(request, model, oid):
+    """Async version of docstore_object"""
+    index = MODELS_DOCTYPES[model]
+    async def fetch():
+        async with admission.aadmit('lookup'):
+            with metrics.es_timer(index, 'get'):
+                return await get_async_es().get(index=index, id=oid)
+    data = await coalesce.acall(('get', index, oid), fetch)
     return format_object_detail(data, request)
 
+async def adocstore_fields(model, oid, fields):
+    """Async version of docstore_fields"""
+    index = MODELS_DOCTYPES[model]
+    async def fetch():
+        async with admission.aadmit('lookup'):
+            with metrics.es_timer(index, 'get'):
+                return await get_async_es().get(
+                    index=index, id=oid, _source_includes=fields
+                )
+    try:
+        return (await coalesce.acall(('get', index, oid, fields), fetch))['_source']
+    except NotFoundError:
+        return None
+
+async def asearch_raw(s, gate='search'):
+    """Async version of search_raw"""
+    index = ','.join(s._index or [])
+    body = s.to_dict()
+    async def fetch():
+        async with admission.aadmit(gate):
+            with metrics.es_timer(index, 'search'):
+                return await get_async_es().search(
+                    index=s._index, body=body, **s._params
+                )
+    return await coalesce.acall(('search', index, body, s._params), fetch)
+
+async def aexecute_dsl(s, gate='search'):
+    """Async version of execute_dsl"""
+    return dsl.response.Response(s, await asearch_raw(s, gate))
+
+async def aexecute_search(searcher, limit, offset, request=None):
+    """Async version of execute_search
+    
+    @param searcher: elastictools.search.Searcher (prepared)
+    @param limit: int
+    @param offset: int
+    @param request: Django request (for the slow query log)
+    @returns: elastictools.search.SearchResults
+    """
+    s = searcher.s
+    start = time.perf_counter()
+    hits,facets_search = facets.split(s[int(offset):int(offset)+int(limit)])
+    aggregations = await facets.acached(facets_search)
+    hits,routed_facets = requestcache.route(hits, facets_search, request)
+    if facets_search is None or aggregations is not None:
+        raw = await asearch_raw(hits)
+    else:
+        raw,facets_raw = await amsearch_raw([hits, routed_facets])
+        aggregations = await facets.astore(facets_search, facets_raw)
+    raw = facets.merge(_checked(raw), aggregations)
+    took = (time.perf_counter() - start) * 1000
+    results = _prefetched_results(searcher, raw, limit, offset)
+    slowlog.log_search(
+        s, took, getattr(results, 'total', None), limit, offset, request
+    )
+    return results
+
+async def acount_search(searcher, request=None):
+    """Async version of count_search"""
+    s = _count_search(searcher, request)
+    start = time.perf_counter()
+    total = (await asearch_raw(s))['hits']['total']['value']
+    took = (time.perf_counter() - start) * 1000
+    slowlog.log_search(s, took, total, 0, 0, request)
+    return total
+
+async def amsearch_raw(searches, gate='search'):
+    """Async version of msearch_raw"""
+    body = _msearch_body(searches)
+    index = ','.join(header['index'] for header in body[::2])
+    async def fetch():
+        async with admission.aadmit(gate):
+            with metrics.es_timer(index, 'msearch'):
+                return await get_async_es().msearch(body=body)
+    return (await coalesce.acall(('msearch', index, body), fetch))['responses']
+
+async def aexecute_multisearch(searches, request=None, gate='search'):
+    """Async version of execute_multisearch"""
+    return _multisearch_responses(
+        searches, await amsearch_raw(searches, gate), request
+    )
+
+
 def format_object_detail(document, request, listitem=False):
     """Formats repository objects, adds list URLs,
     """
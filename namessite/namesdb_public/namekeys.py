@@ -0,0 +1,127 @@
+"""Normalized and phonetic name keys for matching romanized name variants
+
+Japanese names were romanized by many hands: Inoue/Inouye, Ota/Ohta/Oota,
+Sato/Satow/Satoh, Shimbo/Shinbo, Hotta/Hota, Yamasaki/Yamazaki.  Users
+find the variants with wildcard and fuzzy query_string searches, which scan
+the terms dictionary and are among the most expensive queries these
+indices see.
+
+Instead, two keyword fields are filled in at index time (models'
+from_dict) from the name fields of each record, one key per name word:
+
+    name_keys      normalize(): long vowels and doubled consonants folded,
+                   Kunrei/Nihon-shiki spellings folded to Hepburn
+    name_phonetic  phonetic(): normalize() plus voiced/unvoiced consonants
+                   (z/s, g/k, d/t, j/ch) and l/r, v/b merged
+
+and query() matches each word of a search with exact term lookups on the
+keys; a name_keys match ranks above a name_phonetic-only match.
+
+    >>> normalize('Ohta'), normalize('Oota'), normalize('Satow')
+    ('ota', 'ota', 'sato')
+    >>> phonetic('Yamazaki') == phonetic('Yamasaki')
+    True
+"""
+import re
+import unicodedata
+
+from elastictools.docstore import elasticsearch_dsl as dsl
+
+KEYS_FIELD = 'name_keys'
+PHONETIC_FIELD = 'name_phonetic'
+# Boost of exact normalized matches over phonetic-only matches
+KEYS_BOOST = 2.0
+
+HEPBURN = {
+    'sy': 'sh', 'ty': 'ch', 'zy': 'j', 'jy': 'j',
+    'si': 'shi', 'ti': 'chi', 'tu': 'tsu', 'hu': 'fu', 'zi': 'ji', 'di': 'ji',
+}
+# Applied in order to the lowercased word
+NORMALIZE = [
+    # Inouye, Uyeda
+    (re.compile(r'(?<=[aeiou])ye'), 'e'),
+    # long vowels: Ohta, Satoh, Satow, Oota, Satou, Yuuki
+    (re.compile(r'o[hw](?![aeiouy])'), 'o'),
+    (re.compile(r'ou|oo'), 'o'),
+    (re.compile(r'uu'), 'u'),
+    (re.compile(r'aa'), 'a'),
+    (re.compile(r'ii'), 'i'),
+    (re.compile(r'ee'), 'e'),
+    # Kunrei/Nihon-shiki to Hepburn, in one pass so results aren't rewritten;
+    # the hu of Hepburn shu and chu (Shuji, Chuichi) stays
+    (re.compile(r'sy|ty|zy|jy|si|ti|tu|(?<![sc])hu|zi|di'), lambda m: HEPBURN[m.group()]),
+    # Shimbo, Homma
+    (re.compile(r'm(?=[bpm])'), 'n'),
+    # Hatchi, Hotta, Masshi
+    (re.compile(r'tch'), 'ch'),
+    (re.compile(r'([b-df-hj-np-tv-z])\1+'), r'\1'),
+]
+PHONETIC = [
+    (re.compile(r'ch|j'), 'c'),
+    (re.compile(r'z'), 's'),
+    (re.compile(r'g'), 'k'),
+    (re.compile(r'd'), 't'),
+    (re.compile(r'l'), 'r'),
+    (re.compile(r'v'), 'b'),
+    (re.compile(r'([a-z])\1+'), r'\1'),
+]
+
+
+def words(text):
+    """Lowercase ASCII words of a name, diacritics (macrons) removed
+    """
+    text = unicodedata.normalize('NFKD', str(text))
+    text = ''.join(c for c in text if not unicodedata.combining(c))
+    return re.findall(r'[a-z]+', text.lower())
+
+def _fold(word, rules):
+    for pattern,replacement in rules:
+        word = pattern.sub(replacement, word)
+    return word
+
+def normalize(word):
+    """Normalized key of a romanized name word
+    """
+    return _fold(''.join(words(word)), NORMALIZE)
+
+def phonetic(word):
+    """Phonetic key of a romanized name word
+    """
+    return _fold(normalize(word), PHONETIC)
+
+def keys(values):
+    """Normalized and phonetic keys of name values, for indexing
+
+    @param values: list of str Name field values
+    @returns: (list, list) Unique normalized keys, phonetic keys
+    """
+    normalized = []
+    for value in values:
+        for word in words(value):
+            key = normalize(word)
+            if key and key not in normalized:
+                normalized.append(key)
+    phonetics = []
+    for key in normalized:
+        code = _fold(key, PHONETIC)
+        if code not in phonetics:
+            phonetics.append(code)
+    return normalized,phonetics
+
+def query(text):
+    """Query matching records with every word of TEXT in their name keys
+
+    @param text: str Name(s), e.g. 'Satoh Yaeko'
+    @returns: elasticsearch_dsl.Q
+    @raises: ValueError if TEXT has no words
+    """
+    clauses = [
+        dsl.Q('bool', should=[
+            dsl.Q('term', **{KEYS_FIELD: {'value': key, 'boost': KEYS_BOOST}}),
+            dsl.Q('term', **{PHONETIC_FIELD: _fold(key, PHONETIC)}),
+        ])
+        for key in keys([text])[0]
+    ]
+    if not clauses:
+        raise ValueError(f'No name in "{text}"')
+    return dsl.Q('bool', must=clauses)
@@ -0,0 +1,215 @@
+"""Fulltext query cost guard
+
+`fulltext` is Elasticsearch query_string syntax and goes to the cluster as
+typed.  A handful of inputs cost far more than the rest: a leading wildcard
+(`*naka`) walks the whole terms dictionary, short prefixes (`a*`) and
+fuzzy terms expand to thousands of terms, regexes (`/ta.*a/`) are both,
+and a long boolean expression multiplies whatever it contains.
+
+guard() parses the input, estimates its cost, and rewrites what it can:
+
+    tanaka~2, tanaka~   fuzziness is capped: tanaka~1
+
+and rejects (QueryCostError, with a message for the user) what it can't:
+
+    /ta.*a/             regular expressions
+    *naka, ?anaka       leading wildcards
+    ta*, t?naka         fewer than settings.QUERY_MIN_WILDCARD_PREFIX
+                        characters before the first wildcard
+    a OR b OR ...       more than settings.QUERY_MAX_CLAUSES clauses
+                        a cost over settings.QUERY_COST_BUDGET
+
+Rewritten and rejected queries are logged with their cost and counted in
+the namesdb_query_guard_total metric.
+
+    >>> guard('naka AND yaeko~2')
+    'naka AND yaeko~1'
+"""
+import logging
+logger = logging.getLogger(__name__)
+import re
+
+from django.conf import settings
+
+from . import metrics
+
+# Estimated cost of each kind of clause
+COST_TERM = 1
+COST_RANGE = 10
+COST_WILDCARD = 10
+COST_INNER_WILDCARD = 20
+COST_FUZZY_EDIT = 10
+
+TOKENS = re.compile(r'''
+    (?P<space>\s+)
+  | (?P<phrase>"(?:\\.|[^"\\])*"?(?:~[\d.]*)?(?:\^[\d.]+)?)
+  | (?P<regex>/(?:\\.|[^/\\])*/?)
+  | (?P<range>[\[{][^\]}]*[\]}]?)
+  | (?P<operator>(?:AND|OR|NOT|&&|\|\|)(?=[\s()]|$)|[+\-!](?=[\s("]))
+  | (?P<paren>[()])
+  | (?P<field>[\w.]+:(?=\S))
+  | (?P<term>(?:\\.|[^\s()"\[\]{}])+)
+''', re.VERBOSE)
+WILDCARD = re.compile(r'(?<!\\)[*?]')
+FUZZY = re.compile(r'(?<!\\)~([\d.]*)$')
+BOOST = re.compile(r'(?<!\\)\^[\d.]+$')
+
+
+class QueryCostError(ValueError):
+    pass
+
+
+def tokens(text):
+    """Split query_string input into (kind, text) tokens
+
+    Kinds: space, phrase, regex, range, operator, paren, field, term.
+    Joining the texts gives back the input.
+    """
+    return [(m.lastgroup, m.group()) for m in TOKENS.finditer(text)]
+
+def _term(text):
+    """Rewrite a term; returns (text, cost, rewrite or None, problem or None)
+    """
+    modifier = text[:len(text) - len(text.lstrip('+-!'))]
+    body = text[len(modifier):]
+    boost = BOOST.search(body)
+    suffix = boost.group() if boost else ''
+    body = body[:len(body) - len(suffix)]
+    fuzzy = FUZZY.search(body)
+    if fuzzy:
+        body = body[:fuzzy.start()]
+    if body == '*':
+        # match all, or field:* (exists)
+        return text,COST_TERM,None,None
+    rewrite = None
+    stripped = body.lstrip('*?')
+    if stripped != body:
+        if not stripped:
+            # "**" is "*"
+            return '*',COST_TERM,f'{body} searched as *',None
+        return text,0,None,(
+            f'"{text}": searches can\'t start with * or ?; '
+            f'type the start of the name instead, e.g. {stripped}*'
+        )
+    wildcard = WILDCARD.search(body)
+    if wildcard:
+        if wildcard.start() < settings.QUERY_MIN_WILDCARD_PREFIX:
+            return text,0,rewrite,(
+                f'"{text}": wildcard searches need at least '
+                f'{settings.QUERY_MIN_WILDCARD_PREFIX} letters before the * or ?'
+            )
+        trailing = wildcard.start() == len(body) - 1 and body.endswith('*')
+        cost = COST_WILDCARD if trailing else COST_INNER_WILDCARD
+        return modifier + body + suffix,cost,rewrite,None
+    if fuzzy:
+        # "~" alone means the default edit distance, 2
+        distance = fuzzy.group(1)
+        try:
+            distance = int(float(distance)) if distance else 2
+        except ValueError:
+            distance = 2
+        if distance > settings.QUERY_MAX_FUZZINESS:
+            rewrite = f'fuzziness of {body} capped at {settings.QUERY_MAX_FUZZINESS}'
+            distance = settings.QUERY_MAX_FUZZINESS
+        body = f'{body}~{distance}' if distance else body
+        return modifier + body + suffix,COST_TERM + distance * COST_FUZZY_EDIT,rewrite,None
+    return modifier + body + suffix,COST_TERM,rewrite,None
+
+def analyze(text):
+    """Parse, rewrite, and estimate the cost of query_string input
+
+    @param text: str
+    @returns: dict {'query', 'cost', 'clauses', 'rewrites', 'problems'}
+    """
+    parts = []
+    cost = 0
+    clauses = 0
+    rewrites = []
+    problems = []
+    for kind,token in tokens(text):
+        if kind == 'regex':
+            problems.append(
+                f'{token}: regular expressions are not supported; '
+                'use a trailing * to match the start of a word'
+            )
+        elif kind == 'range':
+            clauses += 1
+            cost += COST_RANGE
+        elif kind == 'phrase':
+            clauses += 1
+            cost += COST_TERM * max(len(token.split()), 1)
+            if '~' in token.rsplit('"', 1)[-1]:
+                # proximity (slop) search
+                cost += COST_FUZZY_EDIT
+        elif kind == 'term':
+            token,term_cost,rewrite,problem = _term(token)
+            clauses += 1
+            cost += term_cost
+            if rewrite:
+                rewrites.append(rewrite)
+            if problem:
+                problems.append(problem)
+        parts.append(token)
+    if clauses > settings.QUERY_MAX_CLAUSES:
+        problems.append(
+            f'Too many search terms ({clauses}, max {settings.QUERY_MAX_CLAUSES})'
+        )
+    return {
+        'query': ''.join(parts).strip(),
+        'cost': cost,
+        'clauses': clauses,
+        'rewrites': rewrites,
+        'problems': problems,
+    }
+
+def guard(text, request=None):
+    """Cheaper equivalent of query_string input, or an error if too expensive
+
+    @param text: str
+    @param request: Django request (for the log)
+    @returns: str
+    @raises: QueryCostError with a message for the user
+    """
+    if len(text) > settings.QUERY_MAX_LENGTH:
+        _reject(text, 'length', None, request)
+        raise QueryCostError(
+            f'Search is too long ({len(text)} characters, max {settings.QUERY_MAX_LENGTH})'
+        )
+    result = analyze(text)
+    if result['problems']:
+        _reject(text, 'syntax', result, request)
+        raise QueryCostError('; '.join(result['problems']))
+    if result['cost'] > settings.QUERY_COST_BUDGET:
+        _reject(text, 'cost', result, request)
+        raise QueryCostError(
+            'Search is too expensive; use fewer wildcard (*, ?) and fuzzy (~) terms'
+        )
+    if not result['clauses']:
+        _reject(text, 'empty', result, request)
+        raise QueryCostError('Search has no terms')
+    if result['rewrites']:
+        metrics.inc('namesdb_query_guard_total', result='rewritten', reason='')
+        logger.info(
+            f"Query rewritten cost={result['cost']} "
+            f"{text!r} -> {result['query']!r}: {', '.join(result['rewrites'])}"
+        )
+    else:
+        metrics.inc('namesdb_query_guard_total', result='ok', reason='')
+    return result['query']
+
+def _reject(text, reason, result, request):
+    metrics.inc('namesdb_query_guard_total', result='rejected', reason=reason)
+    cost = result['cost'] if result else ''
+    path = request.path if request is not None else ''
+    logger.info(f'Query rejected reason={reason} cost={cost} path={path} {text!r}')
+
+def guard_params(params, request=None):
+    """Guard params['fulltext'] in place, if present
+
+    @param params: dict or QueryDict (mutable)
+    @returns: params
+    @raises: QueryCostError
+    """
+    if params.get('fulltext'):
+        params['fulltext'] = guard(params['fulltext'], request)
+    return params
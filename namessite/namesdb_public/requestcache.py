@@ -0,0 +1,133 @@
+"""Elasticsearch shard request cache and shard copy routing
+
+Each shard keeps a request cache of the results of size-0 searches: the
+facet searches split off by facets.split, and counts (models.count_search).
+Two things keep it useful:
+
+- Size-0 searches are sent with request_cache=true (settings
+  REQUEST_CACHE_ENABLED), so they are cached even on indices where the
+  cache is not on by default.
+- Every search for the same query carries the same `preference`, so it goes
+  to the same copy (primary or replica) of each shard, the one whose cache
+  already has it.  Without it, successive pages and repeats of a search are
+  spread over copies and each warms its own cache.  With
+  settings.REQUEST_CACHE_PREFERENCE = 'session' a visitor's searches stick
+  to the same copies instead (falling back to the query).  The session key
+  is hashed: it is a credential, and preference ends up in Elasticsearch's
+  logs and slow logs.
+
+The cache's hit rate, summed over the cluster's nodes, is added to /metrics
+(see add_metrics).
+"""
+import hashlib
+import json
+import logging
+logger = logging.getLogger(__name__)
+
+from django.conf import settings
+
+# Parts of a search that decide which documents match
+FINGERPRINT_KEYS = ['query', 'post_filter']
+STATS = {
+    'hit_count': 'namesdb_es_request_cache_hits_total',
+    'miss_count': 'namesdb_es_request_cache_misses_total',
+    'evictions': 'namesdb_es_request_cache_evictions_total',
+    'memory_size_in_bytes': 'namesdb_es_request_cache_memory_bytes',
+}
+
+
+def fingerprint(s):
+    """Hash of the query and filters of a search (not page, sort, or aggregations)
+
+    @param s: elasticsearch_dsl.Search
+    @returns: str
+    """
+    body = s.to_dict()
+    text = json.dumps(
+        [s._index, {key: body.get(key) for key in FINGERPRINT_KEYS}],
+        sort_keys=True, default=str,
+    )
+    return hashlib.sha1(text.encode()).hexdigest()[:16]
+
+def preference(s, request=None):
+    """`preference` for a search, per settings.REQUEST_CACHE_PREFERENCE
+
+    @param s: elasticsearch_dsl.Search
+    @param request: Django request
+    @returns: str or None
+    """
+    mode = settings.REQUEST_CACHE_PREFERENCE
+    if not mode:
+        return None
+    if mode == 'session':
+        session = getattr(request, 'session', None)
+        key = getattr(session, 'session_key', None)
+        if key:
+            return hashlib.sha1(key.encode()).hexdigest()[:16]
+    return fingerprint(s)
+
+def route(hits, facets_search=None, request=None):
+    """Add preference and request_cache to the hits and facets searches
+
+    @param hits: elasticsearch_dsl.Search
+    @param facets_search: elasticsearch_dsl.Search or None (see facets.split)
+    @param request: Django request
+    @returns: (hits, facets_search)
+    """
+    value = preference(hits, request)
+    if value:
+        hits = hits.params(preference=value)
+    if facets_search is not None:
+        facets_search = cacheable(facets_search, request, value)
+    return hits,facets_search
+
+def cacheable(s, request=None, value=None):
+    """Add preference and request_cache to a size-0 search
+
+    @param s: elasticsearch_dsl.Search
+    @param request: Django request
+    @param value: str Preference, if already known
+    @returns: elasticsearch_dsl.Search
+    """
+    value = value or preference(s, request)
+    if value:
+        s = s.params(preference=value)
+    if settings.REQUEST_CACHE_ENABLED:
+        s = s.params(request_cache=True)
+    return s
+
+def stats(es):
+    """Shard request cache statistics summed over the cluster's nodes
+
+    @param es: Elasticsearch client
+    @returns: dict {'hit_count', 'miss_count', 'evictions', 'memory_size_in_bytes'}
+    """
+    response = es.nodes.stats(metric='indices', index_metric='request_cache')
+    totals = {key: 0 for key in STATS}
+    for node in response.get('nodes', {}).values():
+        cache = node.get('indices', {}).get('request_cache', {})
+        for key in totals:
+            totals[key] += cache.get(key, 0)
+    return totals
+
+def add_metrics(totals, es):
+    """Add the shard request cache statistics to collected metrics
+
+    Left out if Elasticsearch can't be reached.
+
+    @param totals: dict Output of metrics.collect()
+    @param es: Elasticsearch client
+    @returns: totals
+    """
+    try:
+        values = stats(es)
+    except Exception as err:
+        logger.warning(f'Could not get request cache stats: {err}')
+        return totals
+    for key,name in STATS.items():
+        kind = 'gauges' if key == 'memory_size_in_bytes' else 'counters'
+        totals[kind][(name, ())] = values[key]
+    lookups = values['hit_count'] + values['miss_count']
+    totals['gauges'][('namesdb_es_request_cache_hit_ratio', ())] = \
+        values['hit_count'] / lookups if lookups else 0
+    return totals
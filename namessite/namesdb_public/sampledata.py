@@ -0,0 +1,312 @@
+"""Synthetic Names Registry records for tests, benchmarks, and load tests
+
+Records are built from FIELDS_* with plausible values and passed through the
+models' from_dict() methods, so they look like what ingest puts into
+Elasticsearch.  The output is deterministic for a given seed.
+
+    >>> from namesdb_public import sampledata
+    >>> for index,id_,source in sampledata.generate(persons=100):
+    ...     print(index, id_)
+"""
+from datetime import date, datetime, timedelta
+import json
+import random
+
+from . import models
+
+NAAN = '88922'
+
+FAMILY_NAMES = [
+    'Abe', 'Aoki', 'Endo', 'Fujii', 'Fujita', 'Fukuda', 'Goto', 'Harada',
+    'Hasegawa', 'Hashimoto', 'Hayashi', 'Hirano', 'Ikeda', 'Inouye', 'Inoue',
+    'Ishikawa', 'Ito', 'Kato', 'Kawaguchi', 'Kimura', 'Kobayashi', 'Kojima',
+    'Kondo', 'Kubo', 'Matsuda', 'Matsumoto', 'Miura', 'Mori', 'Murakami',
+    'Nakagawa', 'Nakajima', 'Nakamura', 'Nishimura', 'Ogawa', 'Ohashi',
+    'Oohashi', 'Okada', 'Okamoto', 'Ono', 'Ota', 'Ohta', 'Oshima', 'Sakamoto',
+    'Sasaki', 'Sato', 'Satow', 'Shimizu', 'Sugiyama', 'Suzuki', 'Takahashi',
+    'Takeda', 'Takeuchi', 'Tamura', 'Tanaka', 'Ueda', 'Uyeda', 'Watanabe',
+    'Yamada', 'Yamaguchi', 'Yamamoto', 'Yamasaki', 'Yamazaki', 'Yasuda',
+    'Yoshida',
+]
+GIVEN_NAMES_ISSEI = {
+    'M': ['Hideo', 'Ichiro', 'Jiro', 'Kenji', 'Kiyoshi', 'Masao', 'Minoru',
+          'Saburo', 'Shigeru', 'Susumu', 'Takashi', 'Tadashi', 'Yoshio'],
+    'F': ['Chiyo', 'Fumiko', 'Haruko', 'Hisako', 'Kazuko', 'Kimiko', 'Masako',
+          'Michiko', 'Sachiko', 'Shizue', 'Toshiko', 'Yaeko', 'Yoshiko'],
+}
+GIVEN_NAMES_NISEI = {
+    'M': ['Frank', 'George', 'Harry', 'Henry', 'Jack', 'James', 'John',
+          'Paul', 'Robert', 'Roy', 'Thomas', 'William'],
+    'F': ['Alice', 'Betty', 'Dorothy', 'Grace', 'Helen', 'June', 'Lily',
+          'Mary', 'Margaret', 'Ruth', 'Sumi', 'Yuri'],
+}
+CITIES = [
+    ('Los Angeles', 'CA'), ('San Francisco', 'CA'), ('Sacramento', 'CA'),
+    ('Fresno', 'CA'), ('San Jose', 'CA'), ('Stockton', 'CA'),
+    ('Seattle', 'WA'), ('Tacoma', 'WA'), ('Bainbridge Island', 'WA'),
+    ('Portland', 'OR'), ('Hood River', 'OR'), ('Phoenix', 'AZ'),
+]
+FACILITIES = [
+    # facility_id, title, location_label, lat, lng, assembly center
+    ('1-topaz', 'Topaz', 'Delta, Utah', 39.4, -112.8, 'Tanforan'),
+    ('2-poston', 'Poston', 'Poston, Arizona', 34.0, -114.4, 'Salinas'),
+    ('3-gilariver', 'Gila River', 'Rivers, Arizona', 33.1, -111.8, 'Turlock'),
+    ('4-amache', 'Amache', 'Granada, Colorado', 38.0, -102.3, 'Merced'),
+    ('5-heartmountain', 'Heart Mountain', 'Cody, Wyoming', 44.7, -108.9, 'Pomona'),
+    ('6-jerome', 'Jerome', 'Jerome, Arkansas', 33.4, -91.5, 'Fresno'),
+    ('7-manzanar', 'Manzanar', 'Independence, California', 36.7, -118.1, 'Santa Anita'),
+    ('8-minidoka', 'Minidoka', 'Hunt, Idaho', 42.7, -114.2, 'Puyallup'),
+    ('9-rohwer', 'Rohwer', 'Rohwer, Arkansas', 33.8, -91.3, 'Stockton'),
+    ('10-tulelake', 'Tule Lake', 'Newell, California', 41.9, -121.4, 'Marysville'),
+]
+FAR_LINES_PER_PAGE = 30
+TIMESTAMP = datetime(2023, 6, 1, 12, 0, 0)
+
+
+def nr_id(n):
+    return f'{NAAN}/nr{n:07d}'
+
+def _json(doc):
+    """Round-trip through JSON so values look like an Elasticsearch _source
+    """
+    def default(value):
+        if isinstance(value, (date, datetime)):
+            return value.isoformat()
+        raise TypeError(value)
+    return json.loads(json.dumps(doc, default=default))
+
+def _source(record, fieldnames):
+    doc = record.to_dict()
+    doc['fulltext'] = models.assemble_fulltext(record, fieldnames)
+    return _json(doc)
+
+def _families(rng, persons):
+    """Group person numbers into families of 1-6, each at one facility
+    """
+    n = 0
+    family_no = 1
+    while n < persons:
+        size = min(rng.randint(1, 6), persons - n)
+        yield family_no, rng.choice(FACILITIES), list(range(n, n + size))
+        n += size
+        family_no += 1
+
+def generate(persons=1000, seed=0):
+    """Generate Person, FarRecord, WraRecord, FarPage, Facility, and
+    PersonLocation documents
+
+    @param persons: int Number of Persons (one FAR and WRA record each)
+    @param seed: int
+    @returns: generator of (index, id, source) tuples
+    """
+    rng = random.Random(seed)
+    for facility_id,title,label,lat,lng,_ in FACILITIES:
+        record = models.Facility.from_dict(facility_id, {
+            'facility_id': facility_id,
+            'facility_type': 'Concentration Camp',
+            'title': title,
+            'location_label': label,
+            'location_lat': lat,
+            'location_lng': lng,
+            'encyc_title': title,
+            'encyc_url': f"https://encyclopedia.densho.org/{title.replace(' ', '_')}/",
+        })
+        yield 'namesfacility', facility_id, _json(record.to_dict())
+
+    far_lines = {facility[0]: 0 for facility in FACILITIES}
+    for family_no,facility,members in _families(rng, persons):
+        facility_id,facility_title,_,lat,lng,assemblycenter = facility
+        family_name = rng.choice(FAMILY_NAMES)
+        city,state = rng.choice(CITIES)
+        people = []
+        for n in members:
+            gender = rng.choice(['M', 'F'])
+            birth_date = date(rng.randint(1865, 1942), rng.randint(1, 12), rng.randint(1, 28))
+            if birth_date.year > 1905 and rng.random() < 0.6:
+                given_name = rng.choice(GIVEN_NAMES_NISEI[gender])
+                citizenship = 'American citizen'
+            else:
+                given_name = rng.choice(GIVEN_NAMES_ISSEI[gender])
+                citizenship = 'Japanese citizen' if birth_date.year < 1905 else 'American citizen'
+            far_lines[facility_id] += 1
+            line = far_lines[facility_id]
+            people.append({
+                'n': n,
+                'nr_id': nr_id(n),
+                'gender': gender,
+                'birth_date': birth_date,
+                'given_name': given_name,
+                'preferred_name': f'{given_name} {family_name}',
+                'citizenship': citizenship,
+                'far_record_id': f'{facility_id}-{line}',
+                'far_page': (line - 1) // FAR_LINES_PER_PAGE + 1,
+                'far_line_id': str(line),
+                'wra_record_id': str(n + 1),
+            })
+        for p in people:
+            timestamp = TIMESTAMP + timedelta(minutes=p['n'])
+            person = models.Person.from_dict(p['nr_id'], {
+                'nr_id': p['nr_id'],
+                'family_name': family_name,
+                'given_name': p['given_name'],
+                'preferred_name': p['preferred_name'],
+                'birth_date': p['birth_date'],
+                'birth_place': city if p['citizenship'] == 'American citizen' else 'Japan',
+                'wra_family_no': str(family_no),
+                'wra_individual_no': str(p['n'] + 1),
+                'citizenship': p['citizenship'],
+                'gender': p['gender'],
+                'preexclusion_residence_city': city,
+                'preexclusion_residence_state': state,
+                'postexclusion_residence_city': rng.choice(CITIES)[0],
+                'postexclusion_residence_state': state,
+                'exclusion_order_title': f'Civilian Exclusion Order #{rng.randint(1, 108)}',
+                'exclusion_order_id': str(rng.randint(1, 108)),
+                'timestamp': timestamp,
+                'far_records': [{
+                    'far_record_id': p['far_record_id'],
+                    'last_name': family_name.upper(),
+                    'first_name': p['given_name'].upper(),
+                    'facility_title': facility_title,
+                }],
+                'wra_records': [{
+                    'wra_record_id': p['wra_record_id'],
+                    'lastname': family_name.upper(),
+                    'firstname': p['given_name'].upper(),
+                    'facility_title': facility_title,
+                }],
+                'family': [
+                    {
+                        'nr_id': f['nr_id'],
+                        'preferred_name': f['preferred_name'],
+                        'birth_year': f['birth_date'].year,
+                        'wra_individual_no': str(f['n'] + 1),
+                        'gender': f['gender'],
+                    }
+                    for f in people
+                ],
+            })
+            yield 'namesperson', p['nr_id'], _source(person, models.FIELDS_PERSON)
+
+            nested_person = {
+                'id': p['nr_id'], 'nr_id': p['nr_id'],
+                'name': p['preferred_name'], 'preferred_name': p['preferred_name'],
+            }
+            farrecord = models.FarRecord.from_dict(p['far_record_id'], {
+                'far_record_id': p['far_record_id'],
+                'facility': facility_id,
+                'far_page': p['far_page'],
+                'original_order': p['far_line_id'],
+                'family_number': str(family_no),
+                'far_line_id': p['far_line_id'],
+                'last_name': family_name.upper(),
+                'first_name': p['given_name'].upper(),
+                'year_of_birth': str(p['birth_date'].year),
+                'sex': p['gender'],
+                'marital_status': rng.choice(['Single', 'Married', 'Widowed']),
+                'citizenship': p['citizenship'],
+                'entry_type': 'Assembly Center',
+                'entry_type_code': '2',
+                'entry_category': 'Evacuee',
+                'entry_facility': assemblycenter,
+                'pre_evacuation_address': city,
+                'pre_evacuation_state': state,
+                'date_of_original_entry': '1942-05-01',
+                'departure_type': rng.choice(['Terminal departure', 'Indefinite leave', 'Transfer']),
+                'departure_type_code': str(rng.randint(1, 9)),
+                'departure_category': rng.choice(['Relocated', 'Transferred']),
+                'departure_date': '1945-09-01',
+                'departure_destination': rng.choice(CITIES)[0],
+                'departure_state': rng.choice(CITIES)[1],
+                'camp_address_block': str(rng.randint(1, 40)),
+                'camp_address_barracks': str(rng.randint(1, 14)),
+                'camp_address_room': rng.choice('ABCDEF'),
+                'person': nested_person,
+                'timestamp': timestamp,
+                'family': [
+                    {
+                        'far_record_id': f['far_record_id'],
+                        'last_name': family_name.upper(),
+                        'first_name': f['given_name'].upper(),
+                    }
+                    for f in people
+                ],
+            })
+            yield 'namesfarrecord', p['far_record_id'], _source(
+                farrecord, models.FIELDS_FARRECORD
+            )
+
+            wrarecord = models.WraRecord.from_dict(p['wra_record_id'], {
+                'wra_record_id': p['wra_record_id'],
+                'facility': facility_id,
+                'lastname': family_name.upper(),
+                'firstname': p['given_name'].upper(),
+                'birthyear': str(p['birth_date'].year),
+                'gender': p['gender'],
+                'originalstate': state,
+                'familyno': str(family_no),
+                'individualno': str(p['n'] + 1),
+                'assemblycenter': assemblycenter,
+                'originaladdress': city,
+                'birthcountry': 'Japan' if p['citizenship'] == 'Japanese citizen' else 'United States',
+                'maritalstatus': rng.choice(['Single', 'Married', 'Widowed']),
+                'ethnicity': 'Japanese',
+                'birthplace': city if p['citizenship'] == 'American citizen' else 'Japan',
+                'citizenshipstatus': p['citizenship'],
+                'highestgrade': str(rng.randint(1, 16)),
+                'language': rng.choice(['Japanese', 'English', 'Japanese and English']),
+                'religion': rng.choice(['Buddhist', 'Protestant', 'Catholic', 'None']),
+                'occupqual1': rng.choice(['Farmer', 'Clerk', 'Gardener', 'Student', 'Housewife']),
+                'wra_filenumber': str(100000 + p['n']),
+                'person': nested_person,
+                'timestamp': timestamp,
+                'family': [
+                    {
+                        'wra_record_id': f['wra_record_id'],
+                        'lastname': family_name.upper(),
+                        'firstname': f['given_name'].upper(),
+                    }
+                    for f in people
+                ],
+            })
+            yield 'nameswrarecord', p['wra_record_id'], _source(
+                wrarecord, models.FIELDS_WRARECORD
+            )
+
+            locations = [
+                # preexclusion address, then facility
+                {
+                    'id': f"{p['nr_id']}-1",
+                    'address': f'{city}, {state}',
+                    'lat': '', 'lng': '',
+                    'exit_date': '1942-05-01',
+                },
+                {
+                    'id': f"{p['nr_id']}-2",
+                    'address': facility_title,
+                    'lat': str(lat), 'lng': str(lng),
+                    'facility_id': facility_id,
+                    'facility_name': facility_title,
+                    'entry_date': '1942-09-01',
+                    'exit_date': '1945-09-01',
+                },
+            ]
+            for location in locations:
+                location['person_id'] = p['nr_id']
+                location['person_name'] = p['preferred_name']
+                location['location_id'] = location['id']
+                record = models.PersonLocation.from_dict(location['id'], location)
+                yield 'namespersonlocation', location['id'], _json(record.to_dict())
+
+    for facility_id,facility_title,*_ in FACILITIES:
+        pages = (far_lines[facility_id] - 1) // FAR_LINES_PER_PAGE + 1
+        facility_num = facility_id.split('-')[0]
+        for page in range(1, pages + 1):
+            far_page_id = models.FarPage.es_id(facility_id, page)
+            yield 'namesfarpage', far_page_id, {
+                'far_page_id': far_page_id,
+                'facility_id': facility_id,
+                'page': str(page),
+                'file_id': f'ddr-densho-305-{facility_num}-mezzanine-{page:010x}',
+                'file_label': f'{facility_title} page {page}',
+            }
@@ -0,0 +1,154 @@
+"""Sitemaps of all record pages, generated offline
+
+Crawlers otherwise find records by paging through search results, the most
+expensive requests the site answers.  write() streams every person, FAR
+record, WRA record, and FAR page URL from an Elasticsearch scan (see
+staticexport.targets) into gzipped sitemap files of up to
+settings.SITEMAP_SHARD_SIZE URLs each, and then writes a sitemap index:
+
+    DIR/sitemap.xml
+    DIR/sitemaps/sitemap-00001.xml.gz
+    ...
+
+`lastmod` is the record's `timestamp`.  URLs are written as they are read
+so memory use does not grow with the number of records.  Files are written
+under temporary names and renamed, and the index is replaced last, so
+crawlers never see a partial sitemap.
+
+Nginx can serve DIR at /sitemap.xml and /sitemaps/; otherwise the sitemap
+views do.  robots.txt points crawlers at the index and away from searches.
+
+    python manage.py sitemaps
+"""
+from datetime import datetime, timezone
+import gzip
+from itertools import islice
+import os
+from pathlib import Path
+import re
+from xml.sax.saxutils import escape
+
+from django.conf import settings
+from django.urls import reverse
+
+from . import staticexport
+from . import warmup
+
+# The sitemaps protocol allows 50,000 URLs per file
+MAX_SHARD_SIZE = 50000
+INDEX = 'sitemap.xml'
+SHARDS_DIR = 'sitemaps'
+SHARD_NAME = re.compile(r'^sitemap-[0-9]+\.xml\.gz$')
+XMLNS = 'http://www.sitemaps.org/schemas/sitemap/0.9'
+
+
+def site_url():
+    """Base URL for sitemap entries (settings.SITEMAP_BASE_URL or first host)
+    """
+    if settings.SITEMAP_BASE_URL:
+        return settings.SITEMAP_BASE_URL.rstrip('/')
+    return f'https://{warmup.site_host()}'
+
+def lastmod(timestamp):
+    """W3C datetime of a record timestamp (naive means UTC), or None
+    """
+    try:
+        dt = datetime.fromisoformat(str(timestamp))
+    except ValueError:
+        return None
+    if dt.tzinfo is None:
+        dt = dt.replace(tzinfo=timezone.utc)
+    return dt.astimezone(timezone.utc).strftime('%Y-%m-%dT%H:%M:%S+00:00')
+
+def _entry(tag, loc, modified):
+    text = f'<{tag}><loc>{escape(loc)}</loc>'
+    if modified:
+        text += f'<lastmod>{modified}</lastmod>'
+    return f'{text}</{tag}>\n'
+
+def write_shard(path, entries, base_url):
+    """Write a gzipped sitemap of ENTRIES to PATH
+
+    @param path: Path
+    @param entries: iterable of (url, timestamp)
+    @param base_url: str
+    @returns: (number of URLs, newest lastmod); nothing is written if 0 URLs
+    """
+    count = 0
+    newest = None
+    tmp = path.with_name(f'.{path.name}.{os.getpid()}')
+    with tmp.open('wb') as raw, gzip.GzipFile(fileobj=raw, mode='wb', mtime=0) as f:
+        f.write(
+            f'<?xml version="1.0" encoding="UTF-8"?>\n<urlset xmlns="{XMLNS}">\n'.encode()
+        )
+        for url,timestamp in entries:
+            modified = lastmod(timestamp)
+            f.write(_entry('url', f'{base_url}{url}', modified).encode())
+            count += 1
+            if modified and (newest is None or modified > newest):
+                newest = modified
+        f.write(b'</urlset>\n')
+    if count:
+        os.replace(tmp, path)
+    else:
+        tmp.unlink()
+    return count,newest
+
+def write_index(path, shards, base_url):
+    """Write the sitemap index
+
+    @param shards: list of (filename, lastmod)
+    """
+    tmp = path.with_name(f'.{path.name}.{os.getpid()}')
+    with tmp.open('w') as f:
+        f.write(
+            f'<?xml version="1.0" encoding="UTF-8"?>\n<sitemapindex xmlns="{XMLNS}">\n'
+        )
+        for name,modified in shards:
+            f.write(_entry('sitemap', f'{base_url}/{SHARDS_DIR}/{name}', modified))
+        f.write('</sitemapindex>\n')
+    os.replace(tmp, path)
+
+def write(root=None, base_url=None, shard_size=None):
+    """Write sitemaps of all record pages and the sitemap index
+
+    @param root: str Output directory (default settings.SITEMAP_DIR)
+    @param base_url: str Scheme and host (default site_url())
+    @param shard_size: int URLs per sitemap (default settings.SITEMAP_SHARD_SIZE)
+    @returns: dict {'urls', 'sitemaps', 'index'}
+    """
+    root = Path(root or settings.SITEMAP_DIR)
+    base_url = (base_url or site_url()).rstrip('/')
+    shard_size = min(shard_size or settings.SITEMAP_SHARD_SIZE, MAX_SHARD_SIZE)
+    (root / SHARDS_DIR).mkdir(parents=True, exist_ok=True)
+    entries = staticexport.targets()
+    shards = []
+    urls = 0
+    while True:
+        name = f'sitemap-{len(shards) + 1:05d}.xml.gz'
+        count,modified = write_shard(
+            root / SHARDS_DIR / name, islice(entries, shard_size), base_url
+        )
+        if not count:
+            break
+        shards.append((name, modified))
+        urls += count
+    write_index(root / INDEX, shards, base_url)
+    # shards left over from a bigger previous run
+    names = [name for name,_ in shards]
+    for path in (root / SHARDS_DIR).iterdir():
+        if SHARD_NAME.match(path.name) and path.name not in names:
+            path.unlink()
+    return {'urls': urls, 'sitemaps': len(shards), 'index': str(root / INDEX)}
+
+def robots_txt():
+    """robots.txt: the sitemap index, and no search result pages
+    """
+    return '\n'.join([
+        'User-agent: *',
+        f"Disallow: {reverse('namespub-search')}",
+        # paginated lists and searches
+        'Disallow: /*?',
+        f'Sitemap: {site_url()}/{INDEX}',
+        '',
+    ])
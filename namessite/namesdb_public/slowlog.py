@@ -0,0 +1,141 @@
+"""Slow query log
+
+Searches that take longer than settings.SLOWLOG_THRESHOLD milliseconds are
+written to an NDJSON file (settings.SLOWLOG_PATH), one JSON object per line,
+with everything needed to reproduce them:
+
+    {"id": "...", "timestamp": "...", "view": "namespub-search",
+     "path": "/search/", "params": {"fulltext": "*a*"},
+     "index": "namesperson", "limit": 25, "offset": 0,
+     "body": {...Elasticsearch DSL...}, "took": 3120, "hits": 4100}
+
+`took` is measured around the call in milliseconds and so includes network
+time.  Searches slower than settings.SLOWLOG_PROFILE_THRESHOLD are re-run
+once with the Elasticsearch profile API in a background thread and a second
+record with the same `id` and a `profile` key is written.
+
+    $ jq -c 'select(.profile == null) | [.took, .params.fulltext]' slow.ndjson
+
+All gunicorn workers append to the same file, so it is not rotated here
+(each worker would rotate it out from under the others) but by logrotate
+(conf/logrotate.conf); the handler reopens the file when it is moved.
+"""
+from datetime import datetime
+import json
+import logging
+logger = logging.getLogger(__name__)
+from logging.handlers import WatchedFileHandler
+import threading
+import uuid
+
+from django.conf import settings
+
+_handler_lock = threading.Lock()
+_handler = None
+# Only one profile run at a time so that a burst of slow queries does not
+# pile even more load onto the cluster.
+_profile_lock = threading.Lock()
+
+
+def enabled():
+    return getattr(settings, 'SLOWLOG_ENABLED', False)
+
+def _get_handler():
+    global _handler
+    with _handler_lock:
+        if _handler is None:
+            _handler = WatchedFileHandler(settings.SLOWLOG_PATH)
+            _handler.setFormatter(logging.Formatter('%(message)s'))
+        return _handler
+
+def write(record):
+    """Append one record to the slow query log
+    """
+    line = json.dumps(record, default=str)
+    # handle() takes the handler lock; the profile thread writes too
+    _get_handler().handle(
+        logging.LogRecord(__name__, logging.INFO, '', 0, line, None, None)
+    )
+
+def _caller(request):
+    """View name, path, and query params of the request that ran the search
+    """
+    if request is None:
+        return None,None,{}
+    match = getattr(request, 'resolver_match', None)
+    view = match.url_name if match else None
+    path = getattr(request, 'path', None)
+    if hasattr(request, 'query_params'):
+        params = request.query_params.dict()
+    else:
+        params = request.GET.dict()
+    # POST searches to api.Search
+    data = getattr(request, 'data', None)
+    if data and hasattr(data, 'dict'):
+        params.update(data.dict())
+    elif isinstance(data, dict):
+        params.update(data)
+    return view,path,params
+
+def log_search(search, took, hits, limit, offset, request=None):
+    """Log search if it took longer than the threshold
+
+    @param search: elasticsearch_dsl.Search
+    @param took: float Milliseconds
+    @param hits: int Total hits or None
+    @param limit: int
+    @param offset: int
+    @param request: Django/DRF request or None
+    @returns: str record id if logged or None
+    """
+    if not enabled() or took < settings.SLOWLOG_THRESHOLD:
+        return None
+    limit = int(limit); offset = int(offset)
+    search = search[offset:offset+limit]
+    view,path,params = _caller(request)
+    record = {
+        'id': uuid.uuid4().hex,
+        'timestamp': datetime.now().isoformat(),
+        'view': view,
+        'path': path,
+        'params': params,
+        'index': ','.join(search._index or []),
+        'limit': limit,
+        'offset': offset,
+        'body': search.to_dict(),
+        'took': round(took),
+        'hits': hits,
+    }
+    try:
+        write(record)
+    except OSError as err:
+        logger.error(f'Could not write slow query log: {err}')
+        return None
+    logger.warning(
+        f"Slow search {record['took']}ms view={view} index={record['index']}"
+        f" fulltext={params.get('fulltext')!r}"
+    )
+    if settings.SLOWLOG_PROFILE_THRESHOLD \
+       and took >= settings.SLOWLOG_PROFILE_THRESHOLD:
+        threading.Thread(
+            target=_profile, args=(search, record['id']), daemon=True
+        ).start()
+    return record['id']
+
+def _profile(search, record_id):
+    """Re-run search with the profile API and log the output
+    """
+    if not _profile_lock.acquire(blocking=False):
+        return
+    try:
+        response = search.extra(profile=True).execute()
+        write({
+            'id': record_id,
+            'timestamp': datetime.now().isoformat(),
+            'profile_took': response.took,
+            'profile': response.profile.to_dict(),
+        })
+    except Exception as err:
+        logger.error(f'Could not profile slow search {record_id}: {err}')
+    finally:
+        _profile_lock.release()
@@ -0,0 +1,130 @@
+"""Measure worker cold start: import times and time to first request
+
+A fresh interpreter is started with `python -X importtime`; it builds the
+WSGI application (what a gunicorn worker does at boot) and then serves one
+request through it (which loads the URLconf, views, and models).
+
+    python manage.py startup_profile --path /persons/ --budget 2.5
+"""
+import json
+import os
+import subprocess
+import sys
+import time
+
+from django.conf import settings
+
+# Run in the child process.  Prints a JSON dict of phase timings.
+# Django loads apps, middleware, and the URLconf with importlib.import_module,
+# which -X importtime does not report, so those are timed here.
+PROBE = '''
+import importlib, json, sys, time
+dynamic = []
+_import_module = importlib.import_module
+def import_module(name, package=None):
+    if name in sys.modules:
+        return _import_module(name, package)
+    start = time.perf_counter()
+    try:
+        return _import_module(name, package)
+    finally:
+        dynamic.append((name, time.perf_counter() - start))
+importlib.import_module = import_module
+t0 = time.perf_counter()
+from django.core.wsgi import get_wsgi_application
+application = get_wsgi_application()
+t1 = time.perf_counter()
+from wsgiref.util import setup_testing_defaults
+path, query, host = sys.argv[1:4]
+environ = {'PATH_INFO': path, 'QUERY_STRING': query, 'HTTP_HOST': host}
+setup_testing_defaults(environ)
+status = []
+body = application(environ, lambda s, headers, exc_info=None: status.append(s))
+b''.join(body)
+t2 = time.perf_counter()
+print(json.dumps({
+    'boot': t1 - t0, 'first_request': t2 - t1, 'status': status[0],
+    'dynamic_imports': dynamic,
+}))
+'''
+
+APP_PACKAGES = ['namesdb_public', 'namessite']
+
+
+def parse_importtime(text):
+    """Parse `python -X importtime` output
+
+    @param text: str stderr of the child process
+    @returns: list of (module, self_seconds, cumulative_seconds, depth)
+    """
+    imports = []
+    for line in text.splitlines():
+        if not line.startswith('import time:') or 'self [us]' in line:
+            continue
+        self_us,cumulative_us,name = line[len('import time:'):].split('|')
+        depth = (len(name) - len(name.lstrip()) - 1) // 2
+        imports.append(
+            (name.strip(), int(self_us) / 1e6, int(cumulative_us) / 1e6, depth)
+        )
+    return imports
+
+def default_host():
+    return next(
+        (h.lstrip('.') for h in settings.ALLOWED_HOSTS if h != '*'),
+        'localhost'
+    )
+
+def profile(path='/', query='', host=None):
+    """Start a fresh interpreter, boot the app and serve one request
+
+    @param path: str URL path of the first request
+    @param query: str Query string of the first request
+    @param host: str Host header (default: first of ALLOWED_HOSTS)
+    @returns: dict {'boot', 'first_request', 'total', 'process', 'status',
+              'imports', 'dynamic_imports'}; times in seconds
+    """
+    env = dict(os.environ)
+    env['DJANGO_SETTINGS_MODULE'] = os.environ.get(
+        'DJANGO_SETTINGS_MODULE', 'namessite.settings'
+    )
+    start = time.perf_counter()
+    proc = subprocess.run(
+        [sys.executable, '-X', 'importtime', '-c', PROBE,
+         path, query, host or default_host()],
+        cwd=settings.BASE_DIR, env=env, capture_output=True, text=True,
+    )
+    process = time.perf_counter() - start
+    if proc.returncode:
+        raise RuntimeError(proc.stderr.splitlines()[-1] if proc.stderr else 'failed')
+    result = json.loads(proc.stdout.strip().splitlines()[-1])
+    result['total'] = result['boot'] + result['first_request']
+    result['process'] = process
+    result['imports'] = parse_importtime(proc.stderr)
+    return result
+
+def package_totals(imports):
+    """Self import time summed by top-level package
+
+    @param imports: list (see parse_importtime)
+    @returns: list of (package, seconds), slowest first
+    """
+    totals = {}
+    for name,self_s,_,_ in imports:
+        package = name.split('.')[0]
+        totals[package] = totals.get(package, 0) + self_s
+    return sorted(totals.items(), key=lambda item: -item[1])
+
+def app_modules(imports):
+    """Cumulative import time of this project's own modules
+
+    @param imports: list (see parse_importtime)
+    @returns: list of (module, seconds), slowest first
+    """
+    return sorted(
+        [
+            (name, cumulative)
+            for name,_,cumulative,_ in imports
+            if name.split('.')[0] in APP_PACKAGES
+        ],
+        key=lambda item: -item[1]
+    )
@@ -0,0 +1,228 @@
+"""Static export of record pages, for nginx to serve without Django
+
+Person, FAR and WRA record pages and FAR ledger pages are historical
+documents that change only when the data is reindexed, yet crawlers make
+most of the requests for them.  build() renders them all with the same
+views the site uses into a file tree that mirrors the URLs:
+
+    ROOT/current/persons/88922/nr0000001.html
+    ROOT/current/farrecords/7-manzanar-12.html
+    ROOT/current/wrarecords/13.html
+    ROOT/current/farpages/7-manzanar/1.html
+
+Each build goes into a new directory under ROOT/builds and ROOT/current is
+then switched to it (a symlink replaced with rename), so nginx never sees a
+partial tree.  Rebuilds are incremental: pages whose record `timestamp`
+(FAR pages: the newest of their FAR records) and generation (see
+conditional.generation) are unchanged are hard-linked from the previous
+build; only new and changed records are rendered.  Deleted records are
+simply not carried over.
+
+With settings.STATIC_EXPORT_GZIP a .gz copy of each page is written for
+nginx's gzip_static.  Example nginx config:
+
+    location ~ ^/(persons|farrecords|wrarecords|farpages)/.+ {
+        root /var/www/namesdb/export/current;
+        default_type text/html;
+        gzip_static on;
+        try_files $uri.html @django;
+    }
+
+    python manage.py staticexport [--full]
+"""
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+import json
+import logging
+logger = logging.getLogger(__name__)
+import os
+from pathlib import Path
+import shutil
+import time
+
+from django.conf import settings
+from django.urls import NoReverseMatch, resolve, reverse
+
+from elastictools.docstore import elasticsearch_dsl as dsl
+
+from . import compression
+from . import conditional
+from . import models
+from . import warmup
+
+RECORD_URLS = {
+    'person': 'namespub-person',
+    'farrecord': 'namespub-farrecord',
+    'wrarecord': 'namespub-wrarecord',
+}
+MANIFEST = 'manifest.json'
+# Hits per scroll page
+SCAN_SIZE = 1000
+
+
+class ExportError(Exception):
+    pass
+
+
+def record_url(model, oid):
+    """URL path of a record page, or None if the ID can't be in a URL
+    """
+    args = oid.split('/') if model == 'person' else [oid]
+    try:
+        return reverse(RECORD_URLS[model], args=args)
+    except NoReverseMatch:
+        return None
+
+def targets():
+    """URL and version of every exported page
+
+    Scans the record indices for IDs and timestamps only.
+
+    @returns: generator of (url, version)
+    """
+    es = models.get_docstore().es
+    farpages = {}
+    for model in RECORD_URLS:
+        s = dsl.Search(
+            using=es, index=models.MODELS_DOCTYPES[model]
+        ).source(['timestamp', 'facility', 'far_page']).params(size=SCAN_SIZE)
+        for hit in s.scan():
+            timestamp = str(getattr(hit, 'timestamp', ''))
+            url = record_url(model, hit.meta.id)
+            if url:
+                yield url,timestamp
+            if model == 'farrecord' and getattr(hit, 'far_page', None):
+                page = (hit.facility, int(hit.far_page))
+                farpages[page] = max(farpages.get(page, ''), timestamp)
+    for (facility_id,far_page),timestamp in sorted(farpages.items()):
+        try:
+            yield reverse('namespub-farpage', args=[facility_id, far_page]),timestamp
+        except NoReverseMatch:
+            pass
+
+def file_path(url):
+    """Path of a page's file relative to the build directory
+    """
+    return Path(url.strip('/') + '.html')
+
+def render(url, rf):
+    """Render the page at URL with its view
+
+    @returns: bytes
+    @raises: ExportError if the view does not answer 200
+    """
+    match = resolve(url)
+    # the undecorated view: no conditional GET lookups, validators aren't exported
+    view = getattr(match.func, '__wrapped__', match.func)
+    response = view(rf.get(url), *match.args, **match.kwargs)
+    if response.status_code != 200:
+        raise ExportError(f'{url} {response.status_code}')
+    return response.content
+
+def _write(build_dir, url, content):
+    path = build_dir / file_path(url)
+    path.parent.mkdir(parents=True, exist_ok=True)
+    path.write_bytes(content)
+    if settings.STATIC_EXPORT_GZIP:
+        gz = path.with_name(path.name + '.gz')
+        gz.write_bytes(compression.compress(content, 'gzip', 9))
+
+def _link(previous_dir, build_dir, url):
+    """Hard-link an unchanged page (and its .gz) from the previous build
+
+    @returns: bool False if the previous build doesn't have it
+    """
+    src = previous_dir / file_path(url)
+    dest = build_dir / file_path(url)
+    if not src.exists():
+        return False
+    dest.parent.mkdir(parents=True, exist_ok=True)
+    os.link(src, dest)
+    gz = src.with_name(src.name + '.gz')
+    if settings.STATIC_EXPORT_GZIP and gz.exists():
+        os.link(gz, dest.with_name(dest.name + '.gz'))
+    return True
+
+def read_manifest(build_dir):
+    try:
+        with (build_dir / MANIFEST).open('r') as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {}
+
+def activate(root, build_dir):
+    """Point ROOT/current at BUILD_DIR atomically
+    """
+    tmp = root / f'current.{os.getpid()}'
+    if tmp.is_symlink():
+        tmp.unlink()
+    tmp.symlink_to(build_dir.relative_to(root))
+    os.replace(tmp, root / 'current')
+
+def prune(root, keep):
+    """Remove all but the KEEP newest builds (never the current one)
+    """
+    current = (root / 'current').resolve()
+    builds = sorted((root / 'builds').iterdir(), reverse=True)
+    for path in builds[keep:]:
+        if path.resolve() != current:
+            shutil.rmtree(path, ignore_errors=True)
+
+def build(root=None, full=False, concurrency=None):
+    """Export all record and FAR pages to a new build and activate it
+
+    @param root: str Export directory (default settings.STATIC_EXPORT_DIR)
+    @param full: bool Render every page, not just new and changed ones
+    @param concurrency: int Render threads (default settings.STATIC_EXPORT_CONCURRENCY)
+    @returns: dict {'build', 'pages', 'rendered', 'linked', 'errors', 'seconds'}
+    """
+    root = Path(root or settings.STATIC_EXPORT_DIR)
+    concurrency = concurrency or settings.STATIC_EXPORT_CONCURRENCY
+    start = time.perf_counter()
+    generation,_ = conditional.generation()
+    previous_dir = (root / 'current').resolve() if (root / 'current').exists() else None
+    previous = read_manifest(previous_dir) if previous_dir and not full else {}
+    if previous.get('generation') != generation:
+        previous = {}
+    build_dir = root / 'builds' / datetime.now().strftime('%Y%m%dT%H%M%S.%f')
+    build_dir.mkdir(parents=True)
+
+    pages = {}
+    changed = []
+    for url,version in targets():
+        if previous.get('pages', {}).get(url) == version \
+        and _link(previous_dir, build_dir, url):
+            pages[url] = version
+        else:
+            changed.append((url,version))
+    linked = len(pages)
+
+    rf = warmup.request_factory()
+    def export(target):
+        url,version = target
+        _write(build_dir, url, render(url, rf))
+        return target
+    errors = 0
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        futures = [executor.submit(export, target) for target in changed]
+        for future in futures:
+            try:
+                url,version = future.result()
+                pages[url] = version
+            except Exception as err:
+                # left to Django (nginx try_files falls through)
+                errors += 1
+                logger.warning(f'staticexport: {err}')
+
+    with (build_dir / MANIFEST).open('w') as f:
+        json.dump({'generation': generation, 'pages': pages}, f)
+    activate(root, build_dir)
+    prune(root, settings.STATIC_EXPORT_KEEP)
+    return {
+        'build': str(build_dir),
+        'pages': len(pages),
+        'rendered': len(pages) - linked,
+        'linked': linked,
+        'errors': errors,
+        'seconds': time.perf_counter() - start,
+    }
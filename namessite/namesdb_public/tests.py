@@ -1,10 +1,64 @@
+import asyncio
+import gzip
+import io
+import json
+import math
+import os
+import random
+import shutil
+from pathlib import Path
+import tempfile
+import threading
+import time
+from unittest import mock
+
 from django.conf import settings
-from django.test import TestCase
+from django.core.cache import cache, caches
+from django.core.management import call_command
+from django.http import HttpResponse
+from django.test import RequestFactory, TestCase, override_settings
 from django.urls import reverse
 import httpx
 import pytest
 
+from elastictools.docstore import elasticsearch_dsl as dsl
+
+from . import accesslog
+from . import admission
+from . import api
+from . import autocomplete
+from . import batchmatch
+from . import benchmarks
+from . import coalesce
+from . import compression
+from . import conditional
+from . import facets
+from . import fieldvalues
+from . import formchoices
+from . import loadtest
+from . import memstore
+from . import metrics
+from . import middleware
+from . import models
+from . import namekeys
+from . import querycost
+from . import requestcache
+from . import sampledata
+from . import sitemap
+from . import slowlog
+from . import startup
+from . import staticexport
+from . import views
+from . import warmup
+from . import years
+
 
+def _first_id(index):
+    es = models.get_docstore().es
+    return es.search(index=index, body={'size': 1})['hits']['hits'][0]['_id']
+
+
+@override_settings(DOCSTORE_BACKEND='memory')
 class TestView(TestCase):
 
     def test_index(self):
@@ -16,7 +70,8 @@ class TestView(TestCase):
         self.assertEqual(response.status_code, 200)
 
     def test_farrecord(self):
-        response = self.client.get(reverse('namespub-farrecord'))
+        object_id = _first_id('namesfarrecord')
+        response = self.client.get(reverse('namespub-farrecord', args=[object_id]))
         self.assertEqual(response.status_code, 200)
 
     def test_wrarecords(self):
@@ -24,15 +79,25 @@ class TestView(TestCase):
         self.assertEqual(response.status_code, 200)
 
     def test_wrarecord(self):
-        response = self.client.get(reverse('namespub-wrarecord'))
+        object_id = _first_id('nameswrarecord')
+        response = self.client.get(reverse('namespub-wrarecord', args=[object_id]))
         self.assertEqual(response.status_code, 200)
 
     def test_persons(self):
         response = self.client.get(reverse('namespub-persons'))
         self.assertEqual(response.status_code, 200)
 
-    def test_person(self):
-        response = self.client.get(reverse('namespub-person'))
+    def test_persons_search(self):
+        response = self.client.get(
+            reverse('namespub-persons'), {'fulltext': 'tanaka'}
+        )
+        self.assertEqual(response.status_code, 200)
+        self.assertContains(response, 'Tanaka')
+
+    @mock.patch('httpx.get', return_value=httpx.Response(404))
+    def test_person(self, httpx_get):
+        naan,noid = sampledata.nr_id(1).split('/')
+        response = self.client.get(reverse('namespub-person', args=[naan,noid]))
         self.assertEqual(response.status_code, 200)
 
     def test_farpages(self):
@@ -40,5 +105,1403 @@ class TestView(TestCase):
         self.assertEqual(response.status_code, 200)
 
     def test_farpage(self):
-        response = self.client.get(reverse('namespub-farpage'))
+        response = self.client.get(reverse('namespub-farpage', args=['7-manzanar', 1]))
+        self.assertEqual(response.status_code, 200)
+
+    def test_api_search_all(self):
+        url = reverse('namespub-api-search-all')
+        with mock.patch.object(
+                memstore.Elasticsearch, 'msearch', autospec=True,
+                side_effect=memstore.Elasticsearch.msearch
+        ) as msearch:
+            response = self.client.get(url, {'fulltext': 'tanaka', 'limit': 2})
+            self.assertEqual(msearch.call_count, 1)
+        self.assertEqual(response.status_code, 200)
+        data = response.json()
+        persons = self.client.get(reverse('namespub-api-search'), {'fulltext': 'tanaka'})
+        self.assertEqual(data['models']['person']['total'], persons.json()['total'])
+        self.assertEqual(len(data['models']['farrecord']['objects']), 2)
+        self.assertEqual(data['models']['farrecord']['objects'][0]['model'], 'farrecord')
+        self.assertIn('fulltext=tanaka', data['models']['wrarecord']['more'])
+        self.assertEqual(
+            data['total'], sum(m['total'] for m in data['models'].values())
+        )
+        self.assertEqual(self.client.get(url, {'limit': 2}).status_code, 400)
+
+    def test_api_persons_paging(self):
+        url = reverse('namespub-api-persons')
+        first = self.client.get(url, {'limit': 2, 'offset': 0}).json()['objects']
+        second = self.client.get(url, {'limit': 2, 'offset': 2}).json()['objects']
+        self.assertEqual(len(first), 2)
+        self.assertEqual(len(second), 2)
+        self.assertFalse(
+            {o['id'] for o in first} & {o['id'] for o in second}
+        )
+        response = self.client.get(url, {'limit': 100000})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json()['limit'], api.MAX_LIMIT)
+        response = self.client.get(url, {'offset': 20000})
+        self.assertEqual(response.status_code, 400)
+        self.assertIn('10000', response.json()['detail'])
+
+
+
+@override_settings(
+    DOCSTORE_BACKEND='memory', ROOT_URLCONF='namesdb_public.urls_async'
+)
+class TestAsyncView(TestCase):
+
+    def setUp(self):
+        # responses cached by other tests (see compression)
+        cache.clear()
+
+    def test_persons_search(self):
+        response = self.client.get(
+            reverse('namespub-persons'), {'fulltext': 'tanaka'}
+        )
+        self.assertEqual(response.status_code, 200)
+        self.assertContains(response, 'Tanaka')
+
+    @mock.patch('httpx.AsyncClient.get', return_value=httpx.Response(404))
+    def test_person(self, httpx_get):
+        naan,noid = sampledata.nr_id(1).split('/')
+        response = self.client.get(reverse('namespub-person', args=[naan,noid]))
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(httpx_get.called)
+
+    def test_farpage(self):
+        response = self.client.get(reverse('namespub-farpage', args=['7-manzanar', 1]))
+        self.assertEqual(response.status_code, 200)
+
+    def test_api_persons(self):
+        response = self.client.get(
+            reverse('namespub-api-persons'), {'limit': 5}, format='json'
+        )
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(
+            response.json(),
+            json.loads(json.dumps(
+                api.model_objects(response.wsgi_request, 'person', limit=5)
+            ))
+        )
+        response = self.client.get(
+            reverse('namespub-api-persons'), {'offset': 9990, 'limit': 50}
+        )
+        self.assertEqual(response.status_code, 400)
+
+    def test_api_search(self):
+        url = reverse('namespub-api-search')
+        response = self.client.post(url, {'fulltext': 'tanaka'})
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response.json()['total'])
+        self.assertEqual(self.client.put(url).status_code, 405)
+
+    def test_api_search_all(self):
+        url = reverse('namespub-api-search-all')
+        response = self.client.get(url, {'fulltext': 'tanaka', 'limit': 2})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(list(response.json()['models']), models.SEARCH_MODELS)
+        self.assertEqual(self.client.get(url).status_code, 400)
+
+
+class TestAdmission(TestCase):
+
+    def test_gate(self):
+        gate = admission.Gate('test', 1, queue=1)
+        token = gate.acquire(timeout=0.1)
+        with self.assertRaises(admission.Overloaded) as cm:
+            gate.acquire(timeout=0.02)
+        self.assertEqual(cm.exception.reason, 'timeout')
+        gate.waiting = 1
+        with self.assertRaises(admission.Overloaded) as cm:
+            gate.acquire(timeout=0.02)
+        self.assertEqual(cm.exception.reason, 'queue')
+        gate.waiting = 0
+        gate.release(token)
+        gate.release(gate.acquire(timeout=0.1))
+
+    def test_host_gate(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            # two processes' gates share the host slots
+            gate1 = admission.Gate('test', 2, host_limit=1, lock_dir=tmp)
+            gate2 = admission.Gate('test', 2, host_limit=1, lock_dir=tmp)
+            token = gate1.try_acquire()
+            self.assertIsNotNone(token)
+            self.assertIsNone(gate2.try_acquire())
+            gate1.release(token)
+            gate2.release(gate2.try_acquire())
+
+    def test_ratelimiter(self):
+        limiter = admission.RateLimiter(rate=1, burst=2)
+        self.assertEqual(limiter.allow('a', now=0), (True, 0))
+        self.assertEqual(limiter.allow('a', now=0), (True, 0))
+        self.assertEqual(limiter.allow('a', now=0), (False, 1.0))
+        self.assertEqual(limiter.allow('b', now=0), (True, 0))
+        self.assertEqual(limiter.allow('a', now=1), (True, 0))
+
+    @override_settings(RATELIMIT_FORWARDED_FOR=True, RATELIMIT_TRUSTED_PROXIES=1)
+    def test_client_key_forwarded_for(self):
+        rf = RequestFactory()
+        key,_ = admission.client_key(rf.get('/', HTTP_X_FORWARDED_FOR='5.6.7.8'))
+        self.assertEqual(key, 'ip:5.6.7.8')
+        # a client's own X-Forwarded-For entries don't change its key
+        spoofed,_ = admission.client_key(
+            rf.get('/', HTTP_X_FORWARDED_FOR='10.9.8.7, 5.6.7.8')
+        )
+        self.assertEqual(spoofed, key)
+        with override_settings(RATELIMIT_TRUSTED_PROXIES=2):
+            key,_ = admission.client_key(
+                rf.get('/', HTTP_X_FORWARDED_FOR='1.1.1.1, 5.6.7.8, 10.0.0.2')
+            )
+            self.assertEqual(key, 'ip:5.6.7.8')
+
+    @override_settings(RATELIMIT_ENABLED=True, RATELIMIT_RATE=0.01, RATELIMIT_BURST=1)
+    def test_ratelimit_response(self):
+        self.assertEqual(self.client.get(reverse('namespub-index')).status_code, 200)
+        response = self.client.get(reverse('namespub-index'))
+        self.assertEqual(response.status_code, 429)
+        self.assertEqual(response['Retry-After'], '100')
+
+    @override_settings(
+        DOCSTORE_BACKEND='memory', ADMISSION_ENABLED=True, ADMISSION_TIMEOUT=0.02
+    )
+    @mock.patch.object(admission.Gate, 'try_acquire', return_value=None)
+    def test_overloaded_response(self, try_acquire):
+        response = self.client.get(reverse('namespub-persons'), {'fulltext': 'tanaka'})
+        self.assertEqual(response.status_code, 503)
+        self.assertEqual(response['Retry-After'], str(settings.ADMISSION_RETRY_AFTER))
+
+
+@override_settings(COALESCE_ENABLED=True, COALESCE_SHARED_CACHE='')
+class TestCoalesce(TestCase):
+
+    def test_call(self):
+        calls = []
+        def fn():
+            calls.append(1)
+            time.sleep(0.1)
+            return {'hits': [1, 2]}
+        results = []
+        threads = [
+            threading.Thread(
+                target=lambda: results.append(coalesce.call(('search', 'q'), fn))
+            )
+            for _ in range(5)
+        ]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(len(calls), 1)
+        self.assertEqual(results, [{'hits': [1, 2]}] * 5)
+        # each caller gets its own copy
+        self.assertEqual(len({id(result) for result in results}), 5)
+        # nothing is kept once the call is done
+        coalesce.call(('search', 'q'), fn)
+        self.assertEqual(len(calls), 2)
+
+    def test_call_error(self):
+        def fn():
+            time.sleep(0.05)
+            raise memstore.NotFoundError(404, 'not_found', {})
+        errors = []
+        def caller():
+            try:
+                coalesce.call(('get', 'x'), fn)
+            except memstore.NotFoundError as err:
+                errors.append(err)
+        threads = [threading.Thread(target=caller) for _ in range(3)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(len(errors), 3)
+
+    def test_acall(self):
+        calls = []
+        async def fn():
+            calls.append(1)
+            await asyncio.sleep(0.05)
+            return {'hits': [1]}
+        async def run():
+            return await asyncio.gather(*[
+                coalesce.acall(('search', 'q'), fn) for _ in range(5)
+            ])
+        self.assertEqual(asyncio.run(run()), [{'hits': [1]}] * 5)
+        self.assertEqual(len(calls), 1)
+
+    def test_acall_leader_cancelled(self):
+        calls = []
+        async def fn():
+            calls.append(1)
+            await asyncio.sleep(0.05)
+            return {'hits': [1]}
+        async def run():
+            leader = asyncio.create_task(coalesce.acall(('search', 'q'), fn))
+            await asyncio.sleep(0)
+            waiters = [
+                asyncio.create_task(coalesce.acall(('search', 'q'), fn))
+                for _ in range(3)
+            ]
+            await asyncio.sleep(0.01)
+            leader.cancel()
+            return await asyncio.gather(*waiters)
+        # one waiter takes over the call, the others wait for it
+        self.assertEqual(asyncio.run(run()), [{'hits': [1]}] * 3)
+        self.assertEqual(len(calls), 2)
+
+    @override_settings(COALESCE_SHARED_CACHE='default', COALESCE_WAIT=0.1)
+    def test_shared(self):
+        k = coalesce.key(('search', 'shared'))
+        fn = mock.Mock(return_value='mine')
+        # another worker holds the lock and publishes its result
+        cache.add(f'coalesce:{k}:lock', 1)
+        cache.set(f'coalesce:{k}:result', 'theirs')
+        self.assertEqual(coalesce.call(('search', 'shared'), fn), 'theirs')
+        self.assertFalse(fn.called)
+        # other worker's call failed: lock gone, no result
+        cache.delete(f'coalesce:{k}:lock')
+        cache.delete(f'coalesce:{k}:result')
+        self.assertEqual(coalesce.call(('search', 'shared'), fn), 'mine')
+        self.assertIsNone(cache.get(f'coalesce:{k}:lock'))
+
+
+@override_settings(DOCSTORE_BACKEND='memory', CONDITIONAL_ENABLED=True)
+class TestConditional(TestCase):
+
+    def setUp(self):
+        conditional.CACHE.clear()
+        naan,noid = sampledata.nr_id(1).split('/')
+        self.person_url = reverse('namespub-api-person', args=[naan,noid])
+
+    def test_record(self):
+        response = self.client.get(self.person_url)
+        self.assertEqual(response.status_code, 200)
+        self.assertIn('public', response['Cache-Control'])
+        self.assertIn('s-maxage', response['Cache-Control'])
+        self.assertIn('Accept', response['Vary'])
+        etag = response['ETag']
+        with mock.patch.object(models, 'docstore_fields') as lookup, \
+             mock.patch.object(models.Person, 'get') as get:
+            response = self.client.get(self.person_url, HTTP_IF_NONE_MATCH=etag)
+            self.assertEqual(response.status_code, 304)
+            self.assertEqual(response['ETag'], etag)
+            # validators were cached and the record was not fetched
+            self.assertFalse(lookup.called)
+            self.assertFalse(get.called)
+        response = self.client.get(
+            self.person_url, HTTP_IF_MODIFIED_SINCE=response['Last-Modified']
+        )
+        self.assertEqual(response.status_code, 304)
+
+    def test_generation(self):
+        response = self.client.get(self.person_url)
+        with override_settings(CONDITIONAL_GENERATION='2030-01-01T00:00:00'):
+            conditional.CACHE.clear()
+            again = self.client.get(self.person_url, HTTP_IF_NONE_MATCH=response['ETag'])
+            self.assertEqual(again.status_code, 200)
+            self.assertEqual(again['Last-Modified'], 'Tue, 01 Jan 2030 00:00:00 GMT')
+
+    def test_not_found(self):
+        # the view is called as usual and handles it
+        self.assertIsNone(conditional.record_validators('wrarecord', 'nope'))
+
+    @mock.patch.object(models, 'docstore_fields')
+    def test_farpage(self, lookup):
+        url = reverse('namespub-farpage', args=['7-manzanar', 1])
+        response = self.client.get(url)
+        self.assertEqual(response.status_code, 200)
+        self.assertIn(f'max-age={settings.CONDITIONAL_FARPAGE_MAX_AGE}', response['Cache-Control'])
+        response = self.client.get(url, HTTP_IF_NONE_MATCH=response['ETag'])
+        self.assertEqual(response.status_code, 304)
+        self.assertFalse(lookup.called)
+
+    @override_settings(ROOT_URLCONF='namesdb_public.urls_async')
+    @mock.patch('httpx.AsyncClient.get', return_value=httpx.Response(404))
+    def test_async(self, httpx_get):
+        naan,noid = sampledata.nr_id(1).split('/')
+        url = reverse('namespub-person', args=[naan,noid])
+        response = self.client.get(url)
+        self.assertEqual(response.status_code, 200)
+        response = self.client.get(url, HTTP_IF_NONE_MATCH=response['ETag'])
+        self.assertEqual(response.status_code, 304)
+
+class TestCompression(TestCase):
+
+    def setUp(self):
+        cache.clear()
+        conditional.CACHE.clear()
+
+    def test_negotiate(self):
+        self.assertEqual(compression.negotiate('gzip, deflate'), 'gzip')
+        self.assertEqual(compression.negotiate('deflate, gzip;q=0'), None)
+        self.assertEqual(compression.negotiate('identity'), None)
+        self.assertEqual(compression.negotiate(''), None)
+        self.assertIn(compression.negotiate('*'), compression.available())
+
+    def test_stream(self):
+        chunks = [f'{n},Tanaka,Taro\n'.encode() * 50 for n in range(10)]
+        compressed = list(compression.compress_stream(iter(chunks), 'gzip'))
+        self.assertGreater(len(compressed), len(chunks))
+        self.assertEqual(gzip.decompress(b''.join(compressed)), b''.join(chunks))
+
+    def test_search(self):
+        url = reverse('namespub-persons') + '?fulltext=tanaka'
+        plain = self.client.get(url)
+        response = self.client.get(url, HTTP_ACCEPT_ENCODING='gzip, deflate')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response['Content-Encoding'], 'gzip')
+        self.assertIn('Accept-Encoding', response['Vary'])
+        self.assertLess(len(response.content), len(plain.content))
+        self.assertEqual(gzip.decompress(response.content), plain.content)
+
+    def test_cached(self):
+        naan,noid = sampledata.nr_id(1).split('/')
+        url = reverse('namespub-api-person', args=[naan,noid])
+        first = self.client.get(url, HTTP_ACCEPT_ENCODING='gzip')
+        self.assertEqual(first['Content-Encoding'], 'gzip')
+        with mock.patch.object(models, 'docstore_fields') as lookup, \
+             mock.patch.object(models.Person, 'get') as get:
+            response = self.client.get(url, HTTP_ACCEPT_ENCODING='gzip')
+            self.assertEqual(response.status_code, 200)
+            self.assertEqual(response.content, first.content)
+            self.assertEqual(response['ETag'], first['ETag'])
+            response = self.client.get(
+                url, HTTP_ACCEPT_ENCODING='gzip', HTTP_IF_NONE_MATCH=first['ETag']
+            )
+            self.assertEqual(response.status_code, 304)
+            self.assertFalse(lookup.called)
+            self.assertFalse(get.called)
+        # uncompressed copies are cached separately
+        response = self.client.get(url)
+        self.assertFalse(response.has_header('Content-Encoding'))
+        self.assertEqual(json.loads(response.content)['id'], f'{naan}/{noid}')
+
+    @override_settings(DOCSTORE_BACKEND='memory', ROOT_URLCONF='namesdb_public.urls_async')
+    async def test_async_off_loop(self):
+        on_loop = []
+        def spy(fn):
+            def wrapper(*args):
+                try:
+                    asyncio.get_running_loop()
+                    on_loop.append(fn.__name__)
+                except RuntimeError:
+                    pass
+                return fn(*args)
+            return wrapper
+        url = reverse('namespub-persons') + '?fulltext=tanaka'
+        with mock.patch.object(compression, 'cached_response', spy(compression.cached_response)), \
+             mock.patch.object(compression, 'store', spy(compression.store)), \
+             mock.patch.object(compression, 'compress_response', spy(compression.compress_response)):
+            # Django 4.1's AsyncClient sends extra kwargs as header names
+            response = await self.async_client.get(
+                url, **{'accept-encoding': 'gzip'}
+            )
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response['Content-Encoding'], 'gzip')
+        self.assertEqual(on_loop, [])
+
+    @pytest.mark.skipif(not compression.brotli(), reason='Brotli not installed')
+    def test_brotli(self):
+        url = reverse('namespub-persons') + '?fulltext=tanaka'
+        response = self.client.get(url, HTTP_ACCEPT_ENCODING='gzip, br')
+        self.assertEqual(response['Content-Encoding'], 'br')
+        self.assertIn(b'<html', compression.brotli().decompress(response.content))
+
+class TestAutocomplete(TestCase):
+
+    def setUp(self):
+        caches['autocomplete'].clear()
+
+    def test_suggest(self):
+        names = autocomplete.suggest('ta')
+        self.assertTrue(names)
+        self.assertTrue(all(name.lower().startswith('ta') for name in names))
+        self.assertEqual(autocomplete.suggest('t'), [])
+        farnames = autocomplete.suggest('ta', 'farrecord', facility='7-manzanar', limit=3)
+        self.assertLessEqual(len(farnames), 3)
+        self.assertTrue(all(name.isupper() for name in farnames))
+        self.assertEqual(autocomplete.suggest('ta', facility='nowhere'), [])
+        self.assertEqual(len(autocomplete.suggest('ta', limit=-5)), 1)
+        with mock.patch.object(
+            memstore.Elasticsearch, 'search', autospec=True,
+            side_effect=memstore.Elasticsearch.search,
+        ) as search:
+            autocomplete.suggest('tak')
+        completion = search.call_args[1]['body']['suggest']['names']['completion']
+        self.assertEqual(completion['contexts'], {'facility': [models.SUGGEST_ANY_FACILITY]})
+        # cached
+        with mock.patch.object(models, 'get_docstore') as get_docstore:
+            self.assertEqual(autocomplete.suggest(' TA '), names)
+            self.assertFalse(get_docstore.called)
+
+    def test_api(self):
+        url = reverse('namespub-api-autocomplete')
+        response = self.client.get(url, {'q': 'tak', 'model': 'wrarecord'})
         self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json()['q'], 'tak')
+        self.assertIn('TAKEDA', response.json()['suggestions'])
+        self.assertIn('max-age', response['Cache-Control'])
+        response = self.client.get(url, {'q': 'tak', 'model': 'farpage'})
+        self.assertEqual(response.status_code, 400)
+        response = self.client.get(url, {'q': 'tak', 'limit': 'x'})
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(response.json()['detail'], 'limit must be an integer')
+
+class TestMemstore(TestCase):
+
+    def setUp(self):
+        self.es = memstore.Elasticsearch()
+        self.es.load([
+            ('namesperson', '1', {'family_name': 'Tanaka', 'given_name': 'George',
+                                  'birth_year': '1920', 'gender': 'M',
+                                  'fulltext': 'tanaka george'}),
+            ('namesperson', '2', {'family_name': 'Tanaka', 'given_name': 'Mary',
+                                  'birth_year': '1922', 'gender': 'F',
+                                  'fulltext': 'tanaka mary'}),
+            ('namesperson', '3', {'family_name': 'Yamada', 'given_name': 'Mary',
+                                  'birth_year': '1901', 'gender': 'F',
+                                  'fulltext': 'yamada mary'}),
+        ])
+
+    def ids(self, s):
+        return sorted(hit.meta.id for hit in s.using(self.es).execute())
+
+    def test_get(self):
+        self.assertEqual(
+            self.es.get(index='namesperson', id='3')['_source']['family_name'],
+            'Yamada'
+        )
+        with self.assertRaises(memstore.NotFoundError):
+            self.es.get(index='namesperson', id='4')
+
+    def test_query_string(self):
+        s = dsl.Search(index='namesperson')
+        def qs(text):
+            return self.ids(s.query('query_string', query=text, fields=['fulltext']))
+        self.assertEqual(qs('tanaka'), ['1', '2'])
+        self.assertEqual(qs('tanaka AND NOT george'), ['2'])
+        self.assertEqual(qs('george yamada'), ['1', '3'])
+        self.assertEqual(qs('*ada'), ['3'])
+        self.assertEqual(qs('given_name:mary -tanaka'), ['3'])
+
+    def test_filters_sort_aggs(self):
+        s = dsl.Search(index='namesperson').filter('term', gender='F')
+        s = s.filter('range', birth_year={'gte': 1910}).sort('-birth_year')
+        s.aggs.bucket('family_name', 'terms', field='family_name')
+        response = s.using(self.es).execute()
+        self.assertEqual([hit.meta.id for hit in response], ['2'])
+        self.assertEqual(
+            response.aggregations.family_name.buckets[0].to_dict(),
+            {'key': 'Tanaka', 'doc_count': 1}
+        )
+
+    def test_scan(self):
+        s = dsl.Search(using=self.es, index='namesperson').params(size=1)
+        self.assertEqual(sorted(hit.meta.id for hit in s.scan()), ['1', '2', '3'])
+
+class TestBenchmarks(TestCase):
+
+    def test_run(self):
+        results = benchmarks.run(['join_highlight_text'], repeat=1)
+        self.assertGreater(results['join_highlight_text']['ops'], 0)
+        with self.assertRaises(KeyError):
+            benchmarks.run(['nonexistent'])
+
+    def test_compare(self):
+        baseline = {'results': {
+            'a': {'ops': 1000.0, 'peak_bytes': 100000},
+            'b': {'ops': 1000.0, 'peak_bytes': 100000},
+        }}
+        results = {
+            'a': {'ops': 900.0, 'peak_bytes': 110000},
+            'b': {'ops': 500.0, 'peak_bytes': 200000},
+            'c': {'ops': 1.0, 'peak_bytes': 1},
+        }
+        self.assertEqual(
+            [(name,metric) for name,metric,_,_ in benchmarks.compare(results, baseline)],
+            [('b', 'ops'), ('b', 'peak_bytes')]
+        )
+
+
+class TestFormChoices(TestCase):
+
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.snapshot = os.path.join(self.tmp.name, 'choices.json')
+
+    def tearDown(self):
+        self.tmp.cleanup()
+
+    def test_load_and_snapshot(self):
+        with override_settings(
+                DOCSTORE_BACKEND='memory', FORMS_CHOICES_SNAPSHOT=self.snapshot
+        ):
+            registry = formchoices.Registry()
+            self.assertIn(
+                ('7-manzanar', 'Manzanar'),
+                registry.choices()['facility_id-choices']
+            )
+            self.assertTrue(os.path.exists(self.snapshot))
+
+            # Elasticsearch down: new worker starts from the snapshot
+            def broken():
+                raise ConnectionError('down')
+            registry = formchoices.Registry(loaders={'facility_id': broken})
+            self.assertEqual(registry.labels()['facility_id']['1-topaz'], 'Topaz')
+
+    def test_unavailable(self):
+        calls = []
+        def broken():
+            calls.append(1)
+            raise ConnectionError('down')
+        with override_settings(FORMS_CHOICES_SNAPSHOT=self.snapshot):
+            registry = formchoices.Registry(loaders={'facility_id': broken})
+            self.assertEqual(registry.choices(), {})
+            self.assertEqual(registry.labels(), {})
+            # not retried until FORMS_CHOICES_RETRY has passed
+            self.assertEqual(len(calls), 1)
+
+    def test_stale_refreshed_in_background(self):
+        values = [[('1-topaz', 'Topaz')], [('1-topaz', 'Topaz'), ('2-poston', 'Poston')]]
+        with override_settings(
+                FORMS_CHOICES_SNAPSHOT=self.snapshot,
+                FORMS_CHOICES_TTL=0, FORMS_CHOICES_RETRY=0,
+        ):
+            registry = formchoices.Registry(loaders={'facility_id': lambda: values.pop(0)})
+            self.assertEqual(len(registry.choices()['facility_id-choices']), 1)
+            for _ in range(100):
+                if len(registry.label_map['facility_id']) == 2:
+                    break
+                time.sleep(0.01)
+            self.assertEqual(registry.labels()['facility_id']['2-poston'], 'Poston')
+
+
+class TestLoadtest(TestCase):
+
+    def test_access_log_workload(self):
+        lines = [
+            '1.2.3.4 - - [01/Jun/2023:12:00:00 -0700] "GET /persons/88922/nr0000001/ HTTP/1.1" 200 5120 "-" "Mozilla/5.0"',
+            '1.2.3.4 - - [01/Jun/2023:12:00:01 -0700] "GET /persons/?fulltext=tanaka&gender=F HTTP/1.1" 200 9000 "-" "Mozilla/5.0"',
+            '1.2.3.4 - - [01/Jun/2023:12:00:02 -0700] "GET /farpages/7-manzanar/3 HTTP/1.1" 200 9000',
+            '1.2.3.4 - - [01/Jun/2023:12:00:03 -0700] "GET /persons/88922/nr0000002/ HTTP/1.1" 500 10 "-" "-"',
+            'garbage',
+        ]
+        with tempfile.TemporaryDirectory() as tmp:
+            path = os.path.join(tmp, 'access.log')
+            with open(path, 'w') as f:
+                f.write('\n'.join(lines))
+            self.assertEqual(len(list(accesslog.entries(path))), 3)
+            workload = loadtest.Workload.from_access_log(path)
+        self.assertEqual(workload.nr_ids, ['88922/nr0000001'])
+        self.assertEqual(workload.terms, ['tanaka'])
+        self.assertEqual(workload.farpages, [('7-manzanar', 3)])
+        self.assertEqual(workload.facets, [('gender', 'F')])
+
+    def test_farpage_walk(self):
+        workload = loadtest.Workload(farpages=[('1-topaz', 1), ('1-topaz', 3)])
+        rng = random.Random(0)
+        for _ in range(20):
+            for endpoint,path in loadtest.scenario_farpage(workload, rng):
+                page = int(path.rstrip('/').split('/')[-1])
+                self.assertTrue(1 <= page <= 3)
+
+    def test_stats(self):
+        stats = loadtest.Stats()
+        for n in range(100):
+            stats.record('person', 200 if n else 500, (n + 1) / 1000)
+        report = stats.report(elapsed=10)
+        self.assertEqual(report['person']['requests'], 100)
+        self.assertEqual(report['person']['errors'], 1)
+        self.assertEqual(report['person']['rps'], 10)
+        self.assertAlmostEqual(report['person']['p50'], 50)
+        self.assertAlmostEqual(report['person']['p99'], 99)
+        self.assertEqual(report['total']['requests'], 100)
+
+
+class TestStartup(TestCase):
+
+    def test_parse_importtime(self):
+        text = '\n'.join([
+            'import time: self [us] | cumulative | imported package',
+            'import time:       100 |        100 |     httpx._types',
+            'import time:       250 |        350 |   httpx',
+            'import time:      1000 |       1350 | namesdb_public.api',
+            'unrelated stderr',
+        ])
+        imports = startup.parse_importtime(text)
+        self.assertEqual(imports[1], ('httpx', 0.00025, 0.00035, 1))
+        self.assertEqual(imports[2][3], 0)
+        self.assertEqual(
+            startup.package_totals(imports),
+            [('namesdb_public', 0.001), ('httpx', 0.00035)]
+        )
+        self.assertEqual(
+            startup.app_modules(imports), [('namesdb_public.api', 0.00135)]
+        )
+
+    def test_lazy_schema_view(self):
+        response = self.client.get(reverse('schema-json'))
+        self.assertEqual(response.status_code, 200)
+        self.assertContains(response, 'paths')
+
+
+@override_settings(DOCSTORE_BACKEND='memory')
+class TestWarmup(TestCase):
+
+    def test_plan(self):
+        counts = warmup.from_paths([
+            '/persons/88922/nr0000001',
+            '/api/1.0/persons/88922/nr0000001',
+            '/persons/88922/nr0000002',
+            '/farrecords/1-topaz-1',
+            '/persons/?fulltext=tanaka&page=2',
+            '/persons/?fulltext=tanaka',
+            '/persons/',
+            '/nonexistent/',
+        ])
+        self.assertEqual(counts[('record', 'person', '88922/nr0000001')], 2)
+        self.assertEqual(counts[('search', 'person', 'fulltext=tanaka')], 2)
+        self.assertEqual(len(counts), 4)
+        self.assertEqual(
+            warmup.plan(counts, top=1),
+            [
+                ('record', 'person', '88922/nr0000001'),
+                ('search', 'person', 'fulltext=tanaka'),
+                ('record', 'farrecord', '1-topaz-1'),
+            ]
+        )
+
+    def test_run(self):
+        targets = [
+            ('record', 'person', sampledata.nr_id(1)),
+            ('record', 'person', '88922/nonexistent'),
+            ('search', 'person', 'fulltext=tanaka'),
+        ]
+        result = warmup.run(targets, concurrency=2, timeout=30)
+        self.assertEqual(result['ok'], 2)
+        self.assertEqual(result['errors'], 1)
+
+    @override_settings(WARMUP_ENABLED=True, WARMUP_TIMEOUT=60)
+    def test_gunicorn_hooks(self):
+        server = mock.Mock()
+        server.cfg.timeout = 0.2
+        worker = mock.Mock(pid=1)
+        targets = [('record', 'person', sampledata.nr_id(1))]
+        self.addCleanup(setattr, warmup, '_targets', None)
+        with mock.patch.object(
+                warmup, 'configured_targets', return_value=targets
+        ) as configured:
+            warmup.when_ready(server)
+            with mock.patch.object(
+                    warmup, 'run', side_effect=lambda *a, **kw: time.sleep(1)
+            ) as run:
+                start = time.perf_counter()
+                warmup.post_fork(server, worker)
+                # half the gunicorn timeout, not WARMUP_TIMEOUT
+                self.assertLess(time.perf_counter() - start, 0.5)
+        # access logs read once, in the arbiter
+        self.assertEqual(configured.call_count, 1)
+        self.assertEqual(run.call_args[0][0], targets)
+        self.assertIn('gave up', server.log.warning.call_args[0][0])
+
+
+@mock.patch('httpx.get', return_value=httpx.Response(404))
+class TestStaticExport(TestCase):
+
+    def setUp(self):
+        self.root = Path(tempfile.mkdtemp())
+        naan,noid = sampledata.nr_id(1).split('/')
+        self.person = reverse('namespub-person', args=[naan,noid])
+        self.farpage = reverse('namespub-farpage', args=['7-manzanar', 1])
+
+    def tearDown(self):
+        shutil.rmtree(self.root, ignore_errors=True)
+
+    def test_targets(self, httpx_get):
+        targets = dict(staticexport.targets())
+        self.assertIn(self.person, targets)
+        self.assertIn(self.farpage, targets)
+        self.assertIn(reverse('namespub-wrarecord', args=['1']), targets)
+
+    def test_build(self, httpx_get):
+        targets = [(self.person, 't1'), (self.farpage, 't1'), ('/persons/88922/nope', 't1')]
+        with mock.patch.object(staticexport, 'targets', return_value=targets):
+            result = staticexport.build(self.root)
+        self.assertEqual((result['rendered'], result['errors']), (2, 1))
+        current = self.root / 'current'
+        page = current / staticexport.file_path(self.person)
+        self.assertIn(b'<html', page.read_bytes())
+        self.assertEqual(
+            gzip.decompress(page.with_suffix('.html.gz').read_bytes()), page.read_bytes()
+        )
+        # unchanged pages are linked, changed ones rendered, removed ones dropped
+        targets = [(self.person, 't2'), (self.farpage, 't1')]
+        with mock.patch.object(staticexport, 'targets', return_value=targets):
+            result = staticexport.build(self.root)
+        self.assertEqual((result['rendered'], result['linked']), (1, 1))
+        self.assertEqual(len(list((self.root / 'builds').iterdir())), 2)
+        with mock.patch.object(staticexport, 'targets', return_value=targets[1:]):
+            staticexport.build(self.root)
+        self.assertFalse((current / staticexport.file_path(self.person)).exists())
+        self.assertTrue((current / staticexport.file_path(self.farpage)).exists())
+        self.assertEqual(len(list((self.root / 'builds').iterdir())), settings.STATIC_EXPORT_KEEP)
+
+
+class TestSitemap(TestCase):
+
+    def setUp(self):
+        self.root = Path(tempfile.mkdtemp())
+
+    def tearDown(self):
+        shutil.rmtree(self.root, ignore_errors=True)
+
+    def test_write(self):
+        (self.root / 'sitemaps').mkdir()
+        (self.root / 'sitemaps' / 'sitemap-99999.xml.gz').write_bytes(b'stale')
+        result = sitemap.write(self.root, 'https://example.org', shard_size=1000)
+        self.assertEqual(result['sitemaps'], math.ceil(result['urls'] / 1000))
+        shards = sorted((self.root / 'sitemaps').iterdir())
+        self.assertEqual(len(shards), result['sitemaps'])
+        urlset = gzip.decompress(shards[0].read_bytes()).decode()
+        self.assertEqual(urlset.count('<url>'), 1000)
+        naan,noid = sampledata.nr_id(1).split('/')
+        self.assertIn(
+            f"<loc>https://example.org{reverse('namespub-person', args=[naan,noid])}</loc>",
+            urlset
+        )
+        self.assertIn('<lastmod>', urlset)
+        index = (self.root / 'sitemap.xml').read_text()
+        self.assertIn('https://example.org/sitemaps/sitemap-00001.xml.gz', index)
+        with override_settings(SITEMAP_DIR=str(self.root)):
+            response = self.client.get(reverse('namespub-sitemap'))
+            self.assertEqual(b''.join(response.streaming_content).decode(), index)
+            response = self.client.get(
+                reverse('namespub-sitemap-shard', args=['sitemap-99999.xml.gz'])
+            )
+            self.assertEqual(response.status_code, 404)
+
+    def test_robots(self):
+        response = self.client.get(reverse('namespub-robots'))
+        self.assertContains(response, 'Sitemap: https://')
+        self.assertContains(response, 'Disallow: /search/')
+
+
+class TestBatchMatch(TestCase):
+    CSV = (
+        'id,family_name,given_name,birth_year,camp\n'
+        'a1,Tanaka,,1920,7-manzanar\n'
+        'a2,Takeda,,,\n'
+        'a3,,,,\n'
+        'a4,Zzzzqx,,,\n'
+    )
+
+    def test_read_rows(self):
+        rows = batchmatch.read_rows(self.CSV)
+        self.assertEqual(rows[0], {
+            'id': 'a1', 'name': 'Tanaka', 'birth_year': '1920', 'camp': '7-manzanar',
+        })
+        rows = batchmatch.read_rows('{"name": "Mary Tanaka", "year_of_birth": 1922}\n')
+        self.assertEqual(rows[0]['name'], 'Mary Tanaka')
+        self.assertEqual(rows[0]['birth_year'], '1922')
+        with self.assertRaises(batchmatch.InputError):
+            batchmatch.read_rows('{"name": "Tanaka"}\n{bad')
+        with override_settings(BATCHMATCH_MAX_ROWS=2):
+            with self.assertRaises(batchmatch.InputError):
+                batchmatch.read_rows(self.CSV)
+
+    def test_match(self):
+        rows = batchmatch.read_rows(self.CSV)
+        with mock.patch.object(
+            memstore.Elasticsearch, 'msearch', autospec=True,
+            side_effect=memstore.Elasticsearch.msearch,
+        ) as msearch:
+            results = list(batchmatch.match(rows, batch_size=2, concurrency=2))
+        # one msearch per batch
+        self.assertEqual(msearch.call_count, 2)
+        self.assertEqual([result['row'] for result in results], [0, 1, 2, 3])
+        self.assertTrue(all(
+            'tanaka' in match['preferred_name'].lower()
+            for match in results[0]['matches']['person']
+        ))
+        self.assertTrue(results[1]['matches']['wrarecord'])
+        self.assertEqual(results[2]['error'], 'No name')
+        self.assertFalse(any(results[3]['matches'].values()))
+        # resume
+        results = list(batchmatch.match(rows, start=3))
+        self.assertEqual([result['row'] for result in results], [3])
+
+    @override_settings(BATCHMATCH_BATCH_SIZE=2, BATCHMATCH_CONCURRENCY=1)
+    def test_batch_failed(self):
+        rows = batchmatch.read_rows(self.CSV)
+        execute_multisearch = models.execute_multisearch
+        gates = []
+        def execute(searches, request=None, gate='search'):
+            gates.append(gate)
+            if len(gates) == 1:
+                raise admission.Overloaded(gate, 'timeout')
+            return execute_multisearch(searches, request, gate)
+        with mock.patch.object(models, 'execute_multisearch', side_effect=execute):
+            lines = [json.loads(line) for line in batchmatch.stream(rows)]
+        self.assertEqual(gates, ['batch', 'batch'])
+        self.assertEqual([line.get('row') for line in lines[:4]], [0, 1, 2, 3])
+        self.assertEqual(lines[0]['error'], 'batch gate: timeout')
+        self.assertEqual(lines[1]['error'], 'batch gate: timeout')
+        self.assertNotIn('error', lines[3])
+        # matching went on after the failed batch, and the stream has a summary
+        self.assertEqual(lines[-1]['summary']['errors'], 3)
+
+    def test_api(self):
+        response = self.client.post(
+            reverse('namespub-api-match') + '?start=1&progress=1',
+            self.CSV, content_type='text/csv',
+        )
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response['Content-Type'], 'application/x-ndjson')
+        lines = [
+            json.loads(line)
+            for line in b''.join(response.streaming_content).splitlines()
+        ]
+        self.assertEqual([line['row'] for line in lines[:3]], [1, 2, 3])
+        self.assertEqual(lines[-2]['progress']['done'], 4)
+        self.assertEqual(lines[-1]['summary']['matched'], 1)
+        self.assertEqual(lines[-1]['summary']['errors'], 1)
+        response = self.client.post(
+            reverse('namespub-api-match'), '{bad', content_type='application/x-ndjson'
+        )
+        self.assertEqual(response.status_code, 400)
+
+    def test_command_resume(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            path = Path(tmp) / 'names.csv'
+            path.write_text(self.CSV)
+            output = Path(tmp) / 'matches.ndjson'
+            output.write_text('{"row": 0}\n{"row": 1}\n{"row"')
+            call_command(
+                'matchnames', str(path), output=str(output), resume=True,
+                stderr=io.StringIO(),
+            )
+            rows = [json.loads(line)['row'] for line in output.read_text().splitlines()]
+            self.assertEqual(rows, [0, 1, 2, 3])
+
+
+class TestNameKeys(TestCase):
+
+    def test_keys(self):
+        for variants in [
+            ['Ota', 'Ohta', 'Oota', 'Ōta'], ['Inoue', 'Inouye'], ['Ueda', 'Uyeda'],
+            ['Sato', 'Satow', 'Satoh', 'Satou'], ['Shimbo', 'Shinbo'],
+            ['Hotta', 'Hota'], ['Tsutomu', 'Tutomu'], ['Shizue', 'Sizue'],
+            ['Shuji', 'Syuzi'], ['Chuichi', 'Tyuiti'], ['Shuzo', 'Syuzo'],
+            ['Fumiko', 'Humiko'],
+        ]:
+            self.assertEqual(len({namekeys.normalize(v) for v in variants}), 1, variants)
+        self.assertEqual(namekeys.normalize('Shuji'), 'shuji')
+        self.assertNotEqual(namekeys.normalize('Yamazaki'), namekeys.normalize('Yamasaki'))
+        self.assertEqual(namekeys.phonetic('Yamazaki'), namekeys.phonetic('Yamasaki'))
+        self.assertNotEqual(namekeys.phonetic('Sato'), namekeys.phonetic('Saito'))
+        self.assertEqual(namekeys.keys(['Satoh Yaeko', 'Satō'])[0], ['sato', 'yaeko'])
+        record = models.WraRecord.from_dict('1', {
+            'wra_record_id': '1', 'lastname': 'OHTA', 'firstname': 'Yaeko',
+        })
+        self.assertEqual(record.name_keys, ['ota', 'yaeko'])
+
+    def test_search_all_variants(self):
+        url = reverse('namespub-api-search-all')
+        response = self.client.get(
+            url, {'fulltext': 'Oota', 'mode': 'variants', 'limit': 25}
+        )
+        self.assertEqual(response.status_code, 200)
+        persons = response.json()['models']['person']
+        self.assertTrue(persons['total'])
+        self.assertNotIn('more', persons)
+        names = {o['preferred_name'].split()[-1] for o in persons['objects']}
+        self.assertEqual(names, {'Ota', 'Ohta'})
+        response = self.client.get(url, {'fulltext': '*', 'mode': 'variants'})
+        self.assertEqual(response.status_code, 400)
+        response = self.client.get(url, {'fulltext': 'ota', 'mode': 'fuzzy'})
+        self.assertEqual(response.status_code, 400)
+
+
+class TestQueryCost(TestCase):
+
+    def test_guard(self):
+        guard = querycost.guard
+        self.assertEqual(guard('tanaka AND "paul tanaka"'), 'tanaka AND "paul tanaka"')
+        # rewrites
+        self.assertEqual(guard('naka AND yaeko~2'), 'naka AND yaeko~1')
+        self.assertEqual(guard('tanaka~'), 'tanaka~1')
+        self.assertEqual(guard('**'), '*')
+        self.assertEqual(guard('tan* -"ms x" birth_year:[1900 TO 1920]'),
+                         'tan* -"ms x" birth_year:[1900 TO 1920]')
+        # rejects
+        for text in [
+            '*naka', '?anaka', 'ta*', 't?naka', '/ta.*a/', 'AND',
+            ' OR '.join(['tanaka'] * (settings.QUERY_MAX_CLAUSES + 1)),
+            ' OR '.join(['tanak*'] * 11),
+            'x' * (settings.QUERY_MAX_LENGTH + 1),
+        ]:
+            with self.assertRaises(querycost.QueryCostError, msg=text):
+                guard(text)
+        result = querycost.analyze('tan* OR sato~2')
+        self.assertEqual(result['clauses'], 2)
+        self.assertEqual(result['cost'], 10 + 1 + 10)
+        self.assertEqual(len(result['rewrites']), 1)
+
+    def test_views(self):
+        response = self.client.get(reverse('namespub-api-search'), {'fulltext': '*naka'})
+        self.assertEqual(response.status_code, 400)
+        self.assertIn("can't start with", response.json()['detail'])
+        for url in [
+            reverse('namespub-api-search'), reverse('namespub-api-persons'),
+            reverse('namespub-api-search-all'),
+        ]:
+            response = self.client.get(url, {'fulltext': '/ta.*a/'})
+            self.assertEqual(response.status_code, 400)
+            self.assertIn('regular expressions', response.json()['detail'])
+        request = RequestFactory().get('/', {'fulltext': 'ta*'})
+        template,context,searcher = views._search_ui_prepare(request, 'person')
+        self.assertIsNone(searcher)
+        self.assertIn('wildcard', context['form'].errors['fulltext'][0])
+
+
+class TestFacets(TestCase):
+
+    def setUp(self):
+        cache.clear()
+
+    def patched(self, method):
+        return mock.patch.object(
+            memstore.Elasticsearch, method, autospec=True,
+            side_effect=getattr(memstore.Elasticsearch, method),
+        )
+
+    def test_split(self):
+        s = dsl.Search(index='namesperson').query('match', family_name='tanaka')
+        s.aggs.bucket('gender', 'terms', field='gender')
+        hits,facets_search = facets.split(s.sort('nr_id')[10:20])
+        self.assertNotIn('aggs', hits.to_dict())
+        self.assertEqual(hits.to_dict()['from'], 10)
+        self.assertEqual(facets_search.to_dict()['size'], 0)
+        self.assertNotIn('sort', facets_search.to_dict())
+        self.assertIn('gender', facets_search.to_dict()['aggs'])
+        self.assertEqual(
+            facets.cache_key(facets_search),
+            facets.cache_key(facets.split(s[0:10])[1])
+        )
+        self.assertIsNone(facets.split(dsl.Search()[0:10])[1])
+        # failed facets are not cached
+        self.assertEqual(facets.store(facets_search, {'error': 'timeout'}), {})
+        self.assertIsNone(facets.cached(facets_search))
+
+    def test_paging(self):
+        url = reverse('namespub-api-search')
+        with self.patched('msearch') as msearch, self.patched('search') as search:
+            first = self.client.get(url, {'fulltext': 'tanaka'}).json()
+            self.assertEqual(msearch.call_count, 1)
+            searches = search.call_count
+            second = self.client.get(
+                url, {'fulltext': 'tanaka', 'offset': 5, 'limit': 5}
+            ).json()
+            # facets came from the cache: one plain search for the hits
+            self.assertEqual(msearch.call_count, 1)
+            self.assertEqual(search.call_count, searches + 1)
+            self.assertNotIn('aggs', search.call_args[1]['body'])
+        self.assertEqual(first['aggregations'], second['aggregations'])
+        self.assertEqual(first['total'], second['total'])
+        self.assertEqual(first['objects'][5:10], second['objects'])
+
+    @override_settings(ROOT_URLCONF='namesdb_public.urls_async')
+    async def test_async(self):
+        url = reverse('namespub-api-search')
+        # the sync cache API would block the event loop
+        with mock.patch.object(facets, 'cached', side_effect=AssertionError), \
+             mock.patch.object(facets, 'store', side_effect=AssertionError), \
+             self.patched('msearch') as msearch:
+            first = (await self.async_client.get(url, {'fulltext': 'tanaka'})).json()
+            second = (await self.async_client.get(
+                url, {'fulltext': 'tanaka', 'offset': 5, 'limit': 5}
+            )).json()
+            self.assertEqual(msearch.call_count, 1)
+        self.assertEqual(first['aggregations'], second['aggregations'])
+
+    @override_settings(FACETS_CACHE='')
+    def test_uncached(self):
+        url = reverse('namespub-api-persons')
+        with self.patched('msearch') as msearch:
+            self.client.get(url, {'fulltext': 'tanaka'})
+            self.client.get(url, {'fulltext': 'tanaka', 'offset': 5})
+            self.assertEqual(msearch.call_count, 2)
+
+
+class TestRequestCache(TestCase):
+
+    def setUp(self):
+        cache.clear()
+
+    def test_route(self):
+        s = dsl.Search(index='namesperson').query('match', family_name='tanaka')
+        s.aggs.bucket('gender', 'terms', field='gender')
+        hits,facets_search = facets.split(s[0:10])
+        hits,facets_search = requestcache.route(hits, facets_search)
+        self.assertTrue(facets_search._params['request_cache'])
+        self.assertNotIn('request_cache', hits._params)
+        # all pages and the facets of a query go to the same shard copies
+        page2,_ = requestcache.route(facets.split(s[10:20])[0])
+        self.assertEqual(hits._params['preference'], page2._params['preference'])
+        self.assertEqual(hits._params['preference'], facets_search._params['preference'])
+        other,_ = requestcache.route(s.query('match', given_name='yaeko')[0:10])
+        self.assertNotEqual(hits._params['preference'], other._params['preference'])
+        request = mock.Mock(session=mock.Mock(session_key='abc123'))
+        with override_settings(REQUEST_CACHE_PREFERENCE='session'):
+            value = requestcache.preference(s, request)
+            self.assertNotIn('abc123', value)
+            self.assertEqual(value, requestcache.preference(s[10:20], request))
+            self.assertNotEqual(value, requestcache.fingerprint(s))
+        with override_settings(REQUEST_CACHE_PREFERENCE='', REQUEST_CACHE_ENABLED=False):
+            hits,facets_search = requestcache.route(*facets.split(s[0:10]))
+            self.assertEqual(hits._params, {})
+            self.assertEqual(facets_search._params, {})
+
+    def test_msearch_header(self):
+        with mock.patch.object(
+            memstore.Elasticsearch, 'msearch', autospec=True,
+            side_effect=memstore.Elasticsearch.msearch,
+        ) as msearch:
+            response = self.client.get(reverse('namespub-api-search'), {'fulltext': 'tanaka'})
+        self.assertEqual(response.status_code, 200)
+        hits_header,_,facets_header,_ = msearch.call_args[1]['body']
+        self.assertEqual(hits_header['preference'], facets_header['preference'])
+        self.assertTrue(facets_header['request_cache'])
+
+    def test_metrics(self):
+        es = mock.Mock()
+        es.nodes.stats.return_value = {'nodes': {
+            node: {'indices': {'request_cache': {
+                'hit_count': 30, 'miss_count': 10, 'evictions': 1,
+                'memory_size_in_bytes': 1024,
+            }}}
+            for node in ['a', 'b']
+        }}
+        totals = requestcache.add_metrics({'counters': {}, 'gauges': {}, 'histograms': {}}, es)
+        self.assertEqual(totals['counters'][('namesdb_es_request_cache_hits_total', ())], 60)
+        self.assertEqual(totals['gauges'][('namesdb_es_request_cache_hit_ratio', ())], 0.75)
+        self.assertIn('namesdb_es_request_cache_hit_ratio 0.75', metrics.render(totals))
+        es.nodes.stats.side_effect = OSError('down')
+        totals = requestcache.add_metrics({'counters': {}, 'gauges': {}, 'histograms': {}}, es)
+        self.assertEqual(totals['counters'], {})
+
+
+class TestCount(TestCase):
+
+    def setUp(self):
+        cache.clear()
+
+    def test_count(self):
+        params = {'fulltext': 'tanaka'}
+        with mock.patch.object(
+            memstore.Elasticsearch, 'search', autospec=True,
+            side_effect=memstore.Elasticsearch.search,
+        ) as search:
+            response = self.client.get(reverse('namespub-api-farrecords-count'), params)
+        self.assertEqual(response.status_code, 200)
+        body = search.call_args[1]['body']
+        self.assertEqual(body['size'], 0)
+        self.assertTrue(body['track_total_hits'])
+        self.assertNotIn('aggs', body)
+        self.assertTrue(search.call_args[1]['request_cache'])
+        listed = self.client.get(reverse('namespub-api-farrecords'), params)
+        self.assertEqual(response.json(), {'count': listed.json()['total']})
+        response = self.client.get(
+            reverse('namespub-api-persons-count'), {'fulltext': '/ta.*/'}
+        )
+        self.assertEqual(response.status_code, 400)
+
+    @override_settings(ROOT_URLCONF='namesdb_public.urls_async')
+    def test_count_async(self):
+        params = {'fulltext': 'tanaka'}
+        response = self.client.get(reverse('namespub-api-wrarecords-count'), params)
+        self.assertEqual(response.status_code, 200)
+        listed = self.client.get(reverse('namespub-api-wrarecords'), params)
+        self.assertEqual(response.json(), {'count': listed.json()['total']})
+
+    def test_exists(self):
+        object_id = _first_id('namesfarrecord')
+        url = reverse('namespub-api-farrecord', args=[object_id])
+        conditional.CACHE.clear()
+        with mock.patch.object(
+            memstore.Elasticsearch, 'get', autospec=True,
+            side_effect=memstore.Elasticsearch.get,
+        ) as get, mock.patch.object(
+            memstore.Elasticsearch, 'exists', autospec=True,
+            side_effect=memstore.Elasticsearch.exists,
+        ) as exists:
+            response = self.client.head(url)
+            self.assertEqual(response.status_code, 200)
+            # only conditional's timestamp lookup, not the record
+            self.assertEqual(get.call_count, 1)
+            self.assertEqual(get.call_args[1]['_source_includes'], ['timestamp'])
+            self.assertFalse(exists.called)
+            with override_settings(CONDITIONAL_ENABLED=False):
+                self.assertEqual(self.client.head(url).status_code, 200)
+                self.assertEqual(exists.call_count, 1)
+        self.assertEqual(response.content, b'')
+        got = self.client.get(url)
+        for header in ['Content-Type', 'ETag', 'Last-Modified', 'Cache-Control', 'Vary']:
+            self.assertEqual(response[header], got[header], header)
+        naan,noid = sampledata.nr_id(1).split('/')
+        response = self.client.head(reverse('namespub-api-person', args=[naan, noid]))
+        self.assertEqual(response.status_code, 200)
+        response = self.client.head(reverse('namespub-api-wrarecord', args=['nope']))
+        self.assertEqual(response.status_code, 404)
+        self.assertEqual(self.client.get(url).status_code, 200)
+
+
+class TestFieldValues(TestCase):
+
+    def setUp(self):
+        cache.clear()
+
+    def _get(self, model, field, **params):
+        response = self.client.get(
+            reverse('namespub-api-values', args=[model, field]), params
+        )
+        lines = b''.join(response.streaming_content).decode().splitlines()
+        return [json.loads(line) for line in lines]
+
+    @override_settings(FIELD_VALUES_PAGE_SIZE=4)
+    def test_values(self):
+        es = models.get_docstore().es
+        s = dsl.Search(using=es, index='namesperson')
+        s.aggs.bucket('years', 'terms', field='birth_year', size=10000)
+        expected = {
+            b['key']: b['doc_count']
+            for b in models.execute_dsl(s).aggregations['years']['buckets']
+        }
+        self.assertGreater(len(expected), 4)
+        with mock.patch.object(
+            memstore.Elasticsearch, 'search', autospec=True,
+            side_effect=memstore.Elasticsearch.search,
+        ) as search:
+            lines = self._get('person', 'birth_year')
+            self.assertEqual(search.call_count, math.ceil((len(expected) + 1) / 4))
+            calls = search.call_count
+            # values are cached a page at a time
+            self.assertEqual(self._get('person', 'birth_year'), lines)
+            self.assertEqual(search.call_count, calls)
+            page = cache.get(fieldvalues.cache_key('person', 'birth_year'))
+            self.assertEqual(
+                page, ([[x['value'], x['count']] for x in lines[:4]], lines[3]['value'])
+            )
+            # resuming at a page boundary is served from the cache
+            after = lines[3]['value']
+            self.assertEqual(self._get('person', 'birth_year', after=after)[:-1], lines[4:-1])
+            self.assertEqual(search.call_count, calls)
+        self.assertEqual({x['value']: x['count'] for x in lines[:-1]}, expected)
+        self.assertEqual(
+            lines[-1]['summary'], {
+                'model': 'person', 'field': 'birth_year',
+                'values': len(expected), 'complete': True,
+            }
+        )
+        # resume
+        after = lines[2]['value']
+        self.assertEqual(self._get('person', 'birth_year', after=after)[:-1], lines[3:-1])
+        cache.clear()
+        self.assertEqual(self._get('person', 'birth_year', after=after)[:-1], lines[3:-1])
+        response = self.client.get(reverse('namespub-api-values', args=['person', 'nope']))
+        self.assertEqual(response.status_code, 404)
+
+    @override_settings(FIELD_VALUES_PAGE_SIZE=2)
+    def test_field_values(self):
+        es = models.get_docstore().es
+        values = models.Person.field_values('birth_year', es, 'namesperson')
+        self.assertGreater(len(values), 2)
+        counts = [count for _,count in values]
+        self.assertEqual(counts, sorted(counts, reverse=True))
+        self.assertEqual(
+            sum(count for _,count in values), es.count(index='namesperson')['count']
+        )
+
+
+class TestYears(TestCase):
+
+    def setUp(self):
+        cache.clear()
+
+    def test_year_int(self):
+        self.assertEqual(models.year_int('1920'), 1920)
+        self.assertEqual(models.year_int(' 1920.0'), 1920)
+        self.assertIsNone(models.year_int('ca. 1920'))
+        record = models.FarRecord.from_dict('1-topaz-1', {
+            'far_record_id': '1-topaz-1', 'year_of_birth': '1920',
+        })
+        self.assertEqual(record.year_of_birth, 1920)
+        record = models.FarRecord.from_dict('1-topaz-1', {
+            'far_record_id': '1-topaz-1', 'year_of_birth': 'unknown',
+        })
+        self.assertIsNone(record.year_of_birth)
+        self.assertEqual(record.errors, ['year_of_birth:unknown'])
+
+    def test_bounds(self):
+        self.assertEqual(years.bounds({}), (None, None))
+        self.assertEqual(years.bounds({'birth_year_max': '1925'}), (None, 1925))
+        with self.assertRaises(years.RangeError):
+            years.bounds({'birth_year_min': 'x'})
+        with self.assertRaises(years.RangeError):
+            years.bounds({'birth_year_min': '1930', 'birth_year_max': '1920'})
+
+    @override_settings(YEAR_HISTOGRAM_INTERVAL=5)
+    def test_api(self):
+        url = reverse('namespub-api-persons')
+        params = {'fulltext': 'tanaka', 'birth_year_min': 1900, 'birth_year_max': 1920}
+        data = self.client.get(url, params).json()
+        self.assertTrue(data['objects'])
+        for o in data['objects']:
+            self.assertTrue(1900 <= o['birth_year'] <= 1920)
+        keys = [int(b['key']) for b in data['aggregations']['birth_year']]
+        self.assertTrue(keys)
+        self.assertTrue(all(key % 5 == 0 and 1900 <= key <= 1920 for key in keys))
+        count = self.client.get(reverse('namespub-api-persons-count'), params).json()
+        self.assertEqual(count['count'], data['total'])
+        with override_settings(YEAR_HISTOGRAM_INTERVAL=0):
+            data = self.client.get(url, params).json()
+        self.assertIn(1917, [int(b['key']) for b in data['aggregations']['birth_year']])
+        response = self.client.get(url, {'fulltext': 'tanaka', 'birth_year_min': 'x'})
+        self.assertEqual(response.status_code, 400)
+
+    def test_ui(self):
+        url = reverse('namespub-wrarecords')
+        with override_settings(YEAR_HISTOGRAM_INTERVAL=5):
+            response = self.client.get(url, {'fulltext': 'tanaka', 'birth_year_max': 1910})
+        self.assertEqual(response.status_code, 200)
+        self.assertContains(response, 'name="birth_year_min"')
+        # histogram buckets
+        self.assertRegex(response.content.decode(), r'18\d5-18\d9 \(\d+\)')
+        # until the histogram is enabled the terms facet is still offered
+        response = self.client.get(reverse('namespub-persons'), {'fulltext': 'tanaka'})
+        self.assertContains(response, 'name="birth_year"')
+        self.assertContains(response, 'name="birth_year_min"')
+        response = self.client.get(url, {'fulltext': 'tanaka', 'birth_year_max': 'x'})
+        self.assertContains(response, 'birth_year_max must be a year')
+
+
+class TestMetrics(TestCase):
+
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.settings = override_settings(
+            METRICS_ENABLED=True, METRICS_DIR=self.tmp.name,
+            METRICS_FLUSH_INTERVAL=0,
+        )
+        self.settings.enable()
+        metrics._registry = None
+
+    def tearDown(self):
+        metrics._registry = None
+        self.settings.disable()
+        self.tmp.cleanup()
+
+    def test_render(self):
+        metrics.inc('namesdb_ddr_api_errors_total')
+        metrics.observe('namesdb_view_duration_seconds', 0.02, view='namespub-person')
+        text = metrics.render()
+        self.assertIn('# TYPE namesdb_view_duration_seconds histogram', text)
+        self.assertIn(
+            'namesdb_view_duration_seconds_bucket{view="namespub-person",le="0.01"} 0',
+            text
+        )
+        self.assertIn(
+            'namesdb_view_duration_seconds_bucket{view="namespub-person",le="0.025"} 1',
+            text
+        )
+        self.assertIn('namesdb_ddr_api_errors_total 1', text)
+
+    @override_settings(DOCSTORE_BACKEND='memory')
+    def test_view_token(self):
+        url = reverse('namespub-metrics')
+        with override_settings(METRICS_TOKEN=''):
+            self.assertEqual(self.client.get(url).status_code, 404)
+        with override_settings(METRICS_TOKEN='s3cret'):
+            self.assertEqual(self.client.get(url).status_code, 401)
+            response = self.client.get(url, HTTP_AUTHORIZATION='Bearer nope')
+            self.assertEqual(response.status_code, 401)
+            response = self.client.get(url, HTTP_AUTHORIZATION='Bearer s3cret')
+            self.assertEqual(response.status_code, 200)
+
+    def test_collect_dead_worker(self):
+        # PID that cannot be running
+        dead = Path(self.tmp.name) / 'metrics-999999999.json'
+        dead.write_text(json.dumps({
+            'pid': 999999999,
+            'counters': [['namesdb_ddr_api_errors_total', [], 2]],
+            'gauges': [['namesdb_requests_in_flight', [], 5]],
+            'histograms': [],
+        }))
+        metrics.inc('namesdb_ddr_api_errors_total')
+        totals = metrics.collect()
+        key = ('namesdb_ddr_api_errors_total', ())
+        self.assertEqual(totals['counters'][key], 3)
+        self.assertNotIn(('namesdb_requests_in_flight', ()), totals['gauges'])
+        self.assertFalse(dead.exists())
+        # archived counters are still counted on the next scrape
+        self.assertEqual(metrics.collect()['counters'][key], 3)
+
+
+    def test_in_flight_flushed(self):
+        seen = []
+        def view(request):
+            data = json.loads(metrics._get_registry().path.read_text())
+            seen.extend(
+                value for name,_,value in data['gauges']
+                if name == 'namesdb_requests_in_flight'
+            )
+            return HttpResponse('ok')
+        middleware.MetricsMiddleware(view)(RequestFactory().get('/'))
+        self.assertEqual(seen, [1])
+
+
+class TestSlowlog(TestCase):
+
+    def test_log_search(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            path = os.path.join(tmp, 'slow.ndjson')
+            with override_settings(
+                    SLOWLOG_ENABLED=True, SLOWLOG_PATH=path,
+                    SLOWLOG_THRESHOLD=100, SLOWLOG_PROFILE_THRESHOLD=0,
+            ):
+                slowlog._handler = None
+                s = dsl.Search(index='namesperson').query(
+                    'query_string', query='*a*'
+                )
+                self.assertIsNone(slowlog.log_search(s, 99, 10, 25, 0))
+                record_id = slowlog.log_search(s, 2500, 10, 25, 50)
+                slowlog._handler.close()
+                slowlog._handler = None
+            with open(path, 'r') as f:
+                lines = f.readlines()
+        self.assertEqual(len(lines), 1)
+        record = json.loads(lines[0])
+        self.assertEqual(record['id'], record_id)
+        self.assertEqual(record['index'], 'namesperson')
+        self.assertEqual(record['took'], 2500)
+        self.assertEqual(record['body']['from'], 50)
+        self.assertEqual(record['body']['query']['query_string']['query'], '*a*')
+
+    def test_reopens_rotated(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            path = os.path.join(tmp, 'slow.ndjson')
+            with override_settings(SLOWLOG_PATH=path):
+                slowlog._handler = None
+                slowlog.write({'id': 'a'})
+                # logrotate moves the file out from under every worker
+                os.rename(path, path + '.1')
+                slowlog.write({'id': 'b'})
+                slowlog._handler.close()
+                slowlog._handler = None
+            with open(path + '.1', 'r') as f:
+                rotated = [json.loads(line)['id'] for line in f]
+            with open(path, 'r') as f:
+                current = [json.loads(line)['id'] for line in f]
+        self.assertEqual(rotated, ['a'])
+        self.assertEqual(current, ['b'])
@@ -1,40 +1,69 @@
 from django.urls import include, path, re_path
-from drf_yasg import views as yasg_views
-from drf_yasg import openapi
-from rest_framework import permissions
+from django.views.decorators.csrf import csrf_exempt
 
 from . import api
 from . import views
 
 
-schema_view = yasg_views.get_schema_view(
-   openapi.Info(
-      title="Densho Digital Repository API",
-      default_version='0.2',
-      description='"namesdb" is the new app; "names" is the old one',
-      terms_of_service="http://ddr.densho.org/terms/",
-      contact=openapi.Contact(email="info@densho.org"),
-      #license=openapi.License(name="TBD"),
-   ),
-   #validators=['flex', 'ssv'],
-   public=True,
-   permission_classes=(permissions.AllowAny,),
-)
+_schema_view = None
+
+def lazy_schema_view(method, *args, **kwargs):
+    """drf_yasg schema view that is built on first request
+    
+    Importing drf_yasg and building the schema view takes longer than loading
+    the rest of the URLconf, and only the API docs pages need it.
+    
+    @param method: str 'with_ui' or 'without_ui'
+    @returns: view function
+    """
+    view = None
+    @csrf_exempt
+    def lazy_view(request, *view_args, **view_kwargs):
+        nonlocal view
+        if view is None:
+            view = getattr(schema_view(), method)(*args, **kwargs)
+        return view(request, *view_args, **view_kwargs)
+    return lazy_view
+
+def schema_view():
+    global _schema_view
+    if _schema_view is None:
+        from drf_yasg import views as yasg_views
+        from drf_yasg import openapi
+        from rest_framework import permissions
+        _schema_view = yasg_views.get_schema_view(
+           openapi.Info(
+              title="Densho Digital Repository API",
+              default_version='0.2',
+              description='"namesdb" is the new app; "names" is the old one',
+              terms_of_service="http://ddr.densho.org/terms/",
+              contact=openapi.Contact(email="info@densho.org"),
+              #license=openapi.License(name="TBD"),
+           ),
+           #validators=['flex', 'ssv'],
+           public=True,
+           permission_classes=(permissions.AllowAny,),
+        )
+    return _schema_view
 
 urlpatterns = [
     path('api/swagger.json',
-         schema_view.without_ui(cache_timeout=0), name='schema-json'
+         lazy_schema_view('without_ui', cache_timeout=0), name='schema-json'
     ),
     path('api/swagger.yaml',
-         schema_view.without_ui(cache_timeout=0), name='schema-yaml'
+         lazy_schema_view('without_ui', cache_timeout=0), name='schema-yaml'
     ),
     path('api/swagger/',
-         schema_view.with_ui('swagger', cache_timeout=0), name='schema-swagger-ui'
+         lazy_schema_view('with_ui', 'swagger', cache_timeout=0), name='schema-swagger-ui'
     ),
     path('api/redoc/',
-         schema_view.with_ui('redoc', cache_timeout=0), name='schema-redoc'
+         lazy_schema_view('with_ui', 'redoc', cache_timeout=0), name='schema-redoc'
     ),
     
+    # before the detail patterns, which would take "count" as an ID
+    path('api/1.0/persons/count/', api.persons_count, name='namespub-api-persons-count'),
+    path('api/1.0/farrecords/count/', api.farrecords_count, name='namespub-api-farrecords-count'),
+    path('api/1.0/wrarecords/count/', api.wrarecords_count, name='namespub-api-wrarecords-count'),
     re_path(
         r'^api/1.0/persons/(?P<naan>[0-9a-zA-Z_:-]+)/(?P<noid>[0-9a-zA-Z_:-]+)',
         api.person, name='namespub-api-person'
@@ -56,6 +85,13 @@ urlpatterns = [
     ),
     path('api/1.0/farpages/', api.farpages, name='namespub-api-farpages'),
     path('api/1.0/search/', api.Search.as_view(), name='namespub-api-search'),
+    path('api/1.0/search/all/', api.search_all, name='namespub-api-search-all'),
+    path('api/1.0/autocomplete/', api.autocomplete, name='namespub-api-autocomplete'),
+    path('api/1.0/match/', api.match, name='namespub-api-match'),
+    path(
+        'api/1.0/values/<str:model>/<str:field>/',
+        api.values, name='namespub-api-values'
+    ),
     path('api/1.0/', api.index, name='namespub-api-index'),
     
     path('search/', views.search_ui, name='namespub-search'),
@@ -79,5 +115,12 @@ urlpatterns = [
         views.farpage, name='namespub-farpage'
     ),
     path('farpages/', views.farpages, name='namespub-farpages'),
+    path('metrics', views.prometheus_metrics, name='namespub-metrics'),
+    path('robots.txt', views.robots_txt, name='namespub-robots'),
+    path('sitemap.xml', views.sitemap_index, name='namespub-sitemap'),
+    re_path(
+        r'^sitemaps/(?P<name>sitemap-[0-9]+\.xml\.gz)$',
+        views.sitemap_shard, name='namespub-sitemap-shard'
+    ),
     path('', views.index, name='namespub-index'),
 ]
@@ -0,0 +1,38 @@
+"""URLconf for the ASGI application (see namessite/asgi.py)
+
+Same URLs as urls.py with async versions of the I/O-bound views.  Views
+without an async version run in a thread as usual.
+"""
+from django.urls import URLPattern
+
+from . import api
+from . import urls
+from . import views
+
+ASYNC_VIEWS = {
+    'namespub-api-persons': api.persons_async,
+    'namespub-api-farrecords': api.farrecords_async,
+    'namespub-api-wrarecords': api.wrarecords_async,
+    'namespub-api-persons-count': api.persons_count_async,
+    'namespub-api-farrecords-count': api.farrecords_count_async,
+    'namespub-api-wrarecords-count': api.wrarecords_count_async,
+    'namespub-api-search': api.search_async,
+    'namespub-api-search-all': api.search_all_async,
+    'namespub-search': views.search_ui_async,
+    'namespub-person': views.person_async,
+    'namespub-persons': views.persons_async,
+    'namespub-farrecords': views.farrecords_async,
+    'namespub-wrarecords': views.wrarecords_async,
+    'namespub-farpage': views.farpage_async,
+}
+
+
+def _async_pattern(pattern):
+    if pattern.name in ASYNC_VIEWS:
+        return URLPattern(
+            pattern.pattern, ASYNC_VIEWS[pattern.name],
+            pattern.default_args, pattern.name
+        )
+    return pattern
+
+urlpatterns = [_async_pattern(pattern) for pattern in urls.urlpatterns]
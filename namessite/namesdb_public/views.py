@@ -1,19 +1,27 @@
+import asyncio
+import hmac
 import json
 from urllib.parse import urlparse, urlunparse
 
 from django.conf import settings
 from django.core.paginator import Paginator
+from django.http import FileResponse, Http404, HttpResponse
 from django.http.request import HttpRequest
 from django.shortcuts import render
 from django.urls import reverse
 from django.views.decorators.http import require_http_methods
 
-from elastictools import docstore
 from elastictools import search
 
 from . import forms
+from . import metrics
 from . import models
+from . import querycost
+from . import requestcache
 from . import api
+from . import conditional
+from . import sitemap
+from . import years
 
 PAGE_SIZE = 20
 CONTEXT = 3
@@ -41,6 +49,16 @@ def farrecords(request, template_name='namesdb_public/farrecords.html'):
 def wrarecords(request, template_name='namesdb_public/wrarecords.html'):
     return search_ui(request, 'wrarecord')
 
+async def persons_async(request):
+    return await search_ui_async(request, 'person')
+
+async def farrecords_async(request):
+    return await search_ui_async(request, 'farrecord')
+
+async def wrarecords_async(request):
+    return await search_ui_async(request, 'wrarecord')
+
+@conditional.record('person')
 def person(request, naan, noid, template_name='namesdb_public/person.html'):
     nr_id = '/'.join([naan, noid])
     ddrobjects_ui_url,ddrobjects_api_url,ddrobjects_status,ddrobjects = models.Person.ddr_objects(nr_id, request)
@@ -55,12 +73,35 @@ def person(request, naan, noid, template_name='namesdb_public/person.html'):
         'api_url': reverse('namespub-api-person', args=[naan,noid]),
     })
 
+@conditional.record('person')
+async def person_async(request, naan, noid, template_name='namesdb_public/person.html'):
+    """Async version of person; fetches record, locations, and DDR objects concurrently"""
+    nr_id = '/'.join([naan, noid])
+    record,locations,ddr = await asyncio.gather(
+        models.Person.aget(nr_id, request),
+        models.Person.alocations(nr_id, request),
+        models.Person.addr_objects(nr_id, request),
+    )
+    ddrobjects_ui_url,ddrobjects_api_url,ddrobjects_status,ddrobjects = ddr
+    return render(request, template_name, {
+        'display_fields_person': models.DISPLAY_FIELDS_PERSON,
+        'record': record,
+        'locations': locations,
+        'ddrobjects_ui_url': ddrobjects_ui_url,
+        'ddrobjects_api_url': ddrobjects_api_url,
+        'ddrobjects_status': ddrobjects_status,
+        'ddrobjects': ddrobjects,
+        'api_url': reverse('namespub-api-person', args=[naan,noid]),
+    })
+
+@conditional.record('farrecord')
 def farrecord(request, object_id, template_name='namesdb_public/farrecord.html'):
     return render(request, template_name, {
         'record': models.FarRecord.get(object_id, request),
         'api_url': reverse('namespub-api-farrecord', args=[object_id]),
     })
 
+@conditional.record('wrarecord')
 def wrarecord(request, object_id, template_name='namesdb_public/wrarecord.html'):
     return render(request, template_name, {
         'record': models.WraRecord.get(object_id, request),
@@ -72,6 +113,7 @@ def farpages(request, template_name='namesdb_public/farpages.html'):
         'facilities': models.FarPage.facilities(),
     })
 
+@conditional.farpage()
 def farpage(request, facility_id, far_page, template_name='namesdb_public/farpage.html'):
     farpage = models.FarPage.get(facility_id, far_page, request)
     farrecords = models.FarPage.farrecords(facility_id, far_page, request)
@@ -83,7 +125,41 @@ def farpage(request, facility_id, far_page, template_name='namesdb_public/farpag
         'api_url': reverse('namespub-api-farpage', args=[facility_id, far_page]),
     })
 
+@conditional.farpage()
+async def farpage_async(request, facility_id, far_page, template_name='namesdb_public/farpage.html'):
+    """Async version of farpage"""
+    farpage,farrecords = await asyncio.gather(
+        models.FarPage.aget(facility_id, far_page, request),
+        models.FarPage.afarrecords(facility_id, far_page, request),
+    )
+    return render(request, template_name, {
+        'farpage': farpage,
+        'farpage_prev': int(far_page) - 1,
+        'farpage_next': int(far_page) + 1,
+        'farrecords': farrecords,
+        'api_url': reverse('namespub-api-farpage', args=[facility_id, far_page]),
+    })
+
 def search_ui(request, model=None):
+    template,context,searcher = _search_ui_prepare(request, model)
+    if searcher:
+        limit,offset = _limit_offset(request)
+        results = models.execute_search(searcher, limit, offset, request)
+        _search_ui_results(request, context, results)
+    return render(request, template, context)
+
+async def search_ui_async(request, model=None):
+    """Async version of search_ui"""
+    template,context,searcher = _search_ui_prepare(request, model)
+    if searcher:
+        limit,offset = _limit_offset(request)
+        results = await models.aexecute_search(searcher, limit, offset, request)
+        _search_ui_results(request, context, results)
+    return render(request, template, context)
+
+def _search_ui_prepare(request, model):
+    """Template, context, and prepared Searcher (None if not searching)
+    """
     template = 'namesdb_public/search.html'
     if model == 'person':
         template = 'namesdb_public/person-search.html'
@@ -115,63 +191,106 @@ def search_ui(request, model=None):
         'api_url': api_url,
     }
     
-    if request.GET.get('fulltext'):
-        context['searching'] = True
-        
-        params=request.GET.copy()
-        searcher = search.Searcher(
-            docstore.Docstore(
-                models.INDEX_PREFIX, settings.DOCSTORE_HOST, settings
-            )
-        )
-        searcher.prepare(
-            params=params,
-            params_whitelist=['fulltext'] + params_allowlist,
-            search_models=search_models,
-            sort=[],
-            fields=search_include_fields,
-            fields_nested=[],
-            fields_agg=agg_fields,
-            #highlight_fields=highlight_fields,
-            wildcards=False,
-        )
-        # filter on denormalized values for birth_date and PersonFacility
-        # TODO integrate into elastictools.search.prepare or hard-code
-        if model == 'person':
-            if 'birth_year' in params.keys():
-                searcher.s = searcher.s.filter(
-                    'term', **{'birth_year': params['birth_year']}
-                )
-            if 'facility_id' in params.keys():
-                searcher.s = searcher.s.filter(
-                    'term', **{'facility_id': params['facility_id']}
-                )
-        limit,offset = _limit_offset(request)
-        results = searcher.execute(limit, offset)
-        paginator = Paginator(
-            results.ordered_dict(
-                request=request,
-                format_functions=models.FORMATTERS,
-                pad=True,
-            )['objects'],
-            results.page_size,
-        )
-        page = paginator.page(results.this_page)
-        
-        form = forms.SearchForm(
-            data=request.GET.copy(),
-            search_results=results,
-        )
-        
-        context['results'] = results
-        context['paginator'] = paginator
-        context['page'] = page
+    if not request.GET.get('fulltext'):
+        context['form'] = forms.SearchForm()
+        return template,context,None
+    
+    try:
+        params = querycost.guard_params(request.GET.copy(), request)
+        years.bounds(params)
+    except (querycost.QueryCostError, years.RangeError) as err:
+        form = forms.SearchForm(data=request.GET.copy())
+        form.is_valid()
+        field = 'fulltext'
+        if isinstance(err, years.RangeError):
+            field = years.PARAM_MIN
+        form.add_error(field, str(err))
         context['form'] = form
+        return template,context,None
+    
+    context['searching'] = True
+    searcher = search.Searcher(models.get_docstore())
+    searcher.prepare(
+        params=params,
+        params_whitelist=['fulltext'] + params_allowlist,
+        search_models=search_models,
+        sort=[],
+        fields=search_include_fields,
+        fields_nested=[],
+        fields_agg=agg_fields,
+        #highlight_fields=highlight_fields,
+        wildcards=False,
+    )
+    searcher.s = years.prepare(searcher.s, params)
+    # filter on denormalized values for PersonFacility
+    # TODO integrate into elastictools.search.prepare or hard-code
+    if model == 'person':
+        if 'facility_id' in params.keys():
+            searcher.s = searcher.s.filter(
+                'term', **{'facility_id': params['facility_id']}
+            )
+    return template,context,searcher
 
-    else:
-        context['form'] = forms.SearchForm()
+def _search_ui_results(request, context, results):
+    """Add paginated results and the search form to context
+    """
+    paginator = Paginator(
+        results.ordered_dict(
+            request=request,
+            format_functions=models.FORMATTERS,
+            pad=True,
+        )['objects'],
+        results.page_size,
+    )
+    page = paginator.page(results.this_page)
+    
+    form = forms.SearchForm(
+        data=request.GET.copy(),
+        search_results=results,
+    )
+    
+    context['results'] = results
+    context['paginator'] = paginator
+    context['page'] = page
+    context['form'] = form
 
-    return render(request, template, context)
+def prometheus_metrics(request):
+    """Metrics summed across all workers, in Prometheus text format
+
+    Only for scrapers that send settings.METRICS_TOKEN as a bearer token
+    (Prometheus: `authorization: {credentials: ...}`); without a token the
+    endpoint is off.
+    """
+    if not (metrics.enabled() and settings.METRICS_TOKEN):
+        raise Http404
+    scheme,_,token = request.headers.get('Authorization', '').partition(' ')
+    if scheme.lower() != 'bearer' \
+    or not hmac.compare_digest(token.strip(), settings.METRICS_TOKEN):
+        response = HttpResponse('Unauthorized', status=401, content_type='text/plain')
+        response['WWW-Authenticate'] = 'Bearer'
+        return response
+    totals = requestcache.add_metrics(metrics.collect(), models.get_docstore().es)
+    return HttpResponse(metrics.render(totals), content_type=metrics.CONTENT_TYPE)
+
+def sitemap_index(request):
+    """Sitemap index written by manage.py sitemaps (nginx normally serves it)
+    """
+    return _sitemap_file(sitemap.INDEX, 'application/xml')
+
+def sitemap_shard(request, name):
+    return _sitemap_file(f'{sitemap.SHARDS_DIR}/{name}', 'application/gzip')
+
+def _sitemap_file(name, content_type):
+    if not settings.SITEMAP_DIR:
+        raise Http404
+    try:
+        f = open(f'{settings.SITEMAP_DIR}/{name}', 'rb')
+    except FileNotFoundError:
+        raise Http404
+    return FileResponse(f, content_type=content_type)
+
+def robots_txt(request):
+    return HttpResponse(sitemap.robots_txt(), content_type='text/plain')
 
 def internal_url(request, path, query=None):
     """Internal version of reversed URL
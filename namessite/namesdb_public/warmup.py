@@ -0,0 +1,294 @@
+"""Warm caches before a worker starts serving
+
+After a deploy the first requests find the Elasticsearch filesystem and
+request caches, and the app's own caches and lazily loaded modules, cold.
+This replays the most requested records and searches through the same
+fetch functions the views use.
+
+Targets come from access logs (settings.WARMUP_ACCESS_LOG) and/or a list
+of URL paths, one per line (settings.WARMUP_LIST).  Paths are classified
+by resolving them against the URLconf, so UI and API URLs for the same
+record count together.
+
+    python manage.py warmup --access-log /var/log/nginx/access.log --top 200
+
+To warm each gunicorn worker before it accepts connections, call
+warmup.when_ready and warmup.post_fork from the gunicorn config (see
+conf/gunicorn.conf.py) and set [warmup] enabled=1.  The arbiter reads the
+access logs once and the workers it forks inherit the targets.  Gunicorn
+kills a worker that has not checked in for `timeout` seconds and post_fork
+runs before the first check-in, so each worker stops warming after at most
+half of that (see budget).
+"""
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+import logging
+logger = logging.getLogger(__name__)
+import os
+import threading
+import time
+
+from django.conf import settings
+from django.http import QueryDict
+from django.test import RequestFactory
+from django.urls import Resolver404, get_resolver, resolve
+
+from . import accesslog
+
+# Targets read by when_ready in the gunicorn arbiter, inherited by workers
+_targets = None
+
+RECORD_VIEWS = {
+    'namespub-person': 'person',
+    'namespub-api-person': 'person',
+    'namespub-farrecord': 'farrecord',
+    'namespub-api-farrecord': 'farrecord',
+    'namespub-wrarecord': 'wrarecord',
+    'namespub-api-wrarecord': 'wrarecord',
+}
+SEARCH_VIEWS = {
+    'namespub-persons': 'person',
+    'namespub-api-persons': 'person',
+    'namespub-farrecords': 'farrecord',
+    'namespub-api-farrecords': 'farrecord',
+    'namespub-wrarecords': 'wrarecord',
+    'namespub-api-wrarecords': 'wrarecord',
+    'namespub-search': 'person',
+    'namespub-api-search': 'person',
+}
+# Query args that select a page rather than a different search
+PAGING_ARGS = ['page', 'offset', 'limit']
+
+
+def classify(path, query=''):
+    """Map a URL to a warmup target
+
+    @param path: str URL path
+    @param query: str Query string
+    @returns: ('record', model, object_id) or ('search', model, query) or None
+    """
+    try:
+        match = resolve(path)
+    except Resolver404:
+        return None
+    if match.url_name in RECORD_VIEWS:
+        kwargs = match.kwargs
+        if 'naan' in kwargs:
+            object_id = f"{kwargs['naan']}/{kwargs['noid']}"
+        else:
+            object_id = kwargs['object_id']
+        return ('record', RECORD_VIEWS[match.url_name], object_id)
+    if match.url_name in SEARCH_VIEWS:
+        params = QueryDict(query, mutable=True)
+        for arg in PAGING_ARGS:
+            params.pop(arg, None)
+        if not params:
+            return None
+        return ('search', SEARCH_VIEWS[match.url_name], params.urlencode())
+    return None
+
+def from_paths(paths):
+    """Count targets in a list of URLs (path and optional query)
+    """
+    counts = Counter()
+    for url in paths:
+        path,_,query = url.partition('?')
+        if target := classify(path, query):
+            counts[target] += 1
+    return counts
+
+def from_access_log(paths):
+    """Count targets in access logs
+    """
+    return from_paths(
+        f"{entry['url_path']}?{entry['path'].partition('?')[2]}"
+        for entry in accesslog.entries(paths)
+    )
+
+def from_list(path):
+    """Targets from a file of URLs, one per line (# comments allowed)
+    """
+    with open(path, 'r') as f:
+        return from_paths(
+            line.strip() for line in f
+            if line.strip() and not line.startswith('#')
+        )
+
+def plan(counts, top):
+    """Most frequent TOP targets of each kind, most frequent first
+
+    @param counts: Counter of targets
+    @param top: int
+    @returns: list of targets
+    """
+    targets = []
+    for kind in ['person', 'farrecord', 'wrarecord']:
+        targets += [t for t,_ in counts.most_common() if t[:2] == ('record', kind)][:top]
+    targets += [t for t,_ in counts.most_common() if t[0] == 'search'][:top]
+    # most requested first, so a timeout skips the least useful
+    return sorted(targets, key=lambda t: -counts[t])
+
+
+# api, models, and formchoices are imported inside functions because
+# gunicorn imports this module before Django is set up.
+
+def fetch(target, rf):
+    """Run the fetches a view would make for a target
+    """
+    from . import api
+    from . import models
+    kind,model,value = target
+    if kind == 'record':
+        request = rf.get('/')
+        if model == 'person':
+            models.Person.get(value, request)
+            models.Person.locations(value, request)
+        elif model == 'farrecord':
+            models.FarRecord.get(value, request)
+        elif model == 'wrarecord':
+            models.WraRecord.get(value, request)
+    elif kind == 'search':
+        request = rf.get(f'/?{value}')
+        api.model_objects(request, model)
+
+def site_host():
+    """The site's first configured host
+    """
+    return next(
+        (h.lstrip('.') for h in settings.ALLOWED_HOSTS if h != '*'),
+        'localhost'
+    )
+
+def request_factory():
+    """RequestFactory for the site's first configured host
+    """
+    return RequestFactory(HTTP_HOST=site_host())
+
+def run(targets, concurrency=None, timeout=None):
+    """Fetch targets concurrently until done or TIMEOUT seconds have passed
+
+    Also loads the URLconf and form choices so the first request does not.
+
+    @param targets: list (see plan)
+    @param concurrency: int Threads (default settings.WARMUP_CONCURRENCY)
+    @param timeout: float Seconds (default settings.WARMUP_TIMEOUT)
+    @returns: dict {'targets', 'ok', 'errors', 'skipped', 'seconds'}
+    """
+    from . import formchoices
+    concurrency = concurrency or settings.WARMUP_CONCURRENCY
+    if timeout is None:
+        timeout = settings.WARMUP_TIMEOUT
+    start = time.perf_counter()
+    deadline = start + timeout
+    get_resolver().url_patterns
+    formchoices.choices()
+    rf = request_factory()
+    ok = errors = 0
+    pending = set()
+    remaining = list(targets)
+    executor = ThreadPoolExecutor(max_workers=concurrency)
+    while (remaining or pending) and time.perf_counter() < deadline:
+        while remaining and len(pending) < concurrency:
+            pending.add(executor.submit(fetch, remaining.pop(0), rf))
+        done,pending = wait(
+            pending, timeout=max(0, deadline - time.perf_counter()),
+            return_when=FIRST_COMPLETED,
+        )
+        for future in done:
+            if future.exception():
+                errors += 1
+                logger.debug(f'warmup: {future.exception()}')
+            else:
+                ok += 1
+    # don't wait for fetches still running at the deadline
+    executor.shutdown(wait=False, cancel_futures=True)
+    return {
+        'targets': len(targets),
+        'ok': ok,
+        'errors': errors,
+        'skipped': len(targets) - ok - errors,
+        'seconds': time.perf_counter() - start,
+    }
+
+def configured_targets(access_logs=None, url_list=None, top=None):
+    """Targets from the given or configured access logs and URL list
+    """
+    access_logs = access_logs or [
+        path.strip()
+        for path in settings.WARMUP_ACCESS_LOG.split(',') if path.strip()
+    ]
+    url_list = url_list or settings.WARMUP_LIST
+    counts = Counter()
+    if access_logs:
+        counts.update(from_access_log(access_logs))
+    if url_list:
+        counts.update(from_list(url_list))
+    if not counts:
+        return []
+    return plan(counts, top or settings.WARMUP_TOP)
+
+def _setup():
+    os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'namessite.settings')
+    import django
+    django.setup()
+
+def when_ready(server):
+    """Gunicorn when_ready hook: read the targets once, before any worker forks
+    """
+    global _targets
+    _setup()
+    if not settings.WARMUP_ENABLED:
+        return
+    try:
+        _targets = configured_targets()
+    except Exception as err:
+        server.log.warning(f'Warmup targets not read: {err}')
+        _targets = []
+        return
+    server.log.info(f'Warmup: {len(_targets)} targets')
+
+def budget(server):
+    """Seconds a worker may spend warming up
+
+    settings.WARMUP_TIMEOUT, but no more than half the gunicorn timeout
+    (0 disables gunicorn's timeout).
+    """
+    timeout = settings.WARMUP_TIMEOUT
+    if server.cfg.timeout:
+        timeout = min(timeout, server.cfg.timeout / 2)
+    return timeout
+
+def post_fork(server, worker):
+    """Gunicorn post_fork hook: warm up before the worker accepts requests
+
+    Everything, including reading the targets if when_ready did not, runs in
+    a thread that the worker stops waiting for after budget() seconds.
+    """
+    _setup()
+    if not settings.WARMUP_ENABLED:
+        return
+    timeout = budget(server)
+    start = time.perf_counter()
+    outcome = {}
+
+    def warm():
+        try:
+            targets = _targets if _targets is not None else configured_targets()
+            elapsed = time.perf_counter() - start
+            outcome['result'] = run(targets, timeout=max(0, timeout - elapsed))
+        except Exception as err:
+            outcome['error'] = err
+
+    thread = threading.Thread(target=warm, daemon=True)
+    thread.start()
+    thread.join(timeout)
+    if 'error' in outcome:
+        server.log.warning(f"Worker {worker.pid} warmup failed: {outcome['error']}")
+    elif 'result' not in outcome:
+        server.log.warning(f'Worker {worker.pid} warmup gave up after {timeout:.1f}s')
+    else:
+        result = outcome['result']
+        server.log.info(
+            f"Worker {worker.pid} warmed {result['ok']}/{result['targets']} "
+            f"({result['errors']} errors) in {result['seconds']:.1f}s"
+        )
@@ -0,0 +1,106 @@
+"""Birth year range filters and histogram facets
+
+Birth years (models.YEAR_FIELDS: Person.birth_year, FarRecord.year_of_birth,
+WraRecord.birthyear) are integer fields, with a .keyword sub-field for exact
+string matches.  Searches of one model take
+
+    birth_year_min, birth_year_max    range filter on the model's year field
+                                      (either end may be left out)
+
+and, if settings.YEAR_HISTOGRAM_INTERVAL is set, their year facet is a
+histogram of INTERVAL-year buckets instead of one terms bucket per year.
+The interval defaults to 0 (the terms facet) because histograms need
+numeric fields; set it once indices created before the fields were
+integers have been recreated (range filters work on both).
+
+    >>> bounds({'birth_year_min': '1915', 'birth_year_max': '1925'})
+    (1915, 1925)
+"""
+from django.conf import settings
+
+from . import models
+
+PARAM_MIN = 'birth_year_min'
+PARAM_MAX = 'birth_year_max'
+
+
+class RangeError(ValueError):
+    pass
+
+
+def field(s):
+    """Year field of the model a Search is on, or None
+
+    @param s: elasticsearch_dsl.Search
+    @returns: str or None
+    """
+    indices = s._index or []
+    if len(indices) != 1:
+        return None
+    return models.YEAR_FIELDS.get(indices[0][len(models.INDEX_PREFIX):])
+
+def bounds(params):
+    """Lowest and highest birth year in PARAMS
+
+    @param params: dict or QueryDict
+    @returns: (int or None, int or None)
+    @raises: RangeError if a bound is not a year or min > max
+    """
+    values = []
+    for param in [PARAM_MIN, PARAM_MAX]:
+        value = params.get(param)
+        if value in [None, '']:
+            values.append(None)
+            continue
+        year = models.year_int(value)
+        if year is None:
+            raise RangeError(f'{param} must be a year, not "{value}"')
+        values.append(year)
+    low,high = values
+    if low is not None and high is not None and low > high:
+        raise RangeError(f'{PARAM_MIN} ({low}) is after {PARAM_MAX} ({high})')
+    return low,high
+
+def prepare(s, params):
+    """Add the birth year range filter and histogram facet to a Search
+
+    The histogram replaces the terms aggregation on the year field, if S
+    has aggregations at all.
+
+    @param s: elasticsearch_dsl.Search
+    @param params: dict or QueryDict
+    @returns: elasticsearch_dsl.Search
+    @raises: RangeError
+    """
+    year_field = field(s)
+    low,high = bounds(params)
+    if year_field is None:
+        return s
+    if low is not None or high is not None:
+        limits = {}
+        if low is not None:
+            limits['gte'] = low
+        if high is not None:
+            limits['lte'] = high
+        s = s.filter('range', **{year_field: limits})
+    if settings.YEAR_HISTOGRAM_INTERVAL and s.aggs.to_dict():
+        s.aggs.bucket(
+            year_field, 'histogram', field=year_field,
+            interval=settings.YEAR_HISTOGRAM_INTERVAL, min_doc_count=1,
+        )
+    return s
+
+def buckets(aggregations, year_field):
+    """Histogram buckets of search results as (first year, last year, count)
+
+    @param aggregations: dict SearchResults.aggregations
+    @param year_field: str
+    @returns: list
+    """
+    interval = settings.YEAR_HISTOGRAM_INTERVAL
+    if not interval:
+        return []
+    return [
+        (int(float(b['key'])), int(float(b['key'])) + interval - 1, int(b['doc_count']))
+        for b in aggregations.get(year_field, [])
+    ]
@@ -0,0 +1,28 @@
+"""
+ASGI config for namessite project.
+
+It exposes the ASGI callable as a module-level variable named ``application``.
+Requests are routed with namesdb_public.urls_async, which serves async
+versions of the search and detail views.  The WSGI application
+(namessite/wsgi.py) is unchanged.
+
+    uvicorn namessite.asgi:application --workers 4
+
+For more information on this file, see
+https://docs.djangoproject.com/en/4.1/howto/deployment/asgi/
+"""
+
+import os
+
+from django.core.asgi import get_asgi_application
+from django.core.handlers.asgi import ASGIRequest
+
+os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'namessite.settings')
+
+application = get_asgi_application()
+
+
+class Request(ASGIRequest):
+    urlconf = 'namesdb_public.urls_async'
+
+application.request_class = Request
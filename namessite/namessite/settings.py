@@ -40,9 +40,214 @@ DOCSTORE_USERNAME = 'elastic'
 DOCSTORE_PASSWORD = config.get('database', 'docstore_password')
 _docstore_clusters = config.get('database', 'docstore_clusters')
 DOCSTORE_CLUSTER = docstore.cluster(_docstore_clusters, DOCSTORE_HOST)
+DOCSTORE_ENABLED = config.getboolean('database', 'docstore_enabled', fallback=True)
+# 'elasticsearch' or 'memory' (in-process stand-in with synthetic data,
+# for tests, benchmarks, and development without a cluster)
+DOCSTORE_BACKEND = config.get('database', 'docstore_backend', fallback='elasticsearch')
+DOCSTORE_MEMORY_PERSONS = config.getint('database', 'docstore_memory_persons', fallback=1000)
+DOCSTORE_MEMORY_SEED = config.getint('database', 'docstore_memory_seed', fallback=0)
+# NDJSON file of {_index,_id,_source} docs to load instead of synthetic data
+DOCSTORE_MEMORY_FIXTURES = config.get('database', 'docstore_memory_fixtures', fallback='')
+
+# DDR API (DDR objects linked to Persons)
+DDR_UI_URL = config.get('ddr', 'ui_url', fallback='https://ddr.densho.org')
+DDR_API_URL = config.get('ddr', 'api_url', fallback='https://ddr.densho.org')
+DDR_API_USERNAME = config.get('ddr', 'api_username', fallback='')
+DDR_API_PASSWORD = config.get('ddr', 'api_password', fallback='')
+DDR_API_TIMEOUT = config.getfloat('ddr', 'api_timeout', fallback=5)
 
 RESULTS_PER_PAGE = 25
 
+# Metrics
+# Each worker writes its metrics to a file in METRICS_DIR every
+# METRICS_FLUSH_INTERVAL seconds; /metrics sums them.  /metrics answers only
+# requests with "Authorization: Bearer METRICS_TOKEN" (no token: 404).
+METRICS_ENABLED = config.getboolean('metrics', 'enabled', fallback=False)
+METRICS_DIR = config.get('metrics', 'dir', fallback='/tmp/namesdbpublic-metrics')
+METRICS_FLUSH_INTERVAL = config.getfloat('metrics', 'flush_interval', fallback=1.0)
+METRICS_TOKEN = config.get('metrics', 'token', fallback='')
+
+# Slow query log
+# Searches slower than SLOWLOG_THRESHOLD ms are logged to SLOWLOG_PATH (NDJSON).
+# Searches slower than SLOWLOG_PROFILE_THRESHOLD ms (0=never) are re-run
+# once with the Elasticsearch profile API and the output logged as well.
+SLOWLOG_ENABLED = config.getboolean('slowlog', 'enabled', fallback=False)
+SLOWLOG_PATH = config.get('slowlog', 'path', fallback='/var/log/ddr/namesdbpublic-slow.ndjson')
+SLOWLOG_THRESHOLD = config.getint('slowlog', 'threshold', fallback=1000)
+SLOWLOG_PROFILE_THRESHOLD = config.getint('slowlog', 'profile_threshold', fallback=0)
+
+# Fulltext query cost guard (see namesdb_public/querycost.py)
+# query_string input is parsed and its cost estimated before it is sent;
+# fuzziness is capped, and queries with regexes, leading wildcards, short
+# wildcard prefixes, too many clauses, or a cost over
+# QUERY_COST_BUDGET are rejected with an explanation.
+QUERY_COST_BUDGET = config.getint('querycost', 'budget', fallback=100)
+QUERY_MAX_CLAUSES = config.getint('querycost', 'max_clauses', fallback=32)
+QUERY_MAX_LENGTH = config.getint('querycost', 'max_length', fallback=500)
+QUERY_MIN_WILDCARD_PREFIX = config.getint('querycost', 'min_wildcard_prefix', fallback=3)
+QUERY_MAX_FUZZINESS = config.getint('querycost', 'max_fuzziness', fallback=1)
+
+# Search facets (see namesdb_public/facets.py)
+# Aggregations are fetched apart from hits and kept in the FACETS_CACHE
+# Django cache ('' disables) for FACETS_CACHE_TTL seconds, so paging through
+# results only runs the hits query.
+FACETS_CACHE = config.get('facets', 'cache', fallback='default')
+FACETS_CACHE_TTL = config.getint('facets', 'cache_ttl', fallback=600)
+
+# Elasticsearch shard request cache and shard copy routing (see
+# namesdb_public/requestcache.py).  Facet (size 0) searches are sent with
+# request_cache=true; REQUEST_CACHE_PREFERENCE 'query' sends every search for
+# the same query to the same shard copies, 'session' those of the same
+# session (falling back to 'query'), '' lets Elasticsearch choose.
+REQUEST_CACHE_ENABLED = config.getboolean('requestcache', 'enabled', fallback=True)
+REQUEST_CACHE_PREFERENCE = config.get('requestcache', 'preference', fallback='query')
+
+# Facet field values (see namesdb_public/fieldvalues.py)
+# All values of a field are read FIELD_VALUES_PAGE_SIZE at a time with a
+# composite aggregation; each page is kept in the FIELD_VALUES_CACHE Django
+# cache ('' disables) for FIELD_VALUES_CACHE_TTL seconds, so page_size also
+# bounds the size of a cache entry (memcached's limit is 1 MB).
+FIELD_VALUES_PAGE_SIZE = config.getint('fieldvalues', 'page_size', fallback=1000)
+FIELD_VALUES_CACHE = config.get('fieldvalues', 'cache', fallback='default')
+FIELD_VALUES_CACHE_TTL = config.getint('fieldvalues', 'cache_ttl', fallback=3600)
+
+# Birth year facets (see namesdb_public/years.py)
+# Histogram bucket width in years; 0 keeps one terms bucket per year.
+# Histograms need the integer year fields, so leave this at 0 until the
+# indices have been recreated, then set e.g. 5.
+YEAR_HISTOGRAM_INTERVAL = config.getint('years', 'histogram_interval', fallback=0)
+
+# Search form choice lists (facilities etc)
+# Loaded on first use and reloaded in the background every FORMS_CHOICES_TTL
+# seconds; failed loads are retried after FORMS_CHOICES_RETRY seconds.
+# The last good load is kept in FORMS_CHOICES_SNAPSHOT for new workers.
+FORMS_CHOICES_TTL = config.getint('forms', 'choices_ttl', fallback=3600)
+FORMS_CHOICES_RETRY = config.getint('forms', 'choices_retry', fallback=60)
+FORMS_CHOICES_SNAPSHOT = config.get('forms', 'choices_snapshot', fallback='/tmp/namesdbpublic-choices.json')
+
+# Cache warmup (manage.py warmup, gunicorn post_fork hook)
+# Targets are the WARMUP_TOP most requested records of each type and searches
+# in WARMUP_ACCESS_LOG (comma-separated paths) and/or WARMUP_LIST (URLs, one
+# per line).  Workers give up warming after WARMUP_TIMEOUT seconds, or half the
+# gunicorn timeout if that is shorter.
+WARMUP_ENABLED = config.getboolean('warmup', 'enabled', fallback=False)
+WARMUP_ACCESS_LOG = config.get('warmup', 'access_log', fallback='')
+WARMUP_LIST = config.get('warmup', 'list', fallback='')
+WARMUP_TOP = config.getint('warmup', 'top', fallback=100)
+WARMUP_CONCURRENCY = config.getint('warmup', 'concurrency', fallback=8)
+WARMUP_TIMEOUT = config.getfloat('warmup', 'timeout', fallback=60)
+
+# Admission control (see namesdb_public/admission.py)
+# Concurrent Elasticsearch lookups, searches, and batch match msearches per
+# worker process, and per host (0=no host limit; slot files in ADMISSION_LOCK_DIR).  Calls wait up to
+# ADMISSION_TIMEOUT seconds, at most ADMISSION_QUEUE of them per process,
+# then the request gets 503 with Retry-After: ADMISSION_RETRY_AFTER.
+ADMISSION_ENABLED = config.getboolean('admission', 'enabled', fallback=False)
+ADMISSION_LOOKUP_CONCURRENCY = config.getint('admission', 'lookup_concurrency', fallback=16)
+ADMISSION_SEARCH_CONCURRENCY = config.getint('admission', 'search_concurrency', fallback=4)
+ADMISSION_BATCH_CONCURRENCY = config.getint('admission', 'batch_concurrency', fallback=4)
+ADMISSION_HOST_LOOKUP_CONCURRENCY = config.getint('admission', 'host_lookup_concurrency', fallback=0)
+ADMISSION_HOST_SEARCH_CONCURRENCY = config.getint('admission', 'host_search_concurrency', fallback=0)
+ADMISSION_HOST_BATCH_CONCURRENCY = config.getint('admission', 'host_batch_concurrency', fallback=0)
+ADMISSION_QUEUE = config.getint('admission', 'queue', fallback=32)
+ADMISSION_TIMEOUT = config.getfloat('admission', 'timeout', fallback=2.0)
+ADMISSION_RETRY_AFTER = config.getint('admission', 'retry_after', fallback=5)
+ADMISSION_LOCK_DIR = config.get('admission', 'lock_dir', fallback='/tmp/namesdbpublic-admission')
+
+# Per-client rate limits: token buckets of RATELIMIT_BURST requests refilled
+# at RATELIMIT_RATE per second, per worker process.  Clients are keyed by IP
+# or by a known API key sent in the RATELIMIT_API_KEY_HEADER header.  With
+# RATELIMIT_FORWARDED_FOR the IP is the X-Forwarded-For address added by the
+# outermost of RATELIMIT_TRUSTED_PROXIES proxies (the Nth entry from the right;
+# entries left of it are sent by the client and can be spoofed).
+RATELIMIT_ENABLED = config.getboolean('ratelimit', 'enabled', fallback=False)
+RATELIMIT_RATE = config.getfloat('ratelimit', 'rate', fallback=5.0)
+RATELIMIT_BURST = config.getint('ratelimit', 'burst', fallback=20)
+RATELIMIT_FORWARDED_FOR = config.getboolean('ratelimit', 'forwarded_for', fallback=False)
+RATELIMIT_TRUSTED_PROXIES = config.getint('ratelimit', 'trusted_proxies', fallback=1)
+RATELIMIT_API_KEY_HEADER = config.get('ratelimit', 'api_key_header', fallback='X-Api-Key')
+RATELIMIT_API_KEYS = [
+    key.strip()
+    for key in config.get('ratelimit', 'api_keys', fallback='').split(',')
+    if key.strip()
+]
+RATELIMIT_API_KEY_RATE = config.getfloat('ratelimit', 'api_key_rate', fallback=20.0)
+
+# Coalesce identical concurrent Elasticsearch calls into one (see
+# namesdb_public/coalesce.py).  With COALESCE_SHARED_CACHE set to the alias of
+# a cache shared by all workers, calls are also coalesced across workers:
+# other workers wait up to COALESCE_WAIT seconds for the first one's result.
+COALESCE_ENABLED = config.getboolean('coalesce', 'enabled', fallback=True)
+COALESCE_SHARED_CACHE = config.get('coalesce', 'shared_cache', fallback='')
+COALESCE_WAIT = config.getfloat('coalesce', 'wait', fallback=5.0)
+COALESCE_RESULT_TTL = config.getint('coalesce', 'result_ttl', fallback=10)
+
+# Conditional GET (ETag/Last-Modified/304) for record pages and API (see
+# namesdb_public/conditional.py).  Set CONDITIONAL_GENERATION to the time of
+# the last reindex (ISO datetime); blank uses the code's modification time.
+# Record validators are cached per process for CONDITIONAL_VALIDATOR_TTL s.
+CONDITIONAL_ENABLED = config.getboolean('conditional', 'enabled', fallback=True)
+CONDITIONAL_GENERATION = config.get('conditional', 'generation', fallback='')
+CONDITIONAL_VALIDATOR_TTL = config.getint('conditional', 'validator_ttl', fallback=60)
+# Cache-Control max-age for browsers and s-maxage for nginx/CDN caches
+CONDITIONAL_MAX_AGE = config.getint('conditional', 'max_age', fallback=300)
+CONDITIONAL_S_MAXAGE = config.getint('conditional', 's_maxage', fallback=3600)
+CONDITIONAL_FARPAGE_MAX_AGE = config.getint('conditional', 'farpage_max_age', fallback=86400)
+
+# Response compression (brotli if installed, gzip) (see
+# namesdb_public/compression.py).  Public, cacheable responses are kept in the
+# COMPRESSION_CACHE Django cache ('' disables) already compressed, at the
+# higher COMPRESSION_CACHE_* levels, for up to COMPRESSION_CACHE_TTL seconds.
+COMPRESSION_ENABLED = config.getboolean('compression', 'enabled', fallback=True)
+COMPRESSION_MIN_SIZE = config.getint('compression', 'min_size', fallback=200)
+COMPRESSION_GZIP_LEVEL = config.getint('compression', 'gzip_level', fallback=6)
+COMPRESSION_BROTLI_QUALITY = config.getint('compression', 'brotli_quality', fallback=4)
+COMPRESSION_CACHE = config.get('compression', 'cache', fallback='default')
+COMPRESSION_CACHE_TTL = config.getint('compression', 'cache_ttl', fallback=300)
+COMPRESSION_CACHE_GZIP_LEVEL = config.getint('compression', 'cache_gzip_level', fallback=9)
+COMPRESSION_CACHE_BROTLI_QUALITY = config.getint('compression', 'cache_brotli_quality', fallback=11)
+
+# Static export of record pages (see namesdb_public/staticexport.py)
+STATIC_EXPORT_DIR = config.get('staticexport', 'dir', fallback='')
+STATIC_EXPORT_CONCURRENCY = config.getint('staticexport', 'concurrency', fallback=8)
+STATIC_EXPORT_KEEP = config.getint('staticexport', 'keep', fallback=2)
+STATIC_EXPORT_GZIP = config.getboolean('staticexport', 'gzip', fallback=True)
+
+# Sitemaps (see namesdb_public/sitemap.py)
+SITEMAP_DIR = config.get('sitemap', 'dir', fallback='')
+SITEMAP_BASE_URL = config.get('sitemap', 'base_url', fallback='')
+SITEMAP_SHARD_SIZE = config.getint('sitemap', 'shard_size', fallback=50000)
+
+# Name autocomplete API (see namesdb_public/autocomplete.py)
+AUTOCOMPLETE_MIN_LENGTH = config.getint('autocomplete', 'min_length', fallback=2)
+AUTOCOMPLETE_LIMIT = config.getint('autocomplete', 'limit', fallback=10)
+AUTOCOMPLETE_CACHE_SIZE = config.getint('autocomplete', 'cache_size', fallback=5000)
+AUTOCOMPLETE_CACHE_TTL = config.getint('autocomplete', 'cache_ttl', fallback=600)
+AUTOCOMPLETE_MAX_AGE = config.getint('autocomplete', 'max_age', fallback=300)
+
+# Batch name matching (see namesdb_public/batchmatch.py)
+BATCHMATCH_BATCH_SIZE = config.getint('batchmatch', 'batch_size', fallback=50)
+BATCHMATCH_CONCURRENCY = config.getint('batchmatch', 'concurrency', fallback=4)
+BATCHMATCH_MATCHES = config.getint('batchmatch', 'matches', fallback=3)
+BATCHMATCH_MAX_ROWS = config.getint('batchmatch', 'max_rows', fallback=10000)
+
+CACHES = {
+    'default': {
+        'BACKEND': config.get(
+            'cache', 'backend',
+            fallback='django.core.cache.backends.locmem.LocMemCache'
+        ),
+        'LOCATION': config.get('cache', 'location', fallback=''),
+    },
+    # per-process, see AUTOCOMPLETE_*
+    'autocomplete': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        'LOCATION': 'autocomplete',
+        'TIMEOUT': AUTOCOMPLETE_CACHE_TTL,
+        'OPTIONS': {'MAX_ENTRIES': AUTOCOMPLETE_CACHE_SIZE},
+    },
+}
+
 INSTALLED_APPS = [
     #'django.contrib.admin',
     'django.contrib.auth',
@@ -59,6 +264,9 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    'namesdb_public.middleware.MetricsMiddleware',
+    'namesdb_public.middleware.AdmissionMiddleware',
+    'namesdb_public.middleware.CompressionMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',